@@ -0,0 +1,209 @@
+"""
+    benchmark.py - Performance Benchmarks File
+
+    last update : 15/05/2024
+"""
+
+#  region @ Libraries
+
+from utils import *
+from protocol_27 import send_file_data, TRANSFER_STATS, scan_directory
+from protocol import c_frame_codec, COMPRESSION_METHODS, FRAME_MODE_BINARY, DIR_PAGE_SIZE
+
+import threading
+import tempfile
+import json
+import socket
+import time
+import os
+
+#  endregion
+
+
+#  region @ Constants
+
+BENCHMARK_SIZES: tuple = (64 * 1024, 1024 * 1024, 8 * 1024 * 1024)  # Payload sizes in bytes
+BENCHMARK_KEY: str = "6XK4CVGUYBOS2JSZVPLS9H2TMSSE8DI5"                # Same length as a registered key
+BENCHMARK_FILE_SIZE: int = 64 * 1024 * 1024                             # Transfer benchmark file size
+
+#  endregion
+
+
+#  region @ Benchmark Utils
+
+def measure(function, *args, repeat: int = 3) -> float:
+    """
+        Run function few times.
+
+        Return the best time in seconds
+    """
+
+    best = None
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def megabytes_per_second(size: int, seconds: float) -> float:
+    """
+        Convert bytes and time into MB/s
+    """
+
+    if seconds <= 0:
+        return float("inf")
+
+    return size / (1024 * 1024) / seconds
+
+#  endregion
+
+
+#  region @ Encryption Benchmark
+
+def xor_loop(key: bytes, message: bytes) -> bytes:
+    """
+        Original byte by byte XOR loop, kept as reference
+    """
+
+    encrypted_bytes = []
+
+    for i in range(len(message)):
+        encrypted_bytes.append(message[i] ^ key[i % len(key)])
+
+    return bytes(encrypted_bytes)
+
+
+def benchmark_encryption():
+    """
+        Compare the byte loop against c_encryption in MB/s
+    """
+
+    encryption = c_encryption(BENCHMARK_KEY)
+    key = BENCHMARK_KEY.encode()
+
+    print("XOR encryption (MB/s)")
+    print(f"  {'size':>10} {'loop':>10} {'c_encryption':>14} {'speedup':>9}")
+
+    for size in BENCHMARK_SIZES:
+        message = os.urandom(size)
+
+        # Both must give the same output
+        if xor_loop(key, message) != encryption.encrypt(message):
+            raise Exception("Encryption output mismatch")
+
+        loop_speed = megabytes_per_second(size, measure(xor_loop, key, message, repeat=1))
+        fast_speed = megabytes_per_second(size, measure(encryption.encrypt, message))
+
+        print(f"  {size:>10} {loop_speed:>10.1f} {fast_speed:>14.1f} {fast_speed / loop_speed:>8.0f}x")
+
+#  endregion
+
+
+#  region @ Transfer Benchmark
+
+def drain_socket(socket_obj: socket):
+    """
+        Read everything until the other side closes
+    """
+
+    buffer = bytearray(1024 * 1024)
+
+    while socket_obj.recv_into(buffer):
+        pass
+
+
+def benchmark_transfer():
+    """
+        Compare sendfile against the chunked encrypted path in MB/s
+    """
+
+    with tempfile.NamedTemporaryFile(delete=False) as file:
+        file.write(os.urandom(BENCHMARK_FILE_SIZE))
+        file_name = file.name
+
+    try:
+
+        for data in ({}, {"key": BENCHMARK_KEY}):
+            sender, receiver = socket.socketpair()
+
+            drain_thread = threading.Thread(target=drain_socket, args=(receiver,))
+            drain_thread.start()
+
+            with open(file_name, 'rb') as file:
+                send_file_data(sender, file, BENCHMARK_FILE_SIZE, data)
+
+            sender.close()
+            drain_thread.join()
+            receiver.close()
+
+    finally:
+        os.remove(file_name)
+
+    print("File transfer (MB/s)")
+
+    stats = TRANSFER_STATS.get()
+    for mode in stats:
+        print(f"  {mode:>10} {stats[mode]['mb_per_second']:>10.1f}")
+
+#  endregion
+
+
+#  region @ Compression Benchmark
+
+def benchmark_compression():
+    """
+        Compression ratio and speed of every method on a directory listing page.
+
+        Break-even is the link speed below which the saved bytes
+        take longer to send than compressing and decompressing them
+    """
+
+    entries = []
+    for entry in scan_directory(os.path.dirname(os.__file__), recursive=True):
+        entries.append(entry)
+
+        if len(entries) >= DIR_PAGE_SIZE:
+            break
+
+    value = json.dumps(entries).encode()
+
+    print(f"Frame compression, {len(value)} bytes directory page")
+    print(f"  {'method':>10} {'ratio':>8} {'compress':>10} {'decompress':>11} {'break-even':>14}")
+
+    for method in COMPRESSION_METHODS:
+        codec = c_frame_codec(FRAME_MODE_BINARY, method)
+
+        compressed, flags = codec.compress(value)
+        compress_time = measure(codec.compress, value)
+        decompress_time = measure(c_frame_codec.decompress, compressed, method)
+
+        if c_frame_codec.decompress(compressed, method) != value:
+            raise Exception("Compression output mismatch")
+
+        saved = len(value) - len(compressed)
+        break_even = megabytes_per_second(saved, compress_time + decompress_time)
+
+        print(f"  {method:>10} {len(compressed) / len(value):>8.3f} "
+              f"{megabytes_per_second(len(value), compress_time):>10.1f} "
+              f"{megabytes_per_second(len(value), decompress_time):>11.1f} "
+              f"{break_even:>9.1f} MB/s")
+
+#  endregion
+
+
+# Entry Point
+
+def main():
+    benchmark_encryption()
+    benchmark_transfer()
+    benchmark_compression()
+
+
+if __name__ == "__main__":
+    main()
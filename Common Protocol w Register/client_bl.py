@@ -8,8 +8,14 @@
 
 from protocol_manager import *
 
+from concurrent.futures import Future
+from collections import deque
+
+import itertools
 import json
+import zlib
 import threading
+import time
 import os.path
 import socket
 
@@ -20,17 +26,58 @@ import socket
 
 class c_client_bl:
 
-    def __init__(self, ip: str, port: int):
+    def __init__(self, ip: str, port: int, framing: str = FRAME_MODE_BINARY,
+                 chunk_size: int = TRANSFER_CHUNK_SIZE, adaptive_chunks: bool = False,
+                 photo_store: str = None, compression: any = None):
 
         # Client information
         self._client_info: dict = {
             "ip": ip,
-            "port": port
+            "port": port,
+
+            # Text frames until the server agrees on other mode
+            "codec": c_frame_codec(),
+
+            # File transfer chunk size settings
+            "tuner": c_transfer_tuner(chunk_size, adaptive_chunks)
         }
 
+        # Frame mode we want to use
+        self._framing: str = framing
+
+        # Compression methods we offer by preference (binary frames only), None for no compression
+        self._compression: list = [compression] if type(compression) == str else list(compression or [])
+
         # client socket object
         self._socket_obj: socket = None
 
+        # Buffered frame reader for the socket
+        self._reader: c_frame_reader = None
+
+        # Requests in flight, by request id (binary frames) or by order (text frames).
+        # Each one is (future, deadline), deadline None waits forever
+        self._requests: dict = {}
+        self._requests_order: deque = deque()
+        self._requests_lock = threading.Lock()
+        self._request_ids = itertools.count(1)
+
+        # Many threads can send, frames must not mix
+        self._send_lock = threading.Lock()
+
+        # Received directory listing entries, by request id until the page ends
+        self._dir_pages: dict = {}
+
+        # Rebuilt screens of the running screen streams, by stream id
+        self._screens: dict = {}
+
+        # Received photos by content, None to always receive the whole photo.
+        # Note ! Opt-in, the store keeps a copy of every received photo (see PHOTO_STORE_FOLDER)
+        self._photo_store_folder: str = photo_store
+        self._photo_store = None
+
+        # Requests of offers asked again after the photo changed, they are not asked a third time
+        self._photo_offer_retries: set = set()
+
         # Protocol manager
         self._protocols = c_protocol_manager()
 
@@ -67,6 +114,10 @@ class c_client_bl:
         self._events["disconnect"] = c_event()
         self._events["receive"] = c_event()
         self._events["login"] = c_event()
+        self._events["execute"] = c_event()
+        self._events["dir"] = c_event()
+        self._events["copy"] = c_event()
+        self._events["screen"] = c_event()
 
     def __setup_file(self):
         """
@@ -98,21 +149,63 @@ class c_client_bl:
             self._socket_obj = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self._socket_obj.connect((self._client_info["ip"], self._client_info["port"]))
 
+            self._reader = c_frame_reader(self._socket_obj, self._client_info["codec"])
+
             # Log the data
             write_to_log(f"  Client        - {self._socket_obj.getsockname()} connected")
 
+            # Agree on frame mode before anything else is sent
+            self.__negotiate_framing()
+
             return True  # Return on success
 
         except Exception as e:
 
             # Handle fail
             self._socket_obj = None
+            self._reader = None
 
             write_to_log(f"  Client        - Failed to start the connection.\nexception:{e}")
             self._last_error = f"Error in client_bl.py :\nexception:\n{e}"
 
             return False
 
+    def __negotiate_framing(self):
+        """
+            Ask the server to switch the frame mode.
+
+            Servers that do not answer keep the text frames
+        """
+
+        if self._framing == FRAME_MODE_TEXT:
+            return
+
+        # Request is sent in text frames, the compression methods follow the mode
+        request = self._protocols.create_request(FRAMING_CMD, ",".join([self._framing] + self._compression), self._client_info)
+        self._socket_obj.send(request)
+
+        # Wait for the answer, still in text frames
+        self._reader.set_timeout(2)
+        result, raw_message = self._reader.read_frame()
+        self._reader.set_timeout(READER_TIMEOUT)
+
+        if not result:
+            write_to_log(f"  Client        - server did not answer framing request, using text frames")
+            return
+
+        _, arguments = c_protocol.parse(raw_message)
+        mode = c_protocol_manager.select_frame_mode(arguments)
+
+        # Old servers answer only the mode
+        compression = c_protocol_manager.select_compression(mode, arguments)
+        if compression not in self._compression:
+            compression = None
+
+        # Switch
+        self._client_info["codec"] = c_frame_codec(mode, compression)
+        self._reader.codec = self._client_info["codec"]
+        write_to_log(f"  Client        - using {mode} frames, compression : {compression}")
+
     def stop_connection(self) -> bool:
         """
             Close connection and inform the server
@@ -155,20 +248,20 @@ class c_client_bl:
             Send message to the server
         """
 
+        arguments = self.__offer_arguments(cmd, arguments)
+
         try:
 
             # Create request message
-            message: str = self._protocols.create_request(cmd, arguments, self._client_info)
+            message: bytes = self._protocols.create_request(cmd, arguments, self._client_info)
 
             # Check if valid
             if message is None:
                 raise Exception(self._protocols("last_error"))
 
-            # Encode message
-            encoded: bytes = message.encode()
-
             # Send
-            self._socket_obj.send(encoded)
+            with self._send_lock:
+                self._socket_obj.sendall(message)
 
             # Log the message
             write_to_log(f"  Client        - send to server : {message}")
@@ -184,6 +277,182 @@ class c_client_bl:
 
             return False  # Return on fail
 
+    def request(self, cmd: str, arguments: str, timeout: float = REQUEST_TIMEOUT) -> Future:
+        """
+            Send request to the server without waiting for the response.
+
+            Return future of the response message, so many requests can be in flight.
+            Binary frames match the responses by request id, text frames by order.
+            The future fails with TimeoutError if the response does not arrive in timeout seconds
+        """
+
+        future = Future()
+        deadline = time.monotonic() + timeout if timeout else None
+
+        arguments = self.__offer_arguments(cmd, arguments)
+
+        try:
+
+            with self._send_lock:
+
+                # Tag the request, the server tags the response with the same id
+                data = self._client_info
+                request_id = None
+
+                if self._client_info["codec"].mode == FRAME_MODE_BINARY:
+                    request_id = next(self._request_ids) % REQUEST_ID_LIMIT
+                    data = dict(self._client_info, request_id=request_id)
+
+                # Create request message
+                message: bytes = self._protocols.create_request(cmd, arguments, data)
+
+                # Check if valid
+                if message is None:
+                    raise Exception(self._protocols("last_error"))
+
+                # Register before sending, the response can arrive before send() returns
+                with self._requests_lock:
+                    if request_id is None:
+                        self._requests_order.append((future, deadline))
+                    else:
+                        self._requests[request_id] = (future, deadline)
+
+                self._socket_obj.sendall(message)
+
+            # Log the message
+            write_to_log(f"  Client        - send to server : {message}")
+
+        except Exception as e:
+
+            # Handle fail
+            write_to_log(f"  Client        - Failed to send request to server.\nexception:{e}")
+            self._last_error = f"Error in client_bl.py :\nexception:\n{e}"
+
+            if not future.done():
+                future.set_exception(e)
+
+        return future
+
+    def list_dir(self, path: str, recursive: bool = False, cursor: int = 0, page_size: int = DIR_PAGE_SIZE) -> Future:
+        """
+            Request one page of the directory listing.
+
+            Return future of {"entries": [[name, type, size, mtime], ...], "cursor": next cursor},
+            next cursor is -1 after the last page.
+            Entries are also passed to the "dir" event as they arrive
+        """
+
+        mode = DIR_MODE_WALK if recursive else DIR_MODE_SCAN
+
+        return self.request("DIR", f"{path},{mode},{cursor},{page_size}")
+
+    def request_photo_parallel(self, file_name: str, new_file_name: str, streams: int = PHOTO_PARALLEL_STREAMS) -> Future:
+        """
+            Request photo over several data connections, for high latency links.
+            Small files are sent on this connection as usual
+
+            Return future of the photo status
+        """
+
+        return self.request("SEND_PHOTO", f"{file_name},{new_file_name},{PHOTO_MODE_PARALLEL},{streams}")
+
+    def start_screen_stream(self, fps: float = 10, bandwidth: float = 0, level: int = 1) -> Future:
+        """
+            Start watching the server screen.
+
+            bandwidth : KB per second, 0 for no limit
+
+            Return future of the started message (SCREEN_STARTED>stream,width,height,tile size).
+            Every frame is passed to the "screen" event, its frame is None when nothing changed
+        """
+
+        return self.request("SCREEN_STREAM", f"{fps},{bandwidth},{level}")
+
+    def stop_screen_stream(self, stream_id: int) -> Future:
+
+        return self.request("SCREEN_STOP", str(stream_id))
+
+    def __offer_arguments(self, cmd: str, arguments: str) -> str:
+        """
+            Ask for photo content offer instead of the data,
+            photos the store already has are not sent again
+        """
+
+        if cmd == "SEND_PHOTO" and self._photo_store_folder is not None and arguments and len(arguments.split(",")) == 2:
+            return f"{arguments},{PHOTO_MODE_OFFER}"
+
+        return arguments
+
+    def __complete_request(self, request_id: int, value: any):
+        """
+            Resolve the future of the request this response belongs to
+        """
+
+        future = self.__pop_request(request_id)
+
+        if future is not None and not future.done():
+            future.set_result(value)
+
+    def __pop_request(self, request_id: int) -> Future:
+        """
+            Remove and return the future of the request this response belongs to
+        """
+
+        with self._requests_lock:
+
+            request = None
+
+            if request_id is not None:
+                request = self._requests.pop(request_id, None)
+
+            elif self._client_info["codec"].mode == FRAME_MODE_TEXT and self._requests_order:
+                request = self._requests_order.popleft()
+
+        return request[0] if request is not None else None
+
+    def __fail_requests(self, reason: str):
+        """
+            Fail every request still in flight
+        """
+
+        with self._requests_lock:
+
+            requests = list(self._requests.values()) + list(self._requests_order)
+
+            self._requests.clear()
+            self._requests_order.clear()
+
+        for future, _ in requests:
+            if not future.done():
+                future.set_exception(ConnectionError(reason))
+
+    def __expire_requests(self):
+        """
+            Fail requests whose response did not arrive in time.
+
+            Text frames are matched by order, once a response is missing
+            the later ones can not be matched, so every text request is failed
+            and the next requests start a new order
+        """
+
+        now = time.monotonic()
+
+        def is_expired(request: tuple) -> bool:
+            return request[1] is not None and request[1] < now
+
+        with self._requests_lock:
+
+            expired = [request_id for request_id, request in self._requests.items() if is_expired(request)]
+            requests = [self._requests.pop(request_id) for request_id in expired]
+
+            if any(is_expired(request) for request in self._requests_order):
+                requests.extend(self._requests_order)
+                self._requests_order.clear()
+
+        for future, _ in requests:
+            if not future.done():
+                future.set_exception(TimeoutError("no response from the server"))
+
     def __receive_message(self) -> any:
         """
             Call and receive the first message in buffer
@@ -192,29 +461,73 @@ class c_client_bl:
         try:
 
             # Try to pop something from buffer
-            result, raw_message = c_protocol.get_raw_from_buffer(self._socket_obj)
+            result, raw_message, request_id = self._reader.read_message()
 
             # Check if valid
             if not result:
                 return None
 
             # Decrypt if can
-            message = c_encryption(self._client_info).decrypt(raw_message).decode()
+            message = c_protocol.decrypt_value(raw_message, self._client_info)
 
             # Parse into command and arguments (if possible)
             command, arguments = c_protocol.parse(message)
 
             # Check if it's related to log in Process
-            if command == self._protocols("database")("register_header"):
-                return self.__handle_login(arguments)
+            if command == REGISTER_INFO_MSG:
+                result = self.__handle_login(arguments)
+
+                # Key is saved, the next requests can use it
+                self.__complete_request(request_id, message)
+                return result
+
+            # Check if it's streamed execute job information, not an answer to any request
+            if command == EXECUTE_OUTPUT_MSG or command == EXECUTE_EXIT_MSG:
+                return self.__handle_execute(command, message)
+
+            # Check if it's background copy information, not an answer to any request
+            if command == COPY_PROGRESS_MSG or command == COPY_DONE_MSG:
+                return self.__handle_copy(command, message)
+
+            # Check if it's paginated directory listing
+            if command == DIR_ENTRIES_MSG or command == DIR_END_MSG:
+                return self.__handle_dir(command, message, request_id)
+
+            # Check if it's screen stream information
+            if command == SCREEN_STARTED_MSG:
+                self.__handle_screen_started(arguments)
+
+                self.__complete_request(request_id, message)
+                return message
+
+            if command == SCREEN_FRAME_MSG or command == SCREEN_END_MSG:
+                return self.__handle_screen(command, arguments)
+
+            # Check if it's photo content offer
+            if command == PHOTO_OFFER_MSG:
+                return self.__handle_photo_offer(arguments, request_id)
+
+            # Check if it's parallel photo transfer
+            if command == PHOTO_PARALLEL_MSG:
+                status = self.__handle_receive_parallel(arguments)
+
+                self.__complete_request(request_id, status)
+                return status
 
             # Check if it's related to receiving photo process
-            if command == self._protocols("2.7")("photo_header"):
-                return self.__handle_receive_photo(arguments)
+            if command == PHOTO_INFO_MSG:
+                status = self.__handle_receive_photo(arguments)
+
+                self.__complete_request(request_id, status)
+                return status
 
             # Just log and return the regular information
             write_to_log(f"  Client        - received from server : {message}")
 
+            # Server calls for disconnect, not an answer to any request
+            if message != DISCONNECT_MSG:
+                self.__complete_request(request_id, message)
+
             # Return message
             return message
 
@@ -258,6 +571,258 @@ class c_client_bl:
 
         return None  # Avoid continuing in the __receive_message()
 
+    def __handle_execute(self, command: str, message: str) -> None:
+        """
+            Handle streamed execute job output / exit
+        """
+
+        # Output can have any character, split only the known fields
+        value = message.split(">", 1)[1]
+
+        self._events["execute"] + ("finished", command == EXECUTE_EXIT_MSG)
+
+        if command == EXECUTE_OUTPUT_MSG:
+            job_id, stream, output = value.split(",", 2)
+
+            self._events["execute"] + ("stream", stream)
+            self._events["execute"] + ("output", output)
+            self._events["execute"] + ("status", None)
+        else:
+            job_id, status = value.split(",", 1)
+
+            write_to_log(f"  Client        - job {job_id} finished : {status}")
+
+            self._events["execute"] + ("stream", None)
+            self._events["execute"] + ("output", None)
+            self._events["execute"] + ("status", status)
+
+        self._events["execute"] + ("job", int(job_id))
+
+        # Call execute event
+        self._events["execute"]()
+
+        return None  # Avoid continuing in the __receive_message()
+
+    def __handle_copy(self, command: str, message: str) -> None:
+        """
+            Handle background copy progress / finish
+        """
+
+        # Status can have any character, split only the known fields
+        fields = message.split(">", 1)[1].split(",", 3)
+
+        status = None
+        if command == COPY_DONE_MSG:
+            status = fields[3]
+
+            write_to_log(f"  Client        - copy {fields[0]} finished : {status}")
+
+        # Prepare and call copy event
+        self._events["copy"] + ("job", int(fields[0]))
+        self._events["copy"] + ("copied", int(fields[1]))
+        self._events["copy"] + ("total", int(fields[2]))
+        self._events["copy"] + ("finished", command == COPY_DONE_MSG)
+        self._events["copy"] + ("status", status)
+        self._events["copy"]()
+
+        return None  # Avoid continuing in the __receive_message()
+
+    def __handle_dir(self, command: str, message: str, request_id: int) -> None:
+        """
+            Handle paginated directory listing entries / page end
+        """
+
+        # Names can have any character, split only the known fields
+        cursor, value = message.split(">", 1)[1].split(",", 1)
+
+        if command == DIR_ENTRIES_MSG:
+            entries = json.loads(value)
+
+            self._dir_pages.setdefault(request_id, []).extend(entries)
+
+            # Prepare and call dir event
+            self._events["dir"] + ("cursor", int(cursor))
+            self._events["dir"] + ("entries", entries)
+            self._events["dir"]()
+
+            return None  # Avoid continuing in the __receive_message()
+
+        # Page ended, the request gets every entry of it
+        entries = self._dir_pages.pop(request_id, [])
+
+        write_to_log(f"  Client        - received {len(entries)} entries, next cursor : {cursor}")
+
+        self.__complete_request(request_id, {"entries": entries, "cursor": int(cursor)})
+
+        return None  # Avoid continuing in the __receive_message()
+
+    def __handle_screen_started(self, arguments) -> None:
+        """
+            Create the canvas of a new screen stream
+        """
+
+        # Loaded only once a screen stream starts
+        from screen_capture import c_screen_canvas
+
+        stream_id, width, height, tile_size = (int(value) for value in arguments)
+
+        self._screens[stream_id] = c_screen_canvas(width, height, tile_size)
+
+    def __handle_screen(self, command: str, arguments) -> None:
+        """
+            Handle screen stream frame / end
+        """
+
+        stream_id = int(arguments[0])
+
+        if command == SCREEN_END_MSG:
+            self._screens.pop(stream_id, None)
+
+            status = ",".join(arguments[1:])
+            write_to_log(f"  Client        - screen stream {stream_id} finished : {status}")
+
+            self._events["screen"] + ("stream", stream_id)
+            self._events["screen"] + ("finished", True)
+            self._events["screen"] + ("status", status)
+            self._events["screen"] + ("keyframe", False)
+            self._events["screen"] + ("tiles", [])
+            self._events["screen"] + ("frame", None)
+            self._events["screen"]()
+
+            return None  # Avoid continuing in the __receive_message()
+
+        sequence, kind, size = int(arguments[1]), arguments[2], int(arguments[4])
+        if size < 0 or size > MAX_FRAME_SIZE:
+            raise Exception(f"Invalid screen frame size {size}")
+
+        # Compressed tiles follow the header, read them even if the stream is unknown
+        payload = c_protocol.recv_exact(self._reader, size) if size > 0 else b""
+
+        canvas = self._screens.get(stream_id)
+        if canvas is None:
+            return None
+
+        tiles = []
+        if payload:
+            # Note ! The payload comes from the server, cap what it may expand to
+            decompressor = zlib.decompressobj()
+            data = decompressor.decompress(c_encryption(self._client_info).decrypt(payload), COMPRESSION_MAX_SIZE)
+
+            if len(decompressor.unconsumed_tail) > 0 or not decompressor.eof:
+                write_to_log(f"  Client        - screen stream {stream_id} frame {sequence} rejected")
+                return None
+
+            tiles = canvas.apply(data)
+
+        # Prepare and call screen event
+        self._events["screen"] + ("stream", stream_id)
+        self._events["screen"] + ("finished", False)
+        self._events["screen"] + ("status", None)
+        self._events["screen"] + ("sequence", sequence)
+        self._events["screen"] + ("keyframe", kind == SCREEN_KEYFRAME)
+        self._events["screen"] + ("tiles", tiles)
+        self._events["screen"] + ("frame", canvas.frame() if tiles else None)
+        self._events["screen"]()
+
+        return None  # Avoid continuing in the __receive_message()
+
+    def __handle_photo_offer(self, arguments, request_id: int) -> any:
+        """
+            Handle photo content offer.
+            Photos in the store are written without transfer,
+            otherwise only the missing ranges are fetched
+        """
+
+        content_hash, file_size, file_name, new_file_name = arguments[0], int(arguments[1]), arguments[2], arguments[3]
+
+        store = self.__get_photo_store()
+
+        missing = store.missing(content_hash, file_size)
+
+        # Nothing to transfer
+        if not missing or file_size == 0:
+
+            if missing:
+                open(new_file_name, "wb").close()
+            else:
+                store.copy_to(content_hash, new_file_name)
+
+            status = "Photo received"
+            write_to_log(f"  Client        - photo status : {status} (from store)")
+
+            self.__complete_request(request_id, status)
+            return status
+
+        ranges = ",".join(f"{start}-{end}" for start, end in missing)
+
+        # The fetch answer completes the original request
+        future = self.__pop_request(request_id)
+        fetch = self.request(PHOTO_FETCH_CMD, f"{file_name},{content_hash},{new_file_name},{ranges}")
+
+        can_retry = future not in self._photo_offer_retries
+
+        def on_fetched(done: Future):
+
+            if future is None or future.done():
+                return
+
+            # Photo changed between the offer and the fetch, ask for a new offer once
+            if done.exception() is None and done.result() == PHOTO_CHANGED_STATUS and can_retry:
+
+                retry = self.request("SEND_PHOTO", f"{file_name},{new_file_name}")
+                self._photo_offer_retries.add(retry)
+
+                retry.add_done_callback(on_answered)
+                return
+
+            on_answered(done)
+
+        def on_answered(done: Future):
+
+            self._photo_offer_retries.discard(done)
+
+            if future is None or future.done():
+                return
+
+            if done.exception() is not None:
+                future.set_exception(done.exception())
+            else:
+                future.set_result(done.result())
+
+        fetch.add_done_callback(on_fetched)
+
+        return None  # Avoid continuing in the __receive_message()
+
+    def __handle_receive_parallel(self, arguments) -> str:
+        """
+            Handle parallel photo transfer, the ranges come on new data connections
+        """
+
+        data = {
+            "address": (self._client_info["ip"], self._client_info["port"]),
+            "tuner": self._client_info["tuner"],
+            "arguments": arguments,
+            "key": utils.find_key(self._client_info)
+        }
+
+        # Loaded only once a photo arrives
+        from protocol_27 import receive_photo_parallel
+        status = receive_photo_parallel(data)
+
+        write_to_log(f"  Client        - photo status : {status}")
+
+        return status
+
+    def __get_photo_store(self) -> any:
+
+        if self._photo_store is None:
+
+            # Loaded only once a photo arrives
+            from protocol_27 import c_photo_store
+            self._photo_store = c_photo_store(self._photo_store_folder)
+
+        return self._photo_store
+
     def __handle_receive_photo(self, arguments) -> str:
         """
             Handle the receiving photo process
@@ -266,11 +831,18 @@ class c_client_bl:
         # Prepare data that will be used
         data = {
             "socket": self._socket_obj,
+            "reader": self._reader,
+            "tuner": self._client_info["tuner"],
             "arguments": arguments,
             "key": utils.find_key(self._client_info)
         }
 
-        # Call the function from Protocol 2.7 file
+        # Offered photos are written through the store
+        if utils.extract(arguments, 3) is not None:
+            data["photo_store"] = self.__get_photo_store()
+
+        # Call the function from Protocol 2.7 file, loaded only once a photo arrives
+        from protocol_27 import receive_photo
         status = receive_photo(data)
 
         # Write to log the information
@@ -285,11 +857,14 @@ class c_client_bl:
         """
 
         # Work while connected
-        while self._socket_obj is not None:
+        while self._socket_obj is not None and not self._reader.closed:
 
             # Always try to receive something
             message = self.__receive_message()
 
+            # Reader timeouts bring us here regularly, even when nothing arrives
+            self.__expire_requests()
+
             # Manual check if the server wants us to disconnect
             if message == DISCONNECT_MSG:
                 self._events["disconnect"]()
@@ -299,6 +874,9 @@ class c_client_bl:
             self._events["receive"] + ("message", message)  # Update event message
             self._events["receive"]()
 
+        # Nothing will answer the remaining requests
+        self.__fail_requests("connection closed")
+
     #  endregion
 
     #  region Client Utils
@@ -314,6 +892,9 @@ class c_client_bl:
         if index == "last_error":
             return self._last_error
 
+        if index == "compression_stats":
+            return COMPRESSION_STATS.get()
+
         if index in self._events:
             return self._events[index]
 
@@ -7,9 +7,17 @@
 #  region @ Libraries
 
 from abc import ABC, abstractmethod
+from contextlib import nullcontext
+from utils import *
 
+import threading
+import asyncio
 import logging
 import socket
+import struct
+import time
+import zlib
+import lzma
 
 #  endregion
 
@@ -19,14 +27,77 @@ import socket
 DISCONNECT_MSG = "EXIT"     # Default Exit Msg
 HELP_CMD_MSG = "HELP"       # Default Help with commands Msg
 SUCCESS_CMD = "success"     # Default Login/Register success CMD
+FRAMING_CMD = "FRAMING"     # Default Frame mode negotiation CMD
+
+REGISTER_INFO_MSG = "REGISTRATION_INFO"     # Default Login/Register response header
+PHOTO_INFO_MSG = "PHOTO_INFORMATION"        # Default photo transfer header
+PHOTO_OFFER_MSG = "PHOTO_OFFER"             # Photo content hash and size, sent before any data
+PHOTO_FETCH_CMD = "PHOTO_FETCH"             # Client asks for the photo ranges it does not have
+PHOTO_MODE_OFFER: str = "offer"             # SEND_PHOTO>file name,new file name,offer
+PHOTO_STORE_FOLDER: str = "photo_store"     # Client content addressed store of received photos, opt-in
+PHOTO_CHANGED_STATUS: str = "Photo changed since the offer"     # Fetch answer, the offer must be asked again
+PHOTO_PARALLEL_MSG = "PHOTO_PARALLEL"       # Parallel transfer ticket and the ranges to fetch
+PHOTO_RANGE_CMD = "PHOTO_RANGE"             # Data connection asks for one range of the ticket file
+PHOTO_MODE_PARALLEL: str = "parallel"       # SEND_PHOTO>file name,new file name,parallel[,streams]
+PHOTO_PARALLEL_STREAMS: int = 4             # Default data connections of a parallel transfer
+
+EXECUTE_STARTED_MSG = "EXECUTE_STARTED"     # Streamed execute job started header
+EXECUTE_OUTPUT_MSG = "EXECUTE_OUTPUT"       # Streamed execute job output header
+EXECUTE_EXIT_MSG = "EXECUTE_EXIT"           # Streamed execute job finished header
+
+COPY_STARTED_MSG = "COPY_STARTED"       # Background copy started header
+COPY_PROGRESS_MSG = "COPY_PROGRESS"     # Background copy progress header
+COPY_DONE_MSG = "COPY_DONE"             # Background copy finished header
+
+DIR_ENTRIES_MSG = "DIR_ENTRIES"     # Paginated directory listing entries header
+DIR_END_MSG = "DIR_END"             # Paginated directory listing page end header
+DIR_MODE_SCAN: str = "scan"         # DIR>path,scan[,cursor[,page size]]
+DIR_MODE_WALK: str = "walk"         # DIR>path,walk[,cursor[,page size]] - recursive
+DIR_PAGE_SIZE: int = 1000           # Default directory listing entries per page
+
+SCREEN_STARTED_MSG = "SCREEN_STARTED"   # Screen stream started header
+SCREEN_FRAME_MSG = "SCREEN_FRAME"       # Screen stream keyframe / changed tiles header
+SCREEN_END_MSG = "SCREEN_END"           # Screen stream finished header
+SCREEN_KEYFRAME: str = "key"            # Every tile of the screen
+SCREEN_DELTA: str = "delta"             # Only the tiles changed since the last frame
 
 LOG_FILE: str = "LogFile.log"  # Log File Name
 FORMAT: str = "utf-8"          # Format
 
 DEFAULT_PORT: int = 8822    # Default Port Number
 BUFFER_SIZE: int = 1024     # Default full Buffer Read Size
+TRANSFER_CHUNK_SIZE: int = 64 * 1024            # Default file transfer chunk size
+TRANSFER_CHUNK_MAX_SIZE: int = 4 * 1024 * 1024  # Adaptive chunk size limit
+TRANSFER_ADAPT_WINDOW: float = 0.05             # Seconds of transfer between adaptive checks
+TRANSFER_ADAPT_GAIN: float = 1.1                # Throughput gain needed to keep growing
+TRANSFER_ADAPT_PATIENCE: int = 3                # Windows without gain before the chunk size settles
 HEADER_SIZE: int = 4        # Template Header Size
 
+READER_BUFFER_SIZE: int = 64 * 1024     # Default frame reader buffer size
+READER_TIMEOUT: float = 10              # Default frame reader timeout
+REQUEST_TIMEOUT: float = 120            # Default seconds a client request waits for its response
+
+FRAME_MODE_TEXT: str = "text"       # [4 digits length][value]
+FRAME_MODE_BINARY: str = "binary"   # [4 bytes length][1 byte flags][value]
+FRAME_FLAGS_NONE: int = 0x00        # Default frame flags
+FRAME_FLAG_REQUEST_ID: int = 0x01   # Value starts with 4 bytes request id
+FRAME_FLAG_ZLIB: int = 0x02         # Value was zlib compressed before the encryption
+FRAME_FLAG_LZMA: int = 0x04         # Value was lzma compressed before the encryption
+
+COMPRESSION_ZLIB: str = "zlib"              # Fast, good for text
+COMPRESSION_LZMA: str = "lzma"              # Smaller, much more CPU, for slow links
+COMPRESSION_METHODS: tuple = (COMPRESSION_ZLIB, COMPRESSION_LZMA)   # Supported, by preference
+COMPRESSION_THRESHOLD: int = 1024           # Smaller frames are not worth the CPU
+COMPRESSION_ZLIB_LEVEL: int = 6
+COMPRESSION_LZMA_PRESET: int = 1
+COMPRESSION_MAX_SIZE: int = 64 * 1024 * 1024    # Largest value a compressed frame may expand to
+MAX_FRAME_SIZE: int = 64 * 1024 * 1024          # Largest frame value accepted from the other side
+
+BINARY_HEADER = struct.Struct("!IB")  # Network order unsigned length and flags
+REQUEST_ID = struct.Struct("!I")      # Network order unsigned request id
+
+REQUEST_ID_LIMIT: int = 0xFFFFFFFF    # Request ids wrap around after this
+
 logging.basicConfig(filename=LOG_FILE, level=logging.INFO,
                     format='%(asctime)s - %(message)s')
 
@@ -46,22 +117,609 @@ def write_to_log(message: any):
 #  endregion
 
 
+#  region @ Frame Codec Class
+
+class c_frame_codec:
+    """
+        Frame Codec Class.
+
+        Text mode   : [4 digits length][value]
+        Binary mode : [4 bytes length][1 byte flags][value]
+
+        Binary frames of pipelined requests (and their responses)
+        set FRAME_FLAG_REQUEST_ID : [4 bytes length][1 byte flags][4 bytes request id][value]
+
+        Binary connections can agree on compression, values over the threshold
+        are compressed before the encryption and flagged with the method
+    """
+
+    def __init__(self, mode: str = FRAME_MODE_TEXT, compression: str = None, threshold: int = COMPRESSION_THRESHOLD):
+
+        if mode != FRAME_MODE_TEXT and mode != FRAME_MODE_BINARY:
+            raise Exception(f"Invalid frame mode {mode}")
+
+        if compression is not None and compression not in COMPRESSION_METHODS:
+            raise Exception(f"Invalid compression {compression}")
+
+        self.mode = mode
+
+        # Text frames have no flags to mark compressed values
+        self.compression: str = compression if mode == FRAME_MODE_BINARY else None
+        self.threshold: int = threshold
+
+        # Bytes to read before the value size is known
+        self.header_size = HEADER_SIZE
+        if mode == FRAME_MODE_BINARY:
+            self.header_size = BINARY_HEADER.size
+
+    def encode(self, value: bytes, flags: int = FRAME_FLAGS_NONE, request_id: int = None) -> bytes:
+        """
+            Wrap value bytes into a frame.
+            Text frames cannot carry the request id
+        """
+
+        if self.mode == FRAME_MODE_BINARY:
+
+            if request_id is None:
+                return BINARY_HEADER.pack(len(value), flags) + value
+
+            flags |= FRAME_FLAG_REQUEST_ID
+            return BINARY_HEADER.pack(len(value) + REQUEST_ID.size, flags) + REQUEST_ID.pack(request_id) + value
+
+        return f"{len(value):04d}".encode() + value
+
+    def parse_header(self, header: bytes) -> (int, int):
+        """
+            Parse frame header.
+
+            Return value size and flags.
+            Raise if the size is invalid, the buffer is allocated by it
+        """
+
+        if self.mode == FRAME_MODE_BINARY:
+            value_size, flags = BINARY_HEADER.unpack(header)
+        else:
+            value_size, flags = int(header.decode()), FRAME_FLAGS_NONE
+
+        if value_size < 0 or value_size > MAX_FRAME_SIZE:
+            raise Exception(f"Invalid frame size {value_size}")
+
+        return value_size, flags
+
+    def compress(self, value: bytes) -> (bytes, int):
+        """
+            Compress frame value with the agreed method.
+
+            Return the value to send and its flags,
+            small and incompressible values are sent as they are
+        """
+
+        if self.compression is None or len(value) < self.threshold:
+            return value, FRAME_FLAGS_NONE
+
+        start = time.perf_counter()
+
+        if self.compression == COMPRESSION_ZLIB:
+            compressed = zlib.compress(value, COMPRESSION_ZLIB_LEVEL)
+            flags = FRAME_FLAG_ZLIB
+        else:
+            compressed = lzma.compress(value, preset=COMPRESSION_LZMA_PRESET)
+            flags = FRAME_FLAG_LZMA
+
+        sent = len(compressed) < len(value)
+
+        COMPRESSION_STATS.add_compress(self.compression, len(value), len(compressed), time.perf_counter() - start, sent)
+
+        if not sent:
+            return value, FRAME_FLAGS_NONE
+
+        return compressed, flags
+
+    @staticmethod
+    def open_value(value: bytes, flags: int) -> any:
+        """
+            Frame value as the reader returns it.
+
+            Compressed values stay bytes, they are decompressed
+            only after the decryption (see c_protocol.decrypt_value)
+        """
+
+        if flags & FRAME_FLAG_ZLIB:
+            return c_compressed_value(value, COMPRESSION_ZLIB)
+
+        if flags & FRAME_FLAG_LZMA:
+            return c_compressed_value(value, COMPRESSION_LZMA)
+
+        return value.decode()
+
+    @staticmethod
+    def decompress(value: bytes, method: str, max_size: int = COMPRESSION_MAX_SIZE) -> bytes:
+        """
+            Decompress frame value from the other side.
+
+            Raise if the value is corrupt or expands over max size
+        """
+
+        start = time.perf_counter()
+
+        # Never trust the other side with the output size
+        if method == COMPRESSION_ZLIB:
+            decompressor = zlib.decompressobj()
+            result = decompressor.decompress(value, max_size)
+            exceeded = len(decompressor.unconsumed_tail) > 0
+        else:
+            decompressor = lzma.LZMADecompressor()
+            result = decompressor.decompress(value, max_size)
+            exceeded = not decompressor.eof and not decompressor.needs_input
+
+        if exceeded:
+            raise Exception(f"Compressed frame expands over {max_size} bytes")
+
+        if not decompressor.eof:
+            raise Exception("Compressed frame is truncated")
+
+        COMPRESSION_STATS.add_decompress(method, len(value), len(result), time.perf_counter() - start)
+
+        return result
+
+    @staticmethod
+    def select_compression(methods: list) -> str:
+        """
+            First supported method of the offered ones, None without a common one
+        """
+
+        for method in methods or []:
+            if method in COMPRESSION_METHODS:
+                return method
+
+        return None
+
+    @staticmethod
+    def split_request_id(value: bytes, flags: int) -> (int, bytes):
+        """
+            Split the request id from the frame value.
+
+            Return request id (None if the frame has no id) and value
+        """
+
+        if not flags & FRAME_FLAG_REQUEST_ID:
+            return None, value
+
+        return REQUEST_ID.unpack_from(value)[0], value[REQUEST_ID.size:]
+
+    @staticmethod
+    def is_valid_mode(mode: str) -> bool:
+        return mode == FRAME_MODE_TEXT or mode == FRAME_MODE_BINARY
+
+
+class c_compressed_value(bytes):
+    """
+        Received frame value that was compressed before the encryption
+    """
+
+    def __new__(cls, value: bytes, method: str):
+
+        result = super().__new__(cls, value)
+        result.method = method
+
+        return result
+
+#  endregion
+
+
+#  region @ Compression Stats Class
+
+class c_compression_stats:
+    """
+        Compression Statistics Class.
+
+        Collects bytes and CPU time of every compression method,
+        to see if the saved bytes are worth the time on a link
+    """
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self._methods = {}
+
+    def add_compress(self, method: str, size: int, compressed_size: int, seconds: float, sent: bool):
+        """
+            Add compressed frame, sent is False when it did not get smaller
+        """
+
+        with self._lock:
+            stats = self.__get(method)
+
+            stats["frames"] += 1
+            stats["compress_seconds"] += seconds
+
+            if sent:
+                stats["bytes_in"] += size
+                stats["bytes_out"] += compressed_size
+            else:
+                stats["skipped"] += 1
+
+    def add_decompress(self, method: str, size: int, decompressed_size: int, seconds: float):
+
+        with self._lock:
+            stats = self.__get(method)
+
+            stats["received_frames"] += 1
+            stats["received_bytes"] += size
+            stats["decompressed_bytes"] += decompressed_size
+            stats["decompress_seconds"] += seconds
+
+    def get(self) -> dict:
+        """
+            Returns copy of the stats with ratio, saved bytes and speed in MB/s
+        """
+
+        result = {}
+
+        with self._lock:
+            for method in self._methods:
+                stats = self._methods[method].copy()
+
+                stats["ratio"] = stats["bytes_out"] / stats["bytes_in"] if stats["bytes_in"] > 0 else 1.0
+                stats["saved_bytes"] = stats["bytes_in"] - stats["bytes_out"]
+
+                stats["compress_mb_per_second"] = 0.0
+                if stats["compress_seconds"] > 0:
+                    stats["compress_mb_per_second"] = stats["bytes_in"] / (1024 * 1024) / stats["compress_seconds"]
+
+                stats["decompress_mb_per_second"] = 0.0
+                if stats["decompress_seconds"] > 0:
+                    stats["decompress_mb_per_second"] = stats["decompressed_bytes"] / (1024 * 1024) / stats["decompress_seconds"]
+
+                result[method] = stats
+
+        return result
+
+    def __get(self, method: str) -> dict:
+        """
+            Note ! Called with the lock
+        """
+
+        if method not in self._methods:
+            self._methods[method] = {
+                "frames": 0, "skipped": 0, "bytes_in": 0, "bytes_out": 0, "compress_seconds": 0.0,
+                "received_frames": 0, "received_bytes": 0, "decompressed_bytes": 0, "decompress_seconds": 0.0
+            }
+
+        return self._methods[method]
+
+
+# Shared by every connection
+COMPRESSION_STATS = c_compression_stats()
+
+#  endregion
+
+
+#  region @ Frame Reader Class
+
+class c_frame_reader:
+    """
+        Buffered Frame Reader Class. One per socket.
+
+        Receives with recv_into into a preallocated buffer,
+        waits until a full frame is available and can pop
+        several pipelined frames received by one call.
+    """
+
+    def __init__(self, socket_obj: socket, codec: c_frame_codec = None,
+                 buffer_size: int = READER_BUFFER_SIZE, timeout: float = READER_TIMEOUT):
+
+        self._socket = socket_obj
+
+        # Codec can be switched after frame mode negotiation
+        self.codec = codec
+        if self.codec is None:
+            self.codec = c_frame_codec()
+
+        # Preallocated receive buffer
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+
+        # Unread bytes are between start and end
+        self._start: int = 0
+        self._end: int = 0
+
+        # Did the other side close the connection
+        self.closed: bool = False
+
+        # Timeout, lower number for more frequent 'updates'
+        self._socket.settimeout(timeout)
+
+    def read_frame(self) -> (bool, str):
+        """
+            Pop the next frame value.
+            Return false on error / timeout, the partial frame stays buffered
+        """
+
+        result, value, _ = self.read_message()
+
+        return result, value
+
+    def read_message(self) -> (bool, str, int):
+        """
+            Pop the next frame value and its request id (None if it has no id).
+            Return false on error / timeout, the partial frame stays buffered.
+
+            Note ! A closed connection or invalid frame header also sets closed
+        """
+
+        try:
+
+            while True:
+
+                # Maybe it already arrived with the previous frames
+                frame = self.__pop_frame()
+
+                if frame is not None:
+                    value, flags = frame
+                    request_id, value = c_frame_codec.split_request_id(value, flags)
+
+                    logging.info(f"  Protocol      - Buffer Raw : {value}")
+
+                    return True, c_frame_codec.open_value(value, flags), request_id
+
+                self.__fill()
+
+        except Exception as e:
+
+            # Failed / Timeout
+            return False, str(e), None
+
+    def set_timeout(self, timeout: float):
+        self._socket.settimeout(timeout)
+
+    def recv_into(self, buffer: any, nbytes: int = 0) -> int:
+        """
+            Socket like raw read.
+            Buffered bytes are returned before the socket is used
+        """
+
+        if nbytes == 0:
+            nbytes = len(buffer)
+
+        available = self._end - self._start
+
+        if available == 0:
+            return self._socket.recv_into(buffer, nbytes)
+
+        size = min(nbytes, available)
+        buffer[:size] = self._view[self._start:self._start + size]
+        self.__consume(size)
+
+        return size
+
+    def recv(self, size: int) -> bytes:
+        """
+            Socket like raw read.
+            Buffered bytes are returned before the socket is used
+        """
+
+        available = self._end - self._start
+
+        if available == 0:
+            return self._socket.recv(size)
+
+        size = min(size, available)
+        value = bytes(self._view[self._start:self._start + size])
+        self.__consume(size)
+
+        return value
+
+    def __pop_frame(self) -> any:
+        """
+            Pop a full frame from the buffer.
+            Return value and flags, None if the frame is not complete yet
+        """
+
+        available = self._end - self._start
+        header_size = self.codec.header_size
+
+        if available < header_size:
+            return None
+
+        # Parse the header in place
+        header = bytes(self._view[self._start:self._start + header_size])
+
+        try:
+            value_size, flags = self.codec.parse_header(header)
+
+        except Exception as e:
+
+            # The frame boundary is lost, nothing after it can be read
+            self.closed = True
+            raise Exception(f"invalid frame header {header} : {e}")
+
+        frame_size = header_size + value_size
+
+        if available < frame_size:
+
+            # Make sure the frame can fit
+            self.__reserve(frame_size)
+            return None
+
+        logging.info(f"  Protocol      - Buffer Size : {value_size}")
+
+        value = bytes(self._view[self._start + header_size:self._start + frame_size])
+        self.__consume(frame_size)
+
+        return value, flags
+
+    def __fill(self):
+        """
+            Receive as much as possible in one call
+        """
+
+        # Move the unread bytes to the front if there is no room at the end
+        if self._end == len(self._buffer):
+            self.__compact()
+
+        received = self._socket.recv_into(self._view[self._end:])
+
+        if received == 0:
+            self.closed = True
+            raise Exception("connection closed")
+
+        self._end += received
+
+    def __consume(self, size: int):
+
+        self._start += size
+
+        # Reuse the buffer from the beginning
+        if self._start == self._end:
+            self._start = 0
+            self._end = 0
+
+    def __compact(self):
+
+        available = self._end - self._start
+
+        self._view[:available] = self._view[self._start:self._end]
+
+        self._start = 0
+        self._end = available
+
+    def __reserve(self, size: int):
+        """
+            Make sure a frame of the size can fit in the buffer
+        """
+
+        if self._start + size <= len(self._buffer):
+            return
+
+        self.__compact()
+
+        if size <= len(self._buffer):
+            return
+
+        # Grow for big frames
+        buffer = bytearray(size)
+        buffer[:self._end] = self._view[:self._end]
+
+        self._view.release()
+
+        self._buffer = buffer
+        self._view = memoryview(self._buffer)
+
+#  endregion
+
+
+#  region @ Transfer Tuner Class
+
+class c_transfer_tuner:
+    """
+        Transfer Tuner Class. One per connection.
+
+        Holds the file transfer chunk size. In adaptive mode the chunk
+        (and the socket buffers) grow while the measured throughput grows
+    """
+
+    def __init__(self, chunk_size: int = TRANSFER_CHUNK_SIZE, adaptive: bool = False,
+                 max_chunk_size: int = TRANSFER_CHUNK_MAX_SIZE):
+
+        if chunk_size <= 0:
+            raise Exception("Invalid chunk size")
+
+        self.chunk_size: int = chunk_size
+        self.adaptive: bool = adaptive
+
+        self._max_chunk_size: int = max(chunk_size, max_chunk_size)
+
+        # Current measure window
+        self._window_bytes: int = 0
+        self._window_seconds: float = 0.0
+
+        # Best measured throughput in bytes per second
+        self._best_throughput: float = 0.0
+
+        # Stop growing once it stopped helping
+        self._misses: int = 0
+        self._settled: bool = False
+
+    def record(self, size: int, seconds: float, socket_obj: socket = None):
+        """
+            Record transferred chunk.
+            Adaptive mode may grow the chunk size
+        """
+
+        if not self.adaptive or self._settled:
+            return
+
+        self._window_bytes += size
+        self._window_seconds += seconds
+
+        if self._window_seconds < TRANSFER_ADAPT_WINDOW:
+            return
+
+        throughput = self._window_bytes / self._window_seconds
+
+        self._window_bytes = 0
+        self._window_seconds = 0.0
+
+        if throughput < self._best_throughput * TRANSFER_ADAPT_GAIN:
+
+            # Bigger chunks do not help anymore
+            self._misses += 1
+            self._settled = self._misses >= TRANSFER_ADAPT_PATIENCE
+            return
+
+        self._misses = 0
+        self._best_throughput = throughput
+
+        if self.chunk_size >= self._max_chunk_size:
+            self._settled = True
+            return
+
+        self.chunk_size = min(self.chunk_size * 2, self._max_chunk_size)
+        self.apply(socket_obj)
+
+        logging.info(f"  Protocol      - transfer chunk size : {self.chunk_size}")
+
+    def apply(self, socket_obj: socket):
+        """
+            Size the socket buffers to hold a few chunks.
+            Only grows them, smaller values would turn off the kernel auto tuning
+        """
+
+        if getattr(socket_obj, "getsockopt", None) is None:
+            return
+
+        size = self.chunk_size * 2
+
+        try:
+            for option in (socket.SO_SNDBUF, socket.SO_RCVBUF):
+                if socket_obj.getsockopt(socket.SOL_SOCKET, option) < size:
+                    socket_obj.setsockopt(socket.SOL_SOCKET, option, size)
+
+        except Exception as e:
+
+            # Not every socket lets us change it, keep the defaults
+            logging.info(f"  Protocol      - failed to set socket buffers : {e}")
+
+#  endregion
+
+
 #  region @ Protocol Class
 
 class c_protocol(ABC):
 
     @abstractmethod
-    def create_request(self, cmd: str, args: str, data: dict) -> str:  # Virtual Function
+    def create_request(self, cmd: str, args: str, data: dict) -> bytes:  # Virtual Function
         """
-            Creates a request message by formatting the command and arguments.
+            Creates a request frame by formatting the command and arguments.
         """
 
         pass
 
     @abstractmethod
-    def create_response(self, cmd: str, args: list, data: dict) -> str:  # Virtual Function
+    def create_response(self, cmd: str, args: list, data: dict) -> bytes:  # Virtual Function
         """
-            Create valid response information,
+            Create valid response frame,
 
             In case unsupported request "Non-supported cmd" will be returned
         """
@@ -86,6 +744,95 @@ class c_protocol(ABC):
 
         return f"{len(value):04d}{value}"
 
+    @staticmethod
+    def format_frame(value: any, data: dict) -> bytes:
+        """
+            Encrypts any string / bytes Value and wraps it into a frame.
+            Uses the connection frame codec and key from data
+
+            Return ready to send bytes
+        """
+
+        if type(value) == str:
+            value = value.encode()
+
+        # Compress before the encryption, encrypted data does not compress
+        value, flags = c_protocol.find_codec(data).compress(value)
+
+        return c_protocol.wrap_frame(c_encryption(data).encrypt(value), data, flags)
+
+    @staticmethod
+    def send_frame(value: any, data: dict):
+        """
+            Encrypts, frames and sends any string / bytes Value
+            outside the normal response, under the connection send lock
+        """
+
+        c_protocol.send_frame_data(c_protocol.format_frame(value, data), data)
+
+    @staticmethod
+    def send_frame_data(frames: bytes, data: dict):
+        """
+            Sends ready frames (and raw data after them)
+            in one call, under the connection send lock
+        """
+
+        send_lock = utils.extract(data, "send_lock")
+        if send_lock is None:
+            send_lock = nullcontext()
+
+        with send_lock:
+            data["socket"].sendall(frames)
+
+    @staticmethod
+    def wrap_frame(value: bytes, data: dict, flags: int = FRAME_FLAGS_NONE) -> bytes:
+        """
+            Wraps already encrypted value bytes into a frame.
+            Uses the connection frame codec and the request id from data
+        """
+
+        return c_protocol.find_codec(data).encode(value, flags, utils.extract(data, "request_id"))
+
+    @staticmethod
+    def decrypt_value(value: any, data: dict) -> str:
+        """
+            Decrypts received frame value,
+            compressed values are decompressed after the decryption
+        """
+
+        result = c_encryption(data).decrypt(value)
+
+        if isinstance(value, c_compressed_value):
+            result = c_frame_codec.decompress(result, value.method)
+
+        return result.decode()
+
+    @staticmethod
+    def find_tuner(data: dict) -> c_transfer_tuner:
+        """
+            Will try to find the transfer tuner in the data,
+            connections without one use the default chunk size
+        """
+
+        tuner = utils.extract(data, "tuner")
+        if tuner is None:
+            return c_transfer_tuner()
+
+        return tuner
+
+    @staticmethod
+    def find_codec(data: dict) -> c_frame_codec:
+        """
+            Will try to find the frame codec in the data,
+            connections without one use the text frames
+        """
+
+        codec = utils.extract(data, "codec")
+        if codec is None:
+            return c_frame_codec()
+
+        return codec
+
     @staticmethod
     def parse(raw: str) -> any:
         """
@@ -114,26 +861,33 @@ class c_protocol(ABC):
             return raw, None
 
     @staticmethod
-    def get_raw_from_buffer(socket_obj: socket) -> (bool, str):
+    def get_raw_from_buffer(socket_obj: socket, codec: c_frame_codec = None, timeout: float = 10) -> (bool, str):
         """
             Pop from the buffer information
             Return false on error / fail
+
+            Note ! Reads exactly one frame, for connections
+            with pipelined frames use c_frame_reader
         """
 
         # Just in case
         if socket_obj is None:
             return False, ""
 
+        if codec is None:
+            codec = c_frame_codec()
+
         try:
             # Timeout, lower number for more frequent 'updates'
-            socket_obj.settimeout(10)
+            socket_obj.settimeout(timeout)
 
             # Get current data size
-            buffer_size = int(socket_obj.recv(HEADER_SIZE).decode())
+            buffer_size, flags = codec.parse_header(c_protocol.recv_exact(socket_obj, codec.header_size))
             logging.info(f"  Protocol      - Buffer Size : {buffer_size}")
 
             # Receive the data based on size
-            raw_buffer = socket_obj.recv(buffer_size).decode()
+            _, raw_buffer = c_frame_codec.split_request_id(c_protocol.recv_exact(socket_obj, buffer_size), flags)
+            raw_buffer = c_frame_codec.open_value(raw_buffer, flags)
             logging.info(f"  Protocol      - Buffer Raw : {raw_buffer}")
 
             # Return True as Result and the data we got
@@ -144,4 +898,71 @@ class c_protocol(ABC):
             # Failed / Timeout
             return False, str(e)
 
+    @staticmethod
+    def recv_exact(socket_obj: socket, size: int) -> bytes:
+        """
+            Receive exactly size bytes,
+            TCP can split the data between many recv calls
+        """
+
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+
+        received = 0
+        while received < size:
+            count = socket_obj.recv_into(view[received:])
+
+            if count == 0:
+                raise Exception("connection closed")
+
+            received += count
+
+        return bytes(buffer)
+
+    @staticmethod
+    async def get_raw_from_stream(stream_reader: asyncio.StreamReader, codec: c_frame_codec = None) -> (bool, str):
+        """
+            Pop from the asyncio stream information
+            Return false on error / closed connection
+        """
+
+        result, raw_buffer, _ = await c_protocol.get_message_from_stream(stream_reader, codec)
+
+        return result, raw_buffer
+
+    @staticmethod
+    async def get_message_from_stream(stream_reader: asyncio.StreamReader, codec: c_frame_codec = None) -> (bool, str, int):
+        """
+            Pop from the asyncio stream information and its request id (None if it has no id)
+            Return false on error / closed connection
+        """
+
+        # Just in case
+        if stream_reader is None:
+            return False, "", None
+
+        if codec is None:
+            codec = c_frame_codec()
+
+        try:
+            # Get current data size
+            header = await stream_reader.readexactly(codec.header_size)
+            buffer_size, flags = codec.parse_header(header)
+            logging.info(f"  Protocol      - Buffer Size : {buffer_size}")
+
+            # Receive the data based on size
+            raw_buffer = await stream_reader.readexactly(buffer_size)
+            request_id, raw_buffer = c_frame_codec.split_request_id(raw_buffer, flags)
+
+            raw_buffer = c_frame_codec.open_value(raw_buffer, flags)
+            logging.info(f"  Protocol      - Buffer Raw : {raw_buffer}")
+
+            # Return True as Result and the data we got
+            return True, raw_buffer, request_id
+
+        except Exception as e:
+
+            # Failed / Connection closed
+            return False, str(e), None
+
 #  endregion
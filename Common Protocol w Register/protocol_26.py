@@ -56,16 +56,14 @@ class c_protocol_26(c_protocol, ABC):
             "NAME": get_name
         }
 
-    def create_request(self, cmd: str, args: str, data: dict) -> str:
+    def create_request(self, cmd: str, args: str, data: dict) -> bytes:
         """
             Creates a request message by formatting the command and arguments.
         """
 
-        cmd = c_encryption(data).encrypt(cmd).decode()  # encrypt cmd request
+        return c_protocol.format_frame(cmd, data)  # encrypt and frame cmd request
 
-        return c_protocol.format_value(cmd)
-
-    def create_response(self, cmd: str, args: list, data: dict) -> str:
+    def create_response(self, cmd: str, args: list, data: dict) -> bytes:
         """
             Create valid response information,
 
@@ -83,7 +81,7 @@ class c_protocol_26(c_protocol, ABC):
         write_to_log(f"  Protocol 2.6  - response : {response}")
 
         # Return formatted and encrypted response
-        return c_protocol.format_value(c_encryption(data).encrypt(response).decode())
+        return c_protocol.format_frame(response, data)
 
     def get_cmds(self) -> list:
         """
@@ -8,116 +8,2124 @@
 
 from protocol import *
 from utils import *
+from screen_capture import *
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import subprocess
-import pyautogui
+import threading
+import itertools
+import hashlib
+import asyncio
+import codecs
+import json
 import shutil
+import shlex
+import string
+import secrets
+import struct
+import errno
+import zlib
 import glob
+import time
+import sys
 import os
 
-#  endregion
+#  endregion
+
+
+#  region @ Transfer Stats
+
+TRANSFER_MODE_SENDFILE: str = "sendfile"    # Kernel copies the file to the socket
+TRANSFER_MODE_CHUNKED: str = "chunked"      # Read, encrypt and send in python
+TRANSFER_MODE_MEMORY: str = "memory"        # Already in memory, sent in one call
+
+
+class c_transfer_stats:
+    """
+        Transfer Statistics Class.
+
+        Collects sent bytes and time for every transfer mode
+    """
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self._modes = {}
+
+    def add(self, mode: str, size: int, seconds: float):
+        """
+            Add finished transfer
+        """
+
+        with self._lock:
+
+            if mode not in self._modes:
+                self._modes[mode] = {"count": 0, "bytes": 0, "seconds": 0.0}
+
+            self._modes[mode]["count"] += 1
+            self._modes[mode]["bytes"] += size
+            self._modes[mode]["seconds"] += seconds
+
+    def get(self) -> dict:
+        """
+            Returns copy of the stats with throughput in MB/s
+        """
+
+        result = {}
+
+        with self._lock:
+            for mode in self._modes:
+                stats = self._modes[mode].copy()
+
+                stats["mb_per_second"] = 0.0
+                if stats["seconds"] > 0:
+                    stats["mb_per_second"] = stats["bytes"] / (1024 * 1024) / stats["seconds"]
+
+                result[mode] = stats
+
+        return result
+
+
+# Shared by every connection
+TRANSFER_STATS = c_transfer_stats()
+
+#  endregion
+
+
+#  region @ Execute Jobs
+
+EXECUTE_MODE_STREAM: str = "stream"     # EXECUTE>command,stream[,timeout]
+SCREENSHOT_MODE_STREAM: str = "stream"  # TAKE_SCREENSHOT>new file name,stream[,format[,level]]
+EXECUTE_TIMEOUT: float = 300            # Default streamed job timeout in seconds, 0 for none
+EXECUTE_MAX_JOBS: int = 8               # Streamed jobs running at once per connection
+EXECUTE_OUTPUT_CHUNK: int = 4096        # Output bytes read (and sent) at once
+
+EXECUTE_STATUS_TIMEOUT: str = "timeout"
+EXECUTE_STATUS_CANCELLED: str = "cancelled"
+
+
+class c_execute_jobs:
+    """
+        Execute Jobs Class.
+
+        Runs the streamed EXECUTE processes on one background event loop,
+        no thread waits for a process. Output is sent to the client in frames
+        as it is produced, one chunk in flight per pipe,
+        so a slow client holds back its job instead of growing memory
+    """
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+
+        # Job id -> job information
+        self._jobs = {}
+        self._ids = itertools.count(1)
+
+        # Event loop is started on the first job
+        self._loop: asyncio.AbstractEventLoop = None
+
+    def start(self, command: str, timeout: float, data: dict) -> (int, str):
+        """
+            Start streamed job.
+
+            Return job id and error (None on success)
+        """
+
+        socket_obj = utils.extract(data, "socket")
+
+        with self._lock:
+
+            running = sum(1 for job in self._jobs.values() if job["socket"] is socket_obj)
+            if running >= EXECUTE_MAX_JOBS:
+                return None, f"Too many running jobs ({running})"
+
+            job_id = next(self._ids)
+
+            job = {
+                "id": job_id,
+                "command": command,
+                "timeout": timeout,
+                "socket": socket_obj,
+                "data": data,
+                "task": None
+            }
+
+            self._jobs[job_id] = job
+
+            loop = self.__get_loop()
+
+        # The client gets the job id before any output
+        try:
+            c_protocol.send_frame(f"{EXECUTE_STARTED_MSG}>{job_id}", data)
+
+        except Exception as e:
+
+            with self._lock:
+                self._jobs.pop(job_id, None)
+
+            return None, f"Failed to start {command} : {e}"
+
+        asyncio.run_coroutine_threadsafe(self.__start_task(job), loop)
+
+        return job_id, None
+
+    def cancel(self, job_id: int, socket_obj: any) -> bool:
+        """
+            Cancel running job of the connection
+        """
+
+        with self._lock:
+
+            job = self._jobs.get(job_id)
+
+            # Only the connection that started it can cancel it
+            if job is None or job["socket"] is not socket_obj:
+                return False
+
+            loop = self._loop
+
+        loop.call_soon_threadsafe(self.__cancel_task, job)
+
+        return True
+
+    def count(self) -> int:
+
+        with self._lock:
+            return len(self._jobs)
+
+    def __get_loop(self) -> asyncio.AbstractEventLoop:
+        """
+            Get the jobs event loop, start it on first use.
+            Note ! Called with the lock
+        """
+
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+
+            threading.Thread(target=self._loop.run_forever, name="execute jobs", daemon=True).start()
+
+        return self._loop
+
+    async def __start_task(self, job: dict):
+
+        job["task"] = asyncio.current_task()
+
+        # Cancelled before it even started
+        if job.get("cancelled"):
+            return await self.__finish(job, EXECUTE_STATUS_CANCELLED)
+
+        await self.__run(job)
+
+    def __cancel_task(self, job: dict):
+
+        job["cancelled"] = True
+
+        if job["task"] is not None:
+            job["task"].cancel()
+
+    async def __run(self, job: dict):
+        """
+            Run the process and stream its output until it exits,
+            times out or gets cancelled
+        """
+
+        try:
+
+            # Windows parses the command line by itself
+            arguments = shlex.split(job["command"], posix=os.name != "nt")
+
+            process = await asyncio.create_subprocess_exec(*arguments,
+                                                           stdin=asyncio.subprocess.DEVNULL,
+                                                           stdout=asyncio.subprocess.PIPE,
+                                                           stderr=asyncio.subprocess.PIPE)
+
+        except asyncio.CancelledError:
+            return await self.__finish(job, EXECUTE_STATUS_CANCELLED)
+
+        except Exception as e:
+            return await self.__finish(job, f"Failed to execute {job['command']} : {e}")
+
+        write_to_log(f"  Protocol 2.7  - job {job['id']} started : {job['command']}")
+
+        timeout = job["timeout"] if job["timeout"] > 0 else None
+
+        try:
+
+            await asyncio.wait_for(asyncio.gather(
+                self.__stream_pipe(job, process.stdout, "stdout"),
+                self.__stream_pipe(job, process.stderr, "stderr"),
+                process.wait()
+            ), timeout)
+
+            status = str(process.returncode)
+
+        except asyncio.TimeoutError:
+            status = EXECUTE_STATUS_TIMEOUT
+
+        except asyncio.CancelledError:
+            status = EXECUTE_STATUS_CANCELLED
+
+        except Exception as e:
+
+            # Client is gone, nobody reads the output
+            status = None
+            write_to_log(f"  Protocol 2.7  - job {job['id']} lost the connection : {e}")
+
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+        await self.__finish(job, status)
+
+    async def __stream_pipe(self, job: dict, pipe: asyncio.StreamReader, name: str):
+        """
+            Send process pipe output as it is produced
+        """
+
+        # Multi byte characters can be split between reads
+        decoder = codecs.getincrementaldecoder(FORMAT)(errors="replace")
+
+        while True:
+
+            chunk = await pipe.read(EXECUTE_OUTPUT_CHUNK)
+
+            if not chunk:
+                break
+
+            output = decoder.decode(chunk)
+            if output:
+                await asyncio.to_thread(c_protocol.send_frame, f"{EXECUTE_OUTPUT_MSG}>{job['id']},{name},{output}", job["data"])
+
+    async def __finish(self, job: dict, status: str):
+        """
+            Inform the client and remove the job
+        """
+
+        with self._lock:
+            self._jobs.pop(job["id"], None)
+
+        write_to_log(f"  Protocol 2.7  - job {job['id']} finished : {status}")
+
+        if status is None:
+            return
+
+        try:
+            await asyncio.to_thread(c_protocol.send_frame, f"{EXECUTE_EXIT_MSG}>{job['id']},{status}", job["data"])
+
+        except Exception as e:
+            write_to_log(f"  Protocol 2.7  - job {job['id']} failed to send exit : {e}")
+
+
+# Shared by every connection
+EXECUTE_JOBS = c_execute_jobs()
+
+#  endregion
+
+
+#  region @ Copy Jobs
+
+COPY_MODE_BACKGROUND: str = "background"    # COPY>from,to,background
+COPY_WORKERS: int = 2                       # Background copies running at once, the rest wait
+COPY_MAX_JOBS: int = 4                      # Background copies per connection
+COPY_CHUNK_SIZE: int = 8 * 1024 * 1024      # Bytes copied between progress and cancel checks
+COPY_PROGRESS_INTERVAL: float = 0.5         # Seconds between progress frames
+COPY_PART_SUFFIX: str = ".part"             # Destination is written here until complete
+COPY_RESUME_CHECK: int = 64 * 1024          # Tail bytes compared before resuming a part file
+
+COPY_METHOD_RANGE: str = "copy_file_range"  # Kernel copy, no data in user space
+COPY_METHOD_SENDFILE: str = "sendfile"      # Kernel copy into the destination position
+COPY_METHOD_READ: str = "read"              # Portable read / write
+
+COPY_STATUS_DONE: str = "done"
+COPY_STATUS_CANCELLED: str = "cancelled"
+
+# Kernel copy is not possible for these files, try the next method
+COPY_FALLBACK_ERRORS: tuple = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF)
+
+
+class c_copy_jobs:
+    """
+        Copy Jobs Class.
+
+        Copies files in chunks on background workers and reports
+        the progress to the client that asked for the copy.
+        The destination is written to a part file, so an interrupted
+        copy continues from the part size next time
+    """
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+
+        # Job id -> job information
+        self._jobs = {}
+        self._ids = itertools.count(1)
+
+        # Workers are started on the first job
+        self._pool: ThreadPoolExecutor = None
+
+    def start(self, source: str, destination: str, data: dict) -> (int, str):
+        """
+            Start background copy.
+
+            Return job id and error (None on success)
+        """
+
+        if not os.path.isfile(source):
+            return None, f"Failed to copy file from {source}"
+
+        # Same as shutil.copy, copy into the folder
+        if os.path.isdir(destination):
+            destination = os.path.join(destination, os.path.basename(source))
+
+        socket_obj = utils.extract(data, "socket")
+
+        with self._lock:
+
+            running = sum(1 for job in self._jobs.values() if job["socket"] is socket_obj)
+            if running >= COPY_MAX_JOBS:
+                return None, f"Too many running copies ({running})"
+
+            if any(job["destination"] == destination for job in self._jobs.values()):
+                return None, f"Already copying to {destination}"
+
+            job_id = next(self._ids)
+
+            job = {
+                "id": job_id,
+                "source": source,
+                "destination": destination,
+                "total": os.path.getsize(source),
+                "copied": 0,
+                "method": COPY_METHOD_RANGE,
+                "socket": socket_obj,
+                "data": data,
+                "cancelled": False
+            }
+
+            self._jobs[job_id] = job
+
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=COPY_WORKERS, thread_name_prefix="copy")
+
+            pool = self._pool
+
+        job["copied"] = resume_offset(source, destination + COPY_PART_SUFFIX, job["total"])
+
+        # The client gets the job id before any progress
+        try:
+            c_protocol.send_frame(f"{COPY_STARTED_MSG}>{job_id},{job['copied']},{job['total']}", data)
+
+        except Exception as e:
+
+            with self._lock:
+                self._jobs.pop(job_id, None)
+
+            return None, f"Failed to copy file from {source} : {e}"
+
+        pool.submit(self.__run, job)
+
+        return job_id, None
+
+    def cancel(self, job_id: int, socket_obj: any) -> bool:
+        """
+            Cancel running copy of the connection, the part file is kept for resume
+        """
+
+        with self._lock:
+
+            job = self._jobs.get(job_id)
+
+            # Only the connection that started it can cancel it
+            if job is None or job["socket"] is not socket_obj:
+                return False
+
+            job["cancelled"] = True
+
+        return True
+
+    def count(self) -> int:
+
+        with self._lock:
+            return len(self._jobs)
+
+    def __run(self, job: dict):
+
+        start = time.perf_counter()
+        first_offset = job["copied"]
+
+        try:
+            status = self.__copy(job)
+
+        except Exception as e:
+            status = f"Failed to copy file from {job['source']} : {e}"
+
+        with self._lock:
+            self._jobs.pop(job["id"], None)
+
+        elapsed = time.perf_counter() - start
+        write_to_log(f"  Protocol 2.7  - copy {job['id']} {status}, {job['copied'] - first_offset} bytes "
+                     f"in {elapsed:.3f}s ({job['method']})")
+
+        self.__report(job, f"{COPY_DONE_MSG}>{job['id']},{job['copied']},{job['total']},{status}")
+
+    def __copy(self, job: dict) -> str:
+        """
+            Copy the file from the resume offset, one chunk at a time
+        """
+
+        part = job["destination"] + COPY_PART_SUFFIX
+        total = job["total"]
+        offset = job["copied"]
+
+        last_report = time.monotonic()
+
+        with open(job["source"], "rb", buffering=0) as source, \
+                open(part, "r+b" if offset > 0 else "wb", buffering=0) as destination:
+
+            # Drop anything after the verified part
+            destination.truncate(offset)
+
+            while offset < total:
+
+                if job["cancelled"]:
+                    return COPY_STATUS_CANCELLED
+
+                copied = copy_chunk(source, destination, offset, min(COPY_CHUNK_SIZE, total - offset), job)
+
+                # File got shorter while copying
+                if copied == 0:
+                    break
+
+                offset += copied
+                job["copied"] = offset
+
+                if time.monotonic() - last_report >= COPY_PROGRESS_INTERVAL:
+                    last_report = time.monotonic()
+
+                    self.__report(job, f"{COPY_PROGRESS_MSG}>{job['id']},{offset},{total}")
+
+        # Source got shorter, the part file stays for a later resume
+        if offset != total:
+            raise Exception(f"source ended after {offset} of {total} bytes")
+
+        # Complete, now it can have the real name
+        os.replace(part, job["destination"])
+        shutil.copymode(job["source"], job["destination"])
+
+        return COPY_STATUS_DONE
+
+    @staticmethod
+    def __report(job: dict, value: str):
+        """
+            Send job frame to the client, the copy goes on without it
+        """
+
+        if job["data"] is None:
+            return
+
+        try:
+            c_protocol.send_frame(value, job["data"])
+
+        except Exception as e:
+
+            # Client is gone, keep copying
+            job["data"] = None
+            write_to_log(f"  Protocol 2.7  - copy {job['id']} lost the connection : {e}")
+
+
+def copy_chunk(source: any, destination: any, offset: int, size: int, job: dict) -> int:
+    """
+        Copy file range at the same offset.
+        Uses the best method that works for these files
+
+        Return the copied bytes count, 0 at the source end
+    """
+
+    while True:
+
+        method = job["method"]
+
+        try:
+
+            if method == COPY_METHOD_RANGE:
+                if getattr(os, "copy_file_range", None) is None:
+                    raise OSError(errno.ENOSYS, "copy_file_range is not supported")
+
+                return os.copy_file_range(source.fileno(), destination.fileno(), size, offset, offset)
+
+            if method == COPY_METHOD_SENDFILE:
+                if getattr(os, "sendfile", None) is None or sys.platform != "linux":
+                    raise OSError(errno.ENOSYS, "sendfile to file is not supported")
+
+                # Writes at the destination position
+                destination.seek(offset)
+                return os.sendfile(destination.fileno(), source.fileno(), offset, size)
+
+            source.seek(offset)
+            chunk = source.read(size)
+
+            destination.seek(offset)
+            destination.write(chunk)
+
+            return len(chunk)
+
+        except OSError as e:
+
+            if method == COPY_METHOD_READ or e.errno not in COPY_FALLBACK_ERRORS:
+                raise
+
+            job["method"] = COPY_METHOD_SENDFILE if method == COPY_METHOD_RANGE else COPY_METHOD_READ
+
+
+def resume_offset(source: str, part: str, total: int) -> int:
+    """
+        Size of the part file that can be kept.
+
+        The part must be older than the source change
+        and end with the same bytes as the source at that offset
+    """
+
+    try:
+
+        size = os.path.getsize(part)
+
+        if size == 0 or size > total:
+            return 0
+
+        # Source changed after the part was written
+        if os.path.getmtime(source) > os.path.getmtime(part):
+            return 0
+
+        check = min(COPY_RESUME_CHECK, size)
+
+        with open(source, "rb") as source_file, open(part, "rb") as part_file:
+            source_file.seek(size - check)
+            part_file.seek(size - check)
+
+            if source_file.read(check) != part_file.read(check):
+                return 0
+
+        return size
+
+    except OSError:
+        return 0
+
+
+# Shared by every connection
+COPY_JOBS = c_copy_jobs()
+
+#  endregion
+
+
+#  region @ Screen Streams
+
+SCREEN_DEFAULT_FPS: float = 10              # SCREEN_STREAM>[fps[,bandwidth KB/s[,level[,tile size]]]]
+SCREEN_MAX_FPS: float = 60
+SCREEN_DEFAULT_LEVEL: int = 1               # zlib level of the tiles, fast is enough for screen content
+SCREEN_MAX_STREAMS: int = 2                 # Streams running at once per connection
+SCREEN_KEYFRAME_INTERVAL: float = 10        # Seconds between full frames, heals a missed change
+SCREEN_IDLE_INTERVAL: float = 1             # Empty frame when nothing changed, so a lost client is found
+
+SCREEN_STATUS_STOPPED: str = "stopped"
+
+
+class c_screen_streams:
+    """
+        Screen Streams Class.
+
+        Captures the screen on a background thread per stream and sends
+        a keyframe, then only the tiles whose hash changed since the last frame.
+        Frame rate and bandwidth are capped, a frame over the bandwidth budget
+        delays the next capture instead of queueing frames
+    """
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+
+        # Stream id -> stream information
+        self._streams = {}
+        self._ids = itertools.count(1)
+
+    def start(self, fps: float, bandwidth: float, level: int, tile_size: int, data: dict) -> (int, str):
+        """
+            Start screen stream.
+
+            bandwidth : bytes per second, 0 for no limit
+
+            Return stream id and error (None on success)
+        """
+
+        socket_obj = utils.extract(data, "socket")
+
+        with self._lock:
+
+            running = sum(1 for stream in self._streams.values() if stream["socket"] is socket_obj)
+            if running >= SCREEN_MAX_STREAMS:
+                return None, f"Too many running screen streams ({running})"
+
+            stream_id = next(self._ids)
+
+            stream = {
+                "id": stream_id,
+                "fps": fps,
+                "bandwidth": bandwidth,
+                "level": level,
+                "tile_size": tile_size,
+                "socket": socket_obj,
+                "data": data,
+                "stop": threading.Event(),
+                "frames": 0,
+                "sent": 0
+            }
+
+            self._streams[stream_id] = stream
+
+        try:
+            source = get_screen_source()
+            frame = source.grab()
+
+            # The client gets the screen size before any frame
+            c_protocol.send_frame(f"{SCREEN_STARTED_MSG}>{stream_id},{frame.width},{frame.height},{tile_size}", data)
+
+        except Exception as e:
+
+            with self._lock:
+                self._streams.pop(stream_id, None)
+
+            return None, f"Failed to start screen stream : {e}"
+
+        threading.Thread(target=self.__run, args=(stream, source, frame),
+                         name=f"screen stream {stream_id}", daemon=True).start()
+
+        return stream_id, None
+
+    def stop(self, stream_id: int, socket_obj: any) -> bool:
+        """
+            Stop running stream of the connection
+        """
+
+        with self._lock:
+
+            stream = self._streams.get(stream_id)
+
+            # Only the connection that started it can stop it
+            if stream is None or stream["socket"] is not socket_obj:
+                return False
+
+        stream["stop"].set()
+
+        return True
+
+    def count(self) -> int:
+
+        with self._lock:
+            return len(self._streams)
+
+    def __run(self, stream: dict, source: c_screen_source, frame: c_screen_frame):
+
+        start = time.perf_counter()
+
+        try:
+            status = self.__stream(stream, source, frame)
+
+        except Exception as e:
+
+            # Client is gone, nobody watches the screen
+            status = None
+            write_to_log(f"  Protocol 2.7  - screen stream {stream['id']} lost the connection : {e}")
+
+        with self._lock:
+            self._streams.pop(stream["id"], None)
+
+        elapsed = time.perf_counter() - start
+        write_to_log(f"  Protocol 2.7  - screen stream {stream['id']} finished : {status}, "
+                     f"{stream['frames']} frames, {stream['sent']} bytes in {elapsed:.3f}s")
+
+        if status is None:
+            return
+
+        try:
+            c_protocol.send_frame(f"{SCREEN_END_MSG}>{stream['id']},{status}", stream["data"])
+
+        except Exception as e:
+            write_to_log(f"  Protocol 2.7  - screen stream {stream['id']} failed to send end : {e}")
+
+    def __stream(self, stream: dict, source: c_screen_source, frame: c_screen_frame) -> str:
+        """
+            Capture, diff and send frames until stopped
+        """
+
+        tile_size = stream["tile_size"]
+        interval = 1 / stream["fps"]
+        bandwidth = stream["bandwidth"]
+
+        # Canvas size the client got in the started frame
+        screen_size = (frame.width, frame.height)
+
+        hashes = None
+        last_keyframe = 0
+        last_send = 0
+
+        # Token bucket, one second of burst. Sent bytes can take it below zero,
+        # then the next capture waits until it is paid back
+        tokens = bandwidth
+        last_refill = time.monotonic()
+
+        next_frame = time.monotonic()
+
+        while not stream["stop"].is_set():
+
+            if frame is None:
+                frame = source.grab()
+
+            # Screen resolution changed, the client needs new canvas size
+            if (frame.width, frame.height) != screen_size:
+                return f"screen size changed to {frame.width}x{frame.height}"
+
+            tiles = split_tiles(frame, tile_size)
+            new_hashes = hash_tiles(tiles)
+
+            now = time.monotonic()
+
+            if hashes is None or now - last_keyframe >= SCREEN_KEYFRAME_INTERVAL:
+                kind = SCREEN_KEYFRAME
+                changed = range(len(tiles))
+                last_keyframe = now
+            else:
+                kind = SCREEN_DELTA
+                changed = [index for index, value in enumerate(new_hashes) if value != hashes[index]]
+
+            hashes = new_hashes
+
+            if changed or now - last_send >= SCREEN_IDLE_INTERVAL:
+
+                columns, _ = tile_grid(frame.width, frame.height, tile_size)
+                size = self.__send(stream, kind, len(changed), pack_tiles(tiles, changed, columns))
+
+                last_send = time.monotonic()
+                tokens -= size
+
+            frame = None
+
+            # Frame rate cap, slow captures just lower the rate
+            next_frame = max(next_frame + interval, time.monotonic())
+            wait = next_frame - time.monotonic()
+
+            # Bandwidth cap
+            if bandwidth > 0:
+                now = time.monotonic()
+                tokens = min(bandwidth, tokens + (now - last_refill) * bandwidth)
+                last_refill = now
+
+                if tokens < 0:
+                    wait = max(wait, -tokens / bandwidth)
+
+            if wait > 0 and stream["stop"].wait(wait):
+                break
+
+        return SCREEN_STATUS_STOPPED
+
+    @staticmethod
+    def __send(stream: dict, kind: str, count: int, records: bytes) -> int:
+        """
+            Send one frame, header and compressed tiles in one call.
+
+            Return bytes sent
+        """
+
+        data = stream["data"]
+
+        payload = zlib.compress(records, stream["level"]) if records else b""
+
+        stream["frames"] += 1
+
+        header = c_protocol.format_frame(f"{SCREEN_FRAME_MSG}>{stream['id']},{stream['frames']},{kind},{count},{len(payload)}", data)
+        frame = header + c_encryption(data).encrypt(payload)
+
+        c_protocol.send_frame_data(frame, data)
+
+        stream["sent"] += len(frame)
+
+        return len(frame)
+
+
+# Shared by every connection
+SCREEN_STREAMS = c_screen_streams()
+
+#  endregion
+
+
+#  region @ Directory Scan
+
+DIR_PAGE_MAX_SIZE: int = 100000         # Entries limit of one page
+DIR_FRAME_SIZE: int = 64 * 1024         # Entries bytes in one binary frame
+DIR_FRAME_SIZE_TEXT: int = 8 * 1024     # Entries bytes in one text frame, 4 digits header
+
+DIR_TYPE_FILE: str = "file"
+DIR_TYPE_DIR: str = "dir"
+DIR_TYPE_LINK: str = "link"
+DIR_TYPE_OTHER: str = "other"
+
+
+def scan_directory(path: str, recursive: bool = False, on_folder: any = None, skip: int = 0) -> any:
+    """
+        Yield [relative path, type, size, mtime] of every entry,
+        one directory is open at a time.
+
+        Type comes from the directory entry itself and the
+        size / mtime from its cached stat (free on Windows, one lstat on posix).
+        Links are listed but never followed.
+
+        on_folder(folder path) is called before every folder is read.
+        The first skip entries are passed over without their stat (page cursor)
+    """
+
+    folders = [""]
+
+    while folders:
+        relative = folders.pop()
+
+        if on_folder is not None:
+            on_folder(os.path.join(path, relative) if relative else path)
+
+        try:
+            entries = os.scandir(os.path.join(path, relative) if relative else path)
+
+        except OSError:
+
+            # The listed path itself must exist, sub folders may vanish / be locked
+            if relative == "":
+                raise
+
+            continue
+
+        with entries:
+            for entry in entries:
+                name = os.path.join(relative, entry.name)
+
+                if skip > 0:
+                    skip -= 1
+
+                    # Only the type is needed to keep walking, it comes with the entry
+                    try:
+                        is_folder = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        is_folder = False
+
+                else:
+                    information = entry_information(entry, name)
+                    yield information
+
+                    is_folder = information[1] == DIR_TYPE_DIR
+
+                if recursive and is_folder:
+                    folders.append(name)
+
+
+def entry_information(entry: os.DirEntry, name: str) -> list:
+    """
+        Returns [name, type, size, mtime] of scandir entry
+    """
+
+    try:
+
+        if entry.is_symlink():
+            entry_type = DIR_TYPE_LINK
+        elif entry.is_dir(follow_symlinks=False):
+            entry_type = DIR_TYPE_DIR
+        elif entry.is_file(follow_symlinks=False):
+            entry_type = DIR_TYPE_FILE
+        else:
+            entry_type = DIR_TYPE_OTHER
+
+        stat = entry.stat(follow_symlinks=False)
+
+        return [name, entry_type, stat.st_size, stat.st_mtime]
+
+    except OSError:
+
+        # Removed while listing
+        return [name, DIR_TYPE_OTHER, 0, 0]
+
+#  endregion
+
+
+#  region @ Directory Cache
+
+DIR_CACHE_SIZE: int = 256                   # Listings kept
+DIR_CACHE_MAX_ENTRIES: int = 200000         # Bigger listings are streamed without the cache
+DIR_CACHE_MAX_TOTAL_ENTRIES: int = 500000   # Entries kept over all the listings
+DIR_CACHE_MAX_AGE: float = 5                # Seconds a listing is trusted without inotify, files can change in place
+DIR_CACHE_RACY_SECONDS: float = 2           # Folders changed this close to the scan are not cached (coarse timestamps)
+
+DIR_CACHE_MODE_INOTIFY: str = "inotify"     # Linux watcher invalidates the listings
+DIR_CACHE_MODE_MTIME: str = "mtime"         # Folders mtime is checked on every hit
+
+# inotify flags, see <sys/inotify.h>
+IN_MODIFY: int = 0x00000002
+IN_ATTRIB: int = 0x00000004
+IN_MOVED_FROM: int = 0x00000040
+IN_MOVED_TO: int = 0x00000080
+IN_CREATE: int = 0x00000100
+IN_DELETE: int = 0x00000200
+IN_DELETE_SELF: int = 0x00000400
+IN_MOVE_SELF: int = 0x00000800
+IN_Q_OVERFLOW: int = 0x00004000
+IN_IGNORED: int = 0x00008000
+IN_ONLYDIR: int = 0x01000000
+IN_CLOEXEC: int = 0o2000000
+
+IN_FOLDER_CHANGES: int = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+                          IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+INOTIFY_EVENT = struct.Struct("iIII")   # Watch descriptor, mask, cookie, name length
+
+
+class c_folder_watcher:
+    """
+        Folder Watcher Class. Linux only.
+
+        Thin inotify wrapper, calls on_change(watch descriptor)
+        from its own thread for every change in a watched folder.
+        on_change(None) means events were lost
+    """
+
+    def __init__(self, on_change: any):
+
+        import ctypes
+        import ctypes.util
+
+        if not sys.platform.startswith("linux"):
+            raise Exception("inotify is not supported")
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+
+        self._fd: int = self._libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self._on_change = on_change
+
+        threading.Thread(target=self.__process, name="folder watcher", daemon=True).start()
+
+    def watch(self, path: str) -> int:
+        """
+            Watch folder, return watch descriptor or -1 on fail.
+            Same folder returns the same descriptor
+        """
+
+        return self._libc.inotify_add_watch(self._fd, os.fsencode(path), IN_FOLDER_CHANGES)
+
+    def unwatch(self, descriptor: int):
+        self._libc.inotify_rm_watch(self._fd, descriptor)
+
+    def __process(self):
+
+        while True:
+
+            try:
+                events = os.read(self._fd, 64 * 1024)
+
+            except OSError as e:
+                write_to_log(f"  Protocol 2.7  - folder watcher stopped : {e}")
+                return
+
+            offset = 0
+            while offset < len(events):
+                descriptor, mask, _, name_size = INOTIFY_EVENT.unpack_from(events, offset)
+                offset += INOTIFY_EVENT.size + name_size
+
+                self._on_change(None if mask & IN_Q_OVERFLOW else descriptor)
+
+
+class c_dir_cache:
+    """
+        Directory Cache Class. Shared by every connection.
+
+        LRU of directory listings by path. On Linux an inotify watcher
+        drops the listing once any of its folders changes, otherwise
+        the folders mtime is checked on every hit.
+
+        Folders with too many entries are remembered the same way,
+        so their next pages do not scan them again just to find out.
+
+        Bounded by the listings count and by their total entries
+    """
+
+    def __init__(self, max_size: int = DIR_CACHE_SIZE, max_age: float = DIR_CACHE_MAX_AGE, use_inotify: bool = True,
+                 max_entries: int = DIR_CACHE_MAX_TOTAL_ENTRIES):
+
+        self._lock = threading.Lock()
+
+        # Key -> value, folders [(path, mtime_ns)], watch descriptors, time
+        self._items = OrderedDict()
+
+        # Key -> invalidations count, listings scanned during a change are not stored
+        self._versions = {}
+
+        # Watch descriptor -> {key: references}, scans and stored listings hold one each
+        self._watches = {}
+
+        self._max_size: int = max_size
+        self._max_age: float = max_age
+        self._max_entries: int = max_entries
+
+        # Entries count of the stored listings
+        self._entries: int = 0
+
+        # Counters
+        self._hits: int = 0
+        self._misses: int = 0
+        self._invalidations: int = 0
+
+        # Watcher is started on the first listing, clients never need it
+        self._watcher: c_folder_watcher = None
+        self._use_inotify: bool = use_inotify
+        self._started: bool = False
+
+    def listing(self, path: str, recursive: bool = False) -> list:
+        """
+            Get json encoded [name, type, size, mtime] entries of the folder.
+
+            Return None if the folder has too many entries to keep,
+            this answer is cached like a listing
+        """
+
+        path = os.path.abspath(path)
+
+        def load(on_folder):
+
+            result = []
+
+            for entry in scan_directory(path, recursive, on_folder):
+                if len(result) == DIR_CACHE_MAX_ENTRIES:
+                    return None
+
+                result.append(json.dumps(entry))
+
+            return result
+
+        return self.__lookup((DIR_MODE_WALK if recursive else DIR_MODE_SCAN, path), load)
+
+    def names(self, pattern: str, folder: str) -> str:
+        """
+            Get the glob matches of the pattern inside the folder
+        """
+
+        def load(on_folder):
+
+            on_folder(folder)
+
+            return ", ".join(glob.glob(pattern))
+
+        return self.__lookup(("glob", pattern), load)
+
+    def invalidate(self):
+        """
+            Drop every listing
+        """
+
+        with self._lock:
+            for key in list(self._items):
+                self.__drop(key)
+
+    def stats(self) -> dict:
+        """
+            Returns cache counters
+        """
+
+        with self._lock:
+
+            total = self._hits + self._misses
+
+            return {
+                "mode": DIR_CACHE_MODE_INOTIFY if self._watcher is not None else DIR_CACHE_MODE_MTIME,
+                "size": len(self._items),
+                "entries": self._entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "invalidations": self._invalidations,
+                "hit_rate": self._hits / total if total > 0 else 0.0
+            }
+
+    def __lookup(self, key: tuple, load: any) -> any:
+        """
+            Get cached value or load and store it.
+
+            load(on_folder) must call on_folder(path) before reading every folder
+        """
+
+        with self._lock:
+
+            self.__start_watcher()
+
+            item = self._items.get(key)
+
+            if item is not None and self.__is_valid(item):
+
+                # Most recently used goes to the end
+                self._items.move_to_end(key)
+                self._hits += 1
+
+                return item["value"]
+
+            if item is not None:
+                self.__drop(key)
+
+            self._misses += 1
+            version = self._versions.get(key, 0)
+
+        folders = []
+        watches = []
+        start = time.time_ns()
+
+        def on_folder(folder: str):
+
+            # Watch before reading, so no change can slip between them
+            if self._watcher is not None:
+                descriptor = self._watcher.watch(folder)
+                watches.append(descriptor)
+
+                with self._lock:
+                    if descriptor >= 0:
+                        keys = self._watches.setdefault(descriptor, {})
+                        keys[key] = keys.get(key, 0) + 1
+
+            try:
+                folders.append((folder, os.stat(folder).st_mtime_ns))
+            except OSError:
+                folders.append((folder, -1))
+
+        try:
+
+            # Scan without the lock, errors go to the caller
+            value = load(on_folder)
+
+        except Exception:
+
+            with self._lock:
+                self.__release(key, watches)
+
+            raise
+
+        with self._lock:
+
+            if not self.__store(key, version, value, folders, watches, start):
+                self.__release(key, watches)
+
+        return value
+
+    def __start_watcher(self):
+        """
+            Start the inotify watcher on first use.
+            Note ! Called with the lock
+        """
+
+        if self._started:
+            return
+
+        self._started = True
+
+        if self._use_inotify:
+            try:
+                self._watcher = c_folder_watcher(self.__on_folder_change)
+
+            except Exception as e:
+                write_to_log(f"  Protocol 2.7  - dir cache uses mtime checks : {e}")
+
+    def __store(self, key: tuple, version: int, value: any, folders: list, watches: list, start: int) -> bool:
+        """
+            Store scanned listing, return false if it can not be trusted.
+            Note ! Called with the lock
+        """
+
+        # Changed while we were scanning / other scan already stored it
+        if self._versions.get(key, 0) != version or key in self._items:
+            return False
+
+        # Listing alone would push everything else out
+        entries = self.__entries_of(value)
+        if entries > self._max_entries:
+            return False
+
+        # Every folder has a live watch, the watcher drops the listing.
+        # Note ! The scan references now belong to the listing
+        if self._watcher is not None and watches and min(watches) >= 0:
+            item_watches = watches
+
+        else:
+            item_watches = None
+
+            # Coarse timestamps can hide a change that came right after the scan
+            racy = start - int(DIR_CACHE_RACY_SECONDS * 1e9)
+            if any(mtime < 0 or mtime > racy for _, mtime in folders):
+                return False
+
+            # Watches are not needed for mtime checks
+            self.__release(key, watches)
+            watches.clear()
+
+        self._items[key] = {
+            "value": value,
+            "folders": folders,
+            "watches": item_watches,
+            "entries": entries,
+            "time": time.monotonic()
+        }
+        self._entries += entries
+
+        # Drop the least recently used
+        while len(self._items) > self._max_size or self._entries > self._max_entries:
+            self.__drop(next(iter(self._items)))
+
+        return True
+
+    def __is_valid(self, item: dict) -> bool:
+        """
+            Note ! Called with the lock
+        """
+
+        if item["watches"] is not None:
+            return True
+
+        if time.monotonic() - item["time"] > self._max_age:
+            return False
+
+        try:
+            for folder, mtime in item["folders"]:
+                if os.stat(folder).st_mtime_ns != mtime:
+                    return False
+
+        except OSError:
+            return False
+
+        return True
+
+    def __drop(self, key: tuple):
+        """
+            Remove listing and its watches.
+            Note ! Called with the lock
+        """
+
+        item = self._items.pop(key, None)
+        if item is None:
+            return
+
+        self._entries -= item["entries"]
+        self.__release(key, item["watches"] or ())
+
+    @staticmethod
+    def __entries_of(value: any) -> int:
+        """
+            Count the entries of a listing, glob names and markers count as one
+        """
+
+        return len(value) if isinstance(value, list) else 1
+
+    def __release(self, key: tuple, watches: list):
+        """
+            Remove the key from the watches, unwatch unused folders.
+            Note ! Called with the lock
+        """
+
+        for descriptor in watches:
+            keys = self._watches.get(descriptor)
+            if keys is None or key not in keys:
+                continue
+
+            keys[key] -= 1
+            if keys[key] == 0:
+                del keys[key]
+
+            if not keys:
+                del self._watches[descriptor]
+                self._watcher.unwatch(descriptor)
+
+    def __on_folder_change(self, descriptor: any):
+        """
+            Watcher callback, drop every listing of the folder
+        """
+
+        with self._lock:
+
+            # Lost events, nothing can be trusted
+            if descriptor is None:
+                keys = list(self._items)
+            else:
+                keys = list(self._watches.get(descriptor, ()))
+
+            for key in keys:
+                self._versions[key] = self._versions.get(key, 0) + 1
+                self._invalidations += 1
+
+                self.__drop(key)
+
+
+# Shared by every connection, the watcher starts on the first DIR
+DIR_CACHE = c_dir_cache()
+
+#  endregion
+
+
+#  region @ Photo Hashes
+
+PHOTO_HASH_NAME: str = "sha256"             # Content hash of offered photos
+PHOTO_HASH_SIZE: int = 64                   # Hex digest length
+PHOTO_HASH_CHUNK: int = 1024 * 1024         # Bytes hashed at once
+PHOTO_HASH_CACHE_SIZE: int = 1024           # Hashes kept
+PHOTO_HASH_RACY_SECONDS: float = 2          # Files changed this close to the hashing are not cached (coarse timestamps)
+
+PHOTO_STORE_MAX_SIZE: int = 1024 * 1024 * 1024     # Client store bytes, the least recently used photos are removed
+
+
+def file_hash(file_name: str) -> str:
+    """
+        Hex content hash of the file
+    """
+
+    digest = hashlib.new(PHOTO_HASH_NAME)
+
+    with open(file_name, "rb", buffering=0) as file:
+
+        chunk = bytearray(PHOTO_HASH_CHUNK)
+        view = memoryview(chunk)
+
+        while True:
+            size = file.readinto(view)
+
+            if not size:
+                break
+
+            digest.update(view[:size])
+
+    return digest.hexdigest()
+
+
+def is_content_hash(value: str) -> bool:
+    """
+        Hashes name store files, anything else must not get near the file system
+    """
+
+    return type(value) == str and len(value) == PHOTO_HASH_SIZE and all(c in string.hexdigits for c in value)
+
+
+class c_photo_hashes:
+    """
+        Photo Hashes Class.
+
+        Content hashes of offered files by path, mtime and size,
+        so the same file is read once no matter how often it is offered.
+        A changed file gets a new key and is hashed again
+    """
+
+    def __init__(self, max_size: int = PHOTO_HASH_CACHE_SIZE):
+
+        self._lock = threading.Lock()
+
+        # (path, mtime, size) -> hash
+        self._items = OrderedDict()
+        self._max_size: int = max_size
+
+        self._hits: int = 0
+        self._misses: int = 0
+
+    def get(self, file_name: str) -> (str, int):
+        """
+            Return the file content hash and size
+        """
+
+        stat = os.stat(file_name)
+        key = (os.path.abspath(file_name), stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+
+            content_hash = self._items.get(key)
+
+            if content_hash is not None:
+                self._items.move_to_end(key)
+                self._hits += 1
+
+                return content_hash, stat.st_size
+
+            self._misses += 1
+
+        content_hash = file_hash(file_name)
+
+        # Changed while hashing or can still change without a new mtime
+        after = os.stat(file_name)
+        if (after.st_mtime_ns, after.st_size) != key[1:] or time.time() - after.st_mtime < PHOTO_HASH_RACY_SECONDS:
+            return content_hash, after.st_size
+
+        with self._lock:
+
+            self._items[key] = content_hash
+            self._items.move_to_end(key)
+
+            while len(self._items) > self._max_size:
+                self._items.popitem(last=False)
+
+        return content_hash, stat.st_size
+
+    def stats(self) -> dict:
+        """
+            Returns cache counters
+        """
+
+        with self._lock:
+
+            total = self._hits + self._misses
+
+            return {
+                "size": len(self._items),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / total if total > 0 else 0.0
+            }
+
+
+# Shared by every connection
+PHOTO_HASHES = c_photo_hashes()
+
+
+class c_photo_store:
+    """
+        Photo Store Class.
+
+        Client side content addressed store of received photos.
+        Photos are named by their content hash, an interrupted
+        transfer stays as part file and continues from its size
+    """
+
+    def __init__(self, folder: str = PHOTO_STORE_FOLDER, max_size: int = PHOTO_STORE_MAX_SIZE):
+
+        self._folder: str = folder
+        self._max_size: int = max_size
+
+        self._lock = threading.Lock()
+
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, content_hash: str) -> str:
+
+        if not is_content_hash(content_hash):
+            raise Exception(f"Invalid content hash {content_hash}")
+
+        return os.path.join(self._folder, content_hash.lower())
+
+    def missing(self, content_hash: str, size: int) -> list:
+        """
+            Ranges of the content the store does not have, as (start, end)
+        """
+
+        path = self.path(content_hash)
+
+        if os.path.isfile(path) and os.path.getsize(path) == size:
+            return []
+
+        part = path + COPY_PART_SUFFIX
+
+        offset = os.path.getsize(part) if os.path.isfile(part) else 0
+
+        # Full part that failed the check, start over
+        if offset >= size:
+            offset = 0
+
+        return [(offset, size)]
+
+    def open_part(self, content_hash: str) -> any:
+        """
+            Open the part file for writing at any offset
+        """
+
+        part = self.path(content_hash) + COPY_PART_SUFFIX
+
+        return open(part, "r+b" if os.path.isfile(part) else "wb")
+
+    def complete(self, content_hash: str, size: int) -> bool:
+        """
+            Check the part file content and move it into the store
+        """
+
+        path = self.path(content_hash)
+        part = path + COPY_PART_SUFFIX
+
+        if os.path.getsize(part) != size or file_hash(part) != content_hash.lower():
+
+            # Never resume from bad data
+            os.remove(part)
+            return False
+
+        os.replace(part, path)
+
+        self.__evict(path)
+
+        return True
+
+    def copy_to(self, content_hash: str, new_file_name: str):
+        """
+            Write stored photo to the new file, the store keeps its own copy
+        """
+
+        path = self.path(content_hash)
+
+        shutil.copyfile(path, new_file_name)
+
+        # Recently used, removed last
+        os.utime(path)
+
+    def __evict(self, keep: str):
+        """
+            Remove the least recently used photos over the size limit
+        """
+
+        with self._lock:
+
+            entries = []
+            total = 0
+
+            with os.scandir(self._folder) as iterator:
+                for entry in iterator:
+
+                    if not entry.is_file() or not is_content_hash(entry.name):
+                        continue
+
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+            entries.sort()
+
+            for mtime, size, path in entries:
+
+                if total <= self._max_size:
+                    break
+
+                if path == keep:
+                    continue
+
+                os.remove(path)
+                total -= size
+
+#  endregion
+
+
+#  region @ Parallel Transfers
+
+PARALLEL_MAX_STREAMS: int = 16                  # Data connections of one transfer
+PARALLEL_MIN_SIZE: int = 8 * 1024 * 1024        # Smaller files are sent on the main connection
+PARALLEL_MIN_RANGE: int = 2 * 1024 * 1024       # Smallest range worth a connection
+PARALLEL_TICKET_TTL: float = 60                 # Seconds the data connections have to ask for the ranges
+PARALLEL_TICKET_SIZE: int = 16                  # Random ticket bytes
+PARALLEL_CONNECT_TIMEOUT: float = 10            # Client data connection timeout
+
+
+class c_parallel_tickets:
+    """
+        Parallel Tickets Class.
+
+        Tickets of parallel transfers. Data connections are not logged in,
+        the ticket holds the file and the key of the connection that asked for it,
+        so every range is encrypted as part of one stream with that key.
+
+        Every range of a ticket is sent once, the ticket is dropped after the last one
+    """
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+
+        # Ticket -> ticket information
+        self._tickets = {}
+
+    def create(self, file_name: str, streams: int, data: dict) -> (str, int, list):
+        """
+            Create ticket for the file.
+
+            Return ticket, file size and the ranges to ask for
+        """
+
+        stat = os.stat(file_name)
+        ticket = secrets.token_hex(PARALLEL_TICKET_SIZE)
+        ranges = split_ranges(stat.st_size, streams)
+
+        with self._lock:
+
+            self.__expire()
+
+            self._tickets[ticket] = {
+                "file": os.path.abspath(file_name),
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "key": utils.find_key(data),
+                "ranges": set(ranges),
+                "expires": time.monotonic() + PARALLEL_TICKET_TTL
+            }
+
+        return ticket, stat.st_size, ranges
+
+    def claim(self, ticket: str, start: int, end: int) -> dict:
+        """
+            Take one range of the ticket, it cannot be asked for again.
+
+            Return the ticket information, None for unknown / expired tickets
+            and ranges that are not part of the ticket or were already sent
+        """
+
+        with self._lock:
+
+            self.__expire()
+
+            information = self._tickets.get(ticket)
+            if information is None or (start, end) not in information["ranges"]:
+                return None
+
+            information["ranges"].discard((start, end))
+
+            # Nothing left to send
+            if not information["ranges"]:
+                del self._tickets[ticket]
+
+            return information
+
+    def count(self) -> int:
+
+        with self._lock:
+            return len(self._tickets)
+
+    def __expire(self):
+        """
+            Note ! Called with the lock
+        """
+
+        now = time.monotonic()
+
+        for ticket in [ticket for ticket, value in self._tickets.items() if value["expires"] < now]:
+            del self._tickets[ticket]
+
+
+def split_ranges(size: int, streams: int) -> list:
+    """
+        Split the file into equal ranges, one per data connection
+    """
+
+    count = max(1, min(streams, PARALLEL_MAX_STREAMS, size // PARALLEL_MIN_RANGE))
+    step = -(-size // count)
+
+    return [(start, min(start + step, size)) for start in range(0, size, step)]
+
+
+def open_data_connection(address: tuple) -> (socket, c_frame_reader, c_frame_codec):
+    """
+        Connect data connection and switch it to binary frames,
+        so the server runs its range request on the workers
+    """
+
+    socket_obj = socket.create_connection(address, PARALLEL_CONNECT_TIMEOUT)
+
+    try:
+        codec = c_frame_codec()
+        reader = c_frame_reader(socket_obj, codec, timeout=PARALLEL_CONNECT_TIMEOUT)
+
+        socket_obj.sendall(c_protocol.format_frame(f"{FRAMING_CMD}>{FRAME_MODE_BINARY}", {"codec": codec}))
+
+        result, message = reader.read_frame()
+        if not result:
+            raise Exception(f"no framing answer : {message}")
+
+        _, arguments = c_protocol.parse(message)
+        if utils.extract(arguments, 0) == FRAME_MODE_BINARY:
+            reader.codec = c_frame_codec(FRAME_MODE_BINARY)
+
+        return socket_obj, reader, reader.codec
+
+    except Exception:
+        socket_obj.close()
+        raise
+
+
+# Shared by every connection
+PARALLEL_TICKETS = c_parallel_tickets()
+
+#  endregion
+
+
+#  region @ Protocol Utils
+
+PHOTO_INFORMATION_COMMAND: str = PHOTO_INFO_MSG
+
+
+def dir_command(data: dict) -> str:
+    """
+        Get list of files in a specific path
+    """
+
+    arguments = utils.extract(data, "arguments")
+    if not arguments:
+        return "Failed to receive path"
+
+    # Paginated scandir mode
+    mode = utils.extract(arguments, 1)
+    if mode == DIR_MODE_SCAN or mode == DIR_MODE_WALK:
+        return dir_scan_command(arguments[0], mode == DIR_MODE_WALK, arguments[2:], data)
+
+    current_dir: str = str(arguments[0]) + "\\" + "*.*"
+
+    # Polled folders are served from memory
+    return DIR_CACHE.names(current_dir, str(arguments[0]))
+
+
+def dir_scan_command(path: str, recursive: bool, page: list, data: dict) -> str:
+    """
+        Send one page of the directory listing.
+
+        Entries are sent in DIR_ENTRIES>cursor,[[name, type, size, mtime], ...] frames,
+        then DIR_END>next cursor,count is returned. Next cursor is -1 after the last page.
+
+        Listings come from the shared cache, folders too big for it are scanned while sending
+    """
+
+    try:
+        cursor = int(utils.extract(page, 0) or 0)
+        page_size = min(int(utils.extract(page, 1) or DIR_PAGE_SIZE), DIR_PAGE_MAX_SIZE)
+
+    except ValueError:
+        return f"Invalid cursor {page}"
+
+    if cursor < 0 or page_size <= 0:
+        return f"Invalid cursor {page}"
+
+    frame_size = DIR_FRAME_SIZE
+    if c_protocol.find_codec(data).mode == FRAME_MODE_TEXT:
+        frame_size = DIR_FRAME_SIZE_TEXT
+
+    try:
+        listing = DIR_CACHE.listing(path, recursive)
+
+    except OSError as e:
+
+        # Listed path does not exist / not a folder
+        return f"Failed to scan {path} : {e}"
+
+    # One more entry tells if there is a next page
+    if listing is not None:
+
+        # Cached entries are already encoded
+        entries = listing[cursor:cursor + page_size + 1]
+
+    else:
+
+        # Too big to keep, stream it. Entries before the cursor are not stat-ed
+        entries = (json.dumps(entry) for entry in
+                   itertools.islice(scan_directory(path, recursive, skip=cursor), page_size + 1))
+
+    batch = []
+    batch_size = 0
+    batch_cursor = cursor
+
+    count = 0
+    has_more = False
+
+    try:
+
+        for value in entries:
+
+            if count == page_size:
+                has_more = True
+                break
+
+            # Frame is full, send it
+            if batch and batch_size + len(value) + 1 > frame_size:
+                c_protocol.send_frame(f"{DIR_ENTRIES_MSG}>{batch_cursor},[{','.join(batch)}]", data)
+
+                batch_cursor = cursor + count
+                batch = []
+                batch_size = 0
+
+            batch.append(value)
+            batch_size += len(value) + 1
+            count += 1
+
+    except OSError as e:
+
+        # Listed path does not exist / not a folder
+        if count == 0:
+            return f"Failed to scan {path} : {e}"
+
+    if batch:
+        c_protocol.send_frame(f"{DIR_ENTRIES_MSG}>{batch_cursor},[{','.join(batch)}]", data)
+
+    next_cursor = cursor + count if has_more else -1
+
+    return f"{DIR_END_MSG}>{next_cursor},{count}"
+
+
+def delete_command(data: dict) -> str:
+    """
+        Delete a specific file
+    """
+
+    arguments = utils.extract(data, "arguments")
+    if not arguments:
+        return "Failed to receive arguments"
+
+    file_path = arguments[0]
+
+    # Check if we have the file to delete
+    if not os.path.exists(file_path):
+        return f"File {file_path} was not deleted"
+
+    # Delete it
+    os.remove(file_path)
+
+    # Check if it got deleted
+    if not os.path.exists(file_path):
+        return f"File {file_path} was deleted"
+
+    return f"File {file_path} was not deleted"
+
+
+def copy_command(data: dict) -> str:
+    """
+        Copy file from One path to other path
+    """
+
+    arguments = utils.extract(data, "arguments")
+    if not arguments:
+        return "Failed to receive arguments"
+
+    file_path_from = arguments[0]
+    file_path_to = arguments[1]
+
+    # Chunked resumable copy, runs in the background
+    if utils.extract(arguments, 2) == COPY_MODE_BACKGROUND:
+        job_id, error = COPY_JOBS.start(file_path_from, file_path_to, data)
+
+        return error  # None, job sent the started frame by itself
+
+    if os.path.exists(file_path_from):
+        shutil.copy(file_path_from, file_path_to)
+
+        return f"Copy file from {file_path_from} to {file_path_to}"
+
+    return f"Failed to copy file from {file_path_from}"
+
+
+def copy_cancel_command(data: dict) -> str:
+    """
+        Cancel background copy
+    """
+
+    arguments = utils.extract(data, "arguments")
+    if not arguments:
+        return "Failed to receive arguments"
+
+    try:
+        job_id = int(arguments[0])
+
+    except ValueError:
+        return f"Invalid copy {arguments[0]}"
+
+    if COPY_JOBS.cancel(job_id, utils.extract(data, "socket")):
+        return f"Copy {job_id} is cancelling"
+
+    return f"Copy {job_id} was not found"
+
+
+def execute_command(data: dict) -> str:
+    """
+        Execute command
+    """
+
+    arguments = utils.extract(data, "arguments")
+    if not arguments:
+        return "Failed to receive arguments"
+
+    command = arguments[0]
+
+    # Streamed mode, runs in the background
+    if utils.extract(arguments, 1) == EXECUTE_MODE_STREAM:
+        return execute_stream_command(command, utils.extract(arguments, 2), data)
+
+    result = subprocess.call(command)
+
+    if result == 0:
+        return f"Failed to execute {command}"
+
+    return f"Successfully executed {command}"
+
+
+def execute_stream_command(command: str, timeout: any, data: dict) -> any:
+    """
+        Start streamed execute job.
+
+        The client receives EXECUTE_STARTED>job, then EXECUTE_OUTPUT>job,stdout/stderr,output
+        frames and finally EXECUTE_EXIT>job,return code / timeout / cancelled
+    """
 
+    try:
+        timeout = EXECUTE_TIMEOUT if timeout is None or timeout == "" else float(timeout)
 
-#  region @ Protocol Utils
+    except ValueError:
+        return f"Invalid timeout {timeout}"
 
-PHOTO_INFORMATION_COMMAND: str = "PHOTO_INFORMATION"
+    job_id, error = EXECUTE_JOBS.start(command, timeout, data)
 
+    if error is not None:
+        return error
 
-def dir_command(data: dict) -> str:
+    return None  # Job sent the started frame by itself
+
+
+def execute_cancel_command(data: dict) -> str:
     """
-        Get list of files in a specific path
+        Cancel streamed execute job
     """
 
     arguments = utils.extract(data, "arguments")
     if not arguments:
-        return "Failed to receive path"
+        return "Failed to receive arguments"
 
-    current_dir: str = str(arguments[0]) + "\\" + "*.*"
-    directory_list = glob.glob(current_dir)
+    try:
+        job_id = int(arguments[0])
 
-    return str(", ".join(directory_list))
+    except ValueError:
+        return f"Invalid job {arguments[0]}"
 
+    if EXECUTE_JOBS.cancel(job_id, utils.extract(data, "socket")):
+        return f"Job {job_id} is cancelling"
 
-def delete_command(data: dict) -> str:
+    return f"Job {job_id} was not found"
+
+
+def screenshot_command(data: dict) -> str:
     """
-        Delete a specific file
+        Take ScreenShot
     """
 
     arguments = utils.extract(data, "arguments")
     if not arguments:
         return "Failed to receive arguments"
 
-    file_path = arguments[0]
+    file_name = arguments[0]
 
-    # Check if we have the file to delete
-    if not os.path.exists(file_path):
-        return f"File {file_path} was not deleted"
+    # Send the image straight to the client
+    if utils.extract(arguments, 1) == SCREENSHOT_MODE_STREAM:
+        return screenshot_stream_command(file_name, arguments[2:], data)
 
-    # Delete it
-    os.remove(file_path)
+    try:
+        save_screen(file_name)
 
-    # Check if it got deleted
-    if not os.path.exists(file_path):
-        return f"File {file_path} was deleted"
+    except Exception as e:
+        return f"Failed to take screenshot : {e}"
 
-    return f"File {file_path} was not deleted"
+    if os.path.exists(file_name):
+        return "Screenshot was taken"
+
+    return "Failed to take screenshot"
 
 
-def copy_command(data: dict) -> str:
+def screenshot_stream_command(new_file_name: str, options: list, data: dict) -> any:
     """
-        Copy file from One path to other path
+        Capture, encode in memory and send the image as photo transfer,
+        nothing is written on the server.
+
+        TAKE_SCREENSHOT>new file name,stream[,format[,level]]
     """
 
-    arguments = utils.extract(data, "arguments")
-    if not arguments:
-        return "Failed to receive arguments"
+    image_format = utils.extract(options, 0) or CAPTURE_FORMAT_PNG
 
-    file_path_from = arguments[0]
-    file_path_to = arguments[1]
+    try:
+        level = utils.extract(options, 1)
+        level = None if level is None or level == "" else int(level)
 
-    if os.path.exists(file_path_from):
-        shutil.copy(file_path_from, file_path_to)
+        image = capture_screen(image_format, level)
 
-        return f"Copy file from {file_path_from} to {file_path_to}"
+    except Exception as e:
+        return f"Failed to take screenshot : {e}"
 
-    return f"Failed to copy file from {file_path_from}"
+    view = image.getbuffer()
+    size = view.nbytes
 
+    start = time.perf_counter()
 
-def execute_command(data: dict) -> str:
+    # Header and image in one call, so no other response can get between them
+    header = c_protocol.format_frame(f"{PHOTO_INFORMATION_COMMAND}>{size},{size},{new_file_name}", data)
+    c_protocol.send_frame_data(header + c_encryption(data).encrypt(view), data)
+
+    TRANSFER_STATS.add(TRANSFER_MODE_MEMORY, size, time.perf_counter() - start)
+
+    return None  # Avoid interrupting with the data flow
+
+
+def screen_stream_command(data: dict) -> any:
     """
-        Execute command
+        Start screen stream.
+
+        SCREEN_STREAM>[fps[,bandwidth KB/s[,level[,tile size]]]]
+
+        The client receives SCREEN_STARTED>stream,width,height,tile size,
+        then SCREEN_FRAME>stream,frame,key/delta,tiles,size frames followed by
+        the compressed tiles and finally SCREEN_END>stream,status
     """
 
-    arguments = utils.extract(data, "arguments")
-    if not arguments:
-        return "Failed to receive arguments"
+    arguments = utils.extract(data, "arguments") or []
 
-    command = arguments[0]
-    result = subprocess.call(command)
+    # Empty values take the defaults
+    options = [utils.extract(arguments, index) or None for index in range(4)]
 
-    if result == 0:
-        return f"Failed to execute {command}"
+    try:
+        fps = SCREEN_DEFAULT_FPS if options[0] is None else float(options[0])
+        bandwidth = 0 if options[1] is None else float(options[1]) * 1024
+        level = SCREEN_DEFAULT_LEVEL if options[2] is None else int(options[2])
+        tile_size = SCREEN_TILE_SIZE if options[3] is None else int(options[3])
 
-    return f"Successfully executed {command}"
+    except ValueError:
+        return f"Invalid screen stream options {','.join(arguments)}"
 
+    if fps <= 0 or fps > SCREEN_MAX_FPS:
+        return f"Invalid fps {fps}"
 
-def screenshot_command(data: dict) -> str:
+    if bandwidth < 0:
+        return f"Invalid bandwidth {options[1]}"
+
+    if level < 0 or level > 9:
+        return f"Invalid level {level}"
+
+    if tile_size < 8 or tile_size > 1024:
+        return f"Invalid tile size {tile_size}"
+
+    stream_id, error = SCREEN_STREAMS.start(fps, bandwidth, level, tile_size, data)
+
+    if error is not None:
+        return error
+
+    return None  # Stream sent the started frame by itself
+
+
+def screen_stop_command(data: dict) -> str:
     """
-        Take ScreenShot
+        Stop screen stream
     """
 
     arguments = utils.extract(data, "arguments")
     if not arguments:
         return "Failed to receive arguments"
 
-    file_name = arguments[0]
-    image = pyautogui.screenshot()
-    image.save(file_name)
+    try:
+        stream_id = int(arguments[0])
 
-    if os.path.exists(file_name):
-        return "Screenshot was taken"
+    except ValueError:
+        return f"Invalid screen stream {arguments[0]}"
 
-    return "Failed to take screenshot"
+    if SCREEN_STREAMS.stop(stream_id, utils.extract(data, "socket")):
+        return f"Screen stream {stream_id} is stopping"
+
+    return f"Screen stream {stream_id} was not found"
 
 
 def send_photo_command(data: dict) -> any:
@@ -145,37 +2153,233 @@ def send_photo_command(data: dict) -> any:
     if not os.path.exists(file_name):
         return f"{PHOTO_INFORMATION_COMMAND}>{-1},{file_name}"
 
-    # Get file size
-    file_size = os.path.getsize(file_name)
+    # Client has a photo store, it fetches only the content it does not have
+    if utils.extract(arguments, 2) == PHOTO_MODE_OFFER:
+        content_hash, file_size = PHOTO_HASHES.get(file_name)
 
-    # Get photo bytes
-    raw_data = b''
-    with open(file_name, 'rb') as file:
-        raw_data = c_encryption(data).encrypt(file.read())  # encrypt_bytes(file.read(), data)  # Encrypt if you need
+        return f"{PHOTO_OFFER_MSG}>{content_hash},{file_size},{file_name},{new_file_name}"
 
-    # Get length of the raw data
-    raw_size = len(raw_data)
+    # Big files go over many data connections, small ones are not worth the connections
+    if utils.extract(arguments, 2) == PHOTO_MODE_PARALLEL and os.path.getsize(file_name) >= PARALLEL_MIN_SIZE:
+        return send_photo_parallel(file_name, new_file_name, utils.extract(arguments, 3), data)
+
+    # Get file size, XOR keeps the raw data the same size
+    file_size = os.path.getsize(file_name)
+    raw_size = file_size
 
     # Inform the client
     alart_message: str = f"{PHOTO_INFORMATION_COMMAND}>{file_size},{raw_size},{new_file_name}"
-    alart_message = c_encryption(data).encrypt(alart_message).decode()
-    alart_message = c_protocol.format_value(alart_message)
-    socket_obj.send(alart_message.encode())
+    c_protocol.send_frame_data(c_protocol.format_frame(alart_message, data), data)
 
     # Now we can send the photo raw data
-    total_sent = 0
+    with open(file_name, 'rb') as file:
+        send_file_data(socket_obj, file, raw_size, data)
+
+    return None  # Avoid interrupting with the data flow
+
+
+def send_photo_parallel(file_name: str, new_file_name: str, streams: any, data: dict) -> str:
+    """
+        Create parallel transfer ticket.
+
+        PHOTO_PARALLEL>ticket,file size,new file name,start-end[,start-end...]
+        The client asks for every range on its own data connection
+    """
+
+    try:
+        streams = PHOTO_PARALLEL_STREAMS if not streams else int(streams)
+
+    except ValueError:
+        return f"Invalid streams {streams}"
+
+    if streams < 1:
+        return f"Invalid streams {streams}"
+
+    ticket, file_size, ranges = PARALLEL_TICKETS.create(file_name, streams, data)
+
+    ranges = ",".join(f"{start}-{end}" for start, end in ranges)
+
+    return f"{PHOTO_PARALLEL_MSG}>{ticket},{file_size},{new_file_name},{ranges}"
+
+
+def photo_range_command(data: dict) -> any:
+    """
+        Send one range of parallel transfer, on a data connection.
+
+        PHOTO_RANGE>ticket,start-end
+
+        Answered with PHOTO_RANGE>start,end followed by the range data,
+        encrypted with the key of the connection that got the ticket
+    """
+
+    arguments = utils.extract(data, "arguments")
+    if not arguments or len(arguments) < 2:
+        return "Failed to receive arguments"
+
+    socket_obj: socket = utils.extract(data, "socket")
+    if not socket_obj:
+        return "Failed to find socket object"
+
+    try:
+        start, end = (int(number) for number in arguments[1].split("-"))
+
+    except ValueError:
+        return f"Invalid photo range {arguments[1]}"
+
+    # One time only, the same range cannot be asked for again
+    ticket = PARALLEL_TICKETS.claim(arguments[0], start, end)
+    if ticket is None:
+        return "Invalid transfer ticket"
+
+    try:
+        file = open(ticket["file"], 'rb')
+
+    except OSError:
+        return "Failed to find photo"
+
+    with file:
+
+        # Ranges of a changed file would not fit together
+        stat = os.fstat(file.fileno())
+        if (stat.st_mtime_ns, stat.st_size) != (ticket["mtime"], ticket["size"]):
+            return PHOTO_CHANGED_STATUS
+
+        # Range header and data, no other frame can get between them
+        with utils.extract(data, "send_lock") or nullcontext():
+            socket_obj.sendall(c_protocol.format_frame(f"{PHOTO_RANGE_CMD}>{start},{end}", data))
+            send_file_data(socket_obj, file, end - start, dict(data, key=ticket["key"]), start)
+
+    return None  # Avoid interrupting with the data flow
+
+
+def photo_fetch_command(data: dict) -> any:
+    """
+        Send ranges of offered photo.
+
+        PHOTO_FETCH>file name,content hash,new file name,start-end[,start-end...]
+
+        Answered with PHOTO_INFORMATION>file size,ranges size,new file name,content hash,ranges...
+        followed by the ranges data one after the other
+    """
+
+    arguments = utils.extract(data, "arguments")
+    if not arguments or len(arguments) < 4:
+        return "Failed to receive arguments"
+
+    socket_obj: socket = utils.extract(data, "socket")
+    if not socket_obj:
+        return "Failed to find socket object"
+
+    file_name, content_hash, new_file_name = arguments[:3]
+
+    if not os.path.exists(file_name):
+        return f"{PHOTO_INFORMATION_COMMAND}>{-1},{file_name}"
+
+    current_hash, file_size = PHOTO_HASHES.get(file_name)
+
+    # File changed since the offer, the client must ask again
+    if current_hash != content_hash:
+        return f"{PHOTO_INFORMATION_COMMAND}>{-3},{file_name}"
 
-    while total_sent < raw_size:
-        remaining = raw_data[total_sent:]
-        size = min(BUFFER_SIZE, len(remaining))
-        chunk = remaining[:size]
+    ranges = []
 
-        socket_obj.send(chunk)
-        total_sent = total_sent + size
+    try:
+        for value in arguments[3:]:
+            start, end = (int(number) for number in value.split("-"))
+
+            if start < 0 or end > file_size or start >= end:
+                raise ValueError()
+
+            ranges.append((start, end))
+
+    except ValueError:
+        return f"Invalid photo ranges {','.join(arguments[3:])}"
+
+    raw_size = sum(end - start for start, end in ranges)
+
+    alart_message: str = f"{PHOTO_INFORMATION_COMMAND}>{file_size},{raw_size},{new_file_name},{content_hash}," + \
+        ",".join(f"{start}-{end}" for start, end in ranges)
+    c_protocol.send_frame_data(c_protocol.format_frame(alart_message, data), data)
+
+    with open(file_name, 'rb') as file:
+        for start, end in ranges:
+            send_file_data(socket_obj, file, end - start, data, start)
 
     return None  # Avoid interrupting with the data flow
 
 
+def send_file_data(socket_obj: socket, file: any, size: int, data: dict, offset: int = 0) -> int:
+    """
+        Send file data to the socket.
+
+        Without a key the kernel copies the file with sendfile,
+        otherwise the data is read and encrypted in chunks.
+        offset - file position of the data, the encryption follows it
+
+        Return the sent bytes count
+    """
+
+    mode = TRANSFER_MODE_CHUNKED
+
+    # Async sockets and encrypted sessions need the data in python
+    if utils.find_key(data) is None and getattr(socket_obj, "sendfile", None) is not None:
+        mode = TRANSFER_MODE_SENDFILE
+
+    start = time.perf_counter()
+
+    if mode == TRANSFER_MODE_SENDFILE:
+        total_sent = socket_obj.sendfile(file, offset, size)
+    else:
+        file.seek(offset)
+        total_sent = send_file_chunked(socket_obj, file, size, data, offset)
+
+    elapsed = time.perf_counter() - start
+
+    TRANSFER_STATS.add(mode, total_sent, elapsed)
+    write_to_log(f"  Protocol 2.7  - sent {total_sent} bytes in {elapsed:.3f}s ({mode})")
+
+    return total_sent
+
+
+def send_file_chunked(socket_obj: socket, file: any, size: int, data: dict, offset: int = 0) -> int:
+    """
+        Read, encrypt and send one chunk at a time,
+        memory does not grow with the file
+
+        Return the sent bytes count
+    """
+
+    encryption = c_encryption(data).stream(offset)
+    tuner = c_protocol.find_tuner(data)
+
+    chunk = bytearray(tuner.chunk_size)
+    view = memoryview(chunk)
+
+    total_sent = 0
+
+    while total_sent < size:
+
+        # Adaptive tuner may have grown the chunk
+        if len(chunk) < tuner.chunk_size:
+            chunk = bytearray(tuner.chunk_size)
+            view = memoryview(chunk)
+
+        start = time.perf_counter()
+
+        read_size = file.readinto(view[:min(tuner.chunk_size, size - total_sent)])
+
+        # File got shorter while sending
+        if read_size == 0:
+            break
+
+        socket_obj.sendall(encryption.update(view[:read_size]))
+        total_sent = total_sent + read_size
+
+        tuner.record(read_size, time.perf_counter() - start, socket_obj)
+
+    return total_sent
+
+
 def receive_photo(data: dict) -> any:
     """
         Receive photo file
@@ -202,24 +2406,27 @@ def receive_photo(data: dict) -> any:
     if file_size == -2:
         return "Invalid new file name"
 
+    if file_size == -3:
+        return PHOTO_CHANGED_STATUS
+
     # Get new file name and the raw bytes length
     new_file_name = utils.extract(arguments, 2)
     raw_data_size = utils.extract(arguments, 1, int)
     if not raw_data_size:
         return "Failed to get raw data size"
 
-    # Receive the photo data in chunks based on file size
-    received_raw_data = b''
-    while len(received_raw_data) < raw_data_size:
-        chunk_data = socket_obj.recv(min(raw_data_size - len(received_raw_data), BUFFER_SIZE))
-        received_raw_data += chunk_data
+    # The frame reader may already hold the first photo bytes
+    source = utils.extract(data, "reader")
+    if source is None:
+        source = socket_obj
 
-    # Decrypt the received bytes
-    received_data = c_encryption(data).decrypt(received_raw_data)
+    # Ranges of offered photo go into the store
+    content_hash = utils.extract(arguments, 3)
+    if content_hash is not None:
+        return receive_photo_ranges(source, content_hash, file_size, new_file_name, arguments[4:], data)
 
-    # Write the received data to the file
     with open(new_file_name, 'wb') as file:
-        file.write(received_data)
+        receive_file_data(source, file, raw_data_size, data)
 
     # Check if the new file created
     if not os.path.exists(new_file_name):
@@ -233,6 +2440,175 @@ def receive_photo(data: dict) -> any:
     return "Photo received"
 
 
+def receive_photo_parallel(data: dict) -> str:
+    """
+        Receive parallel transfer, one data connection per range.
+        Every range is written at its offset of the new file
+    """
+
+    arguments = utils.extract(data, "arguments")
+    if not arguments or len(arguments) < 4:
+        return "Failed to receive arguments"
+
+    ticket, new_file_name = arguments[0], arguments[2]
+
+    file_size = utils.extract(arguments, 1, int)
+    if file_size is None:
+        return "Failed to get file size"
+
+    try:
+        ranges = [tuple(int(number) for number in value.split("-")) for value in arguments[3:]]
+
+    except ValueError:
+        return "Failed to get photo ranges"
+
+    # Written next to the new file, only a complete transfer replaces it
+    part = new_file_name + COPY_PART_SUFFIX
+
+    # Full size at once, the ranges are written in any order
+    with open(part, 'wb') as file:
+        file.truncate(file_size)
+
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix="photo range") as pool:
+        errors = list(pool.map(lambda value: receive_photo_range(ticket, value, part, data), ranges))
+
+    errors = [error for error in errors if error is not None]
+    if errors:
+        os.remove(part)
+        return f"Failed to transfer Photo file; {errors[0]}"
+
+    write_to_log(f"  Protocol 2.7  - received {file_size} bytes on {len(ranges)} connections "
+                 f"in {time.perf_counter() - start:.3f}s")
+
+    if os.path.getsize(part) != file_size:
+        os.remove(part)
+        return "Failed to transfer Photo file; different File Size"
+
+    os.replace(part, new_file_name)
+
+    return "Photo received"
+
+
+def receive_photo_range(ticket: str, value: tuple, new_file_name: str, data: dict) -> any:
+    """
+        Receive one range on its own data connection.
+
+        Return None on success, otherwise the error
+    """
+
+    start, end = value
+
+    try:
+        socket_obj, reader, codec = open_data_connection(utils.extract(data, "address"))
+
+    except Exception as e:
+        return f"data connection failed : {e}"
+
+    with socket_obj:
+
+        socket_obj.sendall(c_protocol.format_frame(f"{PHOTO_RANGE_CMD}>{ticket},{start}-{end}", {"codec": codec}))
+
+        result, message, _ = reader.read_message()
+        if not result:
+            return f"no range answer : {message}"
+
+        command, _ = c_protocol.parse(message)
+        if command != PHOTO_RANGE_CMD:
+            return message
+
+        # Own tuner, the connection tuner is not shared between threads
+        range_data = {
+            "socket": socket_obj,
+            "key": utils.extract(data, "key"),
+            "tuner": c_transfer_tuner(c_protocol.find_tuner(data).chunk_size)
+        }
+
+        # Own file handle, its position is independent of the other ranges
+        with open(new_file_name, 'r+b') as file:
+            file.seek(start)
+            received = receive_file_data(reader, file, end - start, range_data, start)
+
+        # Let the server close its side
+        socket_obj.sendall(c_protocol.format_frame(DISCONNECT_MSG, {"codec": codec}))
+
+    if received != end - start:
+        return f"range {start}-{end} got {received} bytes"
+
+    return None
+
+
+def receive_photo_ranges(source: any, content_hash: str, file_size: int, new_file_name: str, ranges: list, data: dict) -> str:
+    """
+        Receive missing ranges of offered photo into the client store,
+        check the whole content and write the new file from the store
+    """
+
+    store: c_photo_store = utils.extract(data, "photo_store")
+    if store is None:
+        return "Failed to find photo store"
+
+    with store.open_part(content_hash) as file:
+        for value in ranges:
+            start, end = (int(number) for number in value.split("-"))
+
+            file.seek(start)
+
+            # Connection closed in the middle, the part file is resumed next time
+            if receive_file_data(source, file, end - start, data, start) != end - start:
+                return "Failed to transfer Photo file; connection closed"
+
+    if not store.complete(content_hash, file_size):
+        return "Failed to transfer Photo file; different content"
+
+    store.copy_to(content_hash, new_file_name)
+
+    return "Photo received"
+
+
+def receive_file_data(source: any, file: any, size: int, data: dict, offset: int = 0) -> int:
+    """
+        Receive, decrypt and write the data one chunk at a time.
+        One preallocated buffer, memory does not grow with the file
+
+        offset - file position of the data, the decryption follows it
+
+        Return the received bytes count
+    """
+
+    decryption = c_encryption(data).stream(offset)
+    tuner = c_protocol.find_tuner(data)
+    socket_obj = utils.extract(data, "socket")
+
+    chunk = bytearray(tuner.chunk_size)
+    view = memoryview(chunk)
+
+    total_received = 0
+
+    while total_received < size:
+
+        # Adaptive tuner may have grown the chunk
+        if len(chunk) < tuner.chunk_size:
+            chunk = bytearray(tuner.chunk_size)
+            view = memoryview(chunk)
+
+        start = time.perf_counter()
+
+        received = source.recv_into(view, min(size - total_received, tuner.chunk_size))
+
+        # Connection closed in the middle
+        if received == 0:
+            break
+
+        file.write(decryption.update(view[:received]))
+        total_received = total_received + received
+
+        tuner.record(received, time.perf_counter() - start, socket_obj)
+
+    return total_received
+
+
 #  endregion
 
 
@@ -247,15 +2623,21 @@ class c_protocol_27(c_protocol, ABC):
             "DIR": dir_command,
             "DELETE": delete_command,
             "COPY": copy_command,
+            "COPY_CANCEL": copy_cancel_command,
             "EXECUTE": execute_command,
+            "EXECUTE_CANCEL": execute_cancel_command,
             "TAKE_SCREENSHOT": screenshot_command,
-            "SEND_PHOTO": send_photo_command
+            "SCREEN_STREAM": screen_stream_command,
+            "SCREEN_STOP": screen_stop_command,
+            "SEND_PHOTO": send_photo_command,
+            "PHOTO_FETCH": photo_fetch_command,
+            "PHOTO_RANGE": photo_range_command
         }
 
         # We want to access the photo information header from outside using the class object
         self._photo_information_header = PHOTO_INFORMATION_COMMAND
 
-    def create_request(self, cmd: str, args: str, data: dict) -> str:
+    def create_request(self, cmd: str, args: str, data: dict) -> bytes:
         """
             Creates a request message by formatting the command and arguments.
         """
@@ -265,9 +2647,7 @@ class c_protocol_27(c_protocol, ABC):
         if cmd in self._valid_cmds:
             value = cmd + ">" + args
 
-        value = c_encryption(data).encrypt(value).decode()  # encrypt data
-
-        return c_protocol.format_value(value)
+        return c_protocol.format_frame(value, data)  # encrypt and frame data
 
     def create_response(self, cmd: str, args: list, data: dict) -> any:
         """
@@ -294,8 +2674,15 @@ class c_protocol_27(c_protocol, ABC):
         write_to_log(f"  Protocol 2.7  - response : {response}")
 
         # Encrypt, format and return result
-        response = c_encryption(data_copy).encrypt(response).decode()
-        return c_protocol.format_value(response)
+        return c_protocol.format_frame(response, data_copy)
+
+    def get_handler(self, cmd: str) -> any:
+        """
+            Returns the command handler function, None if not supported.
+            Handlers are plain functions of data, so they can run on workers
+        """
+
+        return self._valid_cmds.get(cmd)
 
     def get_cmds(self) -> list:
         """
@@ -314,6 +2701,27 @@ class c_protocol_27(c_protocol, ABC):
         if value_name == "photo_header":
             return self._photo_information_header
 
+        if value_name == "transfer_stats":
+            return TRANSFER_STATS.get()
+
+        if value_name == "execute_jobs":
+            return EXECUTE_JOBS.count()
+
+        if value_name == "dir_cache_stats":
+            return DIR_CACHE.stats()
+
+        if value_name == "copy_jobs":
+            return COPY_JOBS.count()
+
+        if value_name == "screen_streams":
+            return SCREEN_STREAMS.count()
+
+        if value_name == "photo_hashes":
+            return PHOTO_HASHES.stats()
+
+        if value_name == "parallel_tickets":
+            return PARALLEL_TICKETS.count()
+
         return None
 
 
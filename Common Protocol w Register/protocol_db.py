@@ -9,7 +9,354 @@
 from protocol import *
 from utils import *
 
+from collections import OrderedDict
+
+import threading
 import sqlite3
+import queue
+import time
+
+#  endregion
+
+
+#  region @ Constants
+
+DATABASE_CACHED_STATEMENTS: int = 64    # Prepared statements kept by each connection
+DATABASE_TIMEOUT: float = 10            # Seconds to wait for a locked database
+
+REGISTER_MAX_LATENCY: float = 0.005     # Seconds a registration waits for more to join its batch
+REGISTER_MAX_BATCH: int = 512           # Registrations committed in one transaction
+REGISTER_WAIT_TIMEOUT: float = 30       # Seconds a registration waits for its batch to commit
+
+CREDENTIALS_CACHE_SIZE: int = 10000     # Users kept in memory
+CREDENTIALS_CACHE_TTL: float = 300      # Seconds before a cached user is read again
+
+# Same query text every call, so each connection reuses its prepared statement
+SQL_CREATE_USERS: str = """
+        CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        key TEXT NOT NULL);
+"""
+SQL_INSERT_USER: str = "INSERT INTO users (username, password, key) VALUES (?, ?, ?);"
+SQL_SELECT_USER: str = "SELECT * FROM users WHERE username=?"
+
+#  endregion
+
+
+#  region @ Credentials Cache Class
+
+class c_credentials_cache:
+    """
+        Credentials Cache Class.
+
+        LRU cache of the stored key and encrypted password by username,
+        so repeated logins do not touch the database
+    """
+
+    def __init__(self, max_size: int = CREDENTIALS_CACHE_SIZE, ttl: float = CREDENTIALS_CACHE_TTL):
+
+        self._lock = threading.Lock()
+
+        # username -> (key, encrypted password, expire time)
+        self._users = OrderedDict()
+
+        self._max_size: int = max_size
+        self._ttl: float = ttl
+
+        # Counters
+        self._hits: int = 0
+        self._misses: int = 0
+
+    def get(self, username: str) -> any:
+        """
+            Get cached user.
+
+            Return (key, encrypted password) or None
+        """
+
+        with self._lock:
+
+            user = self._users.get(username)
+
+            if user is None or user[2] < time.monotonic():
+
+                # Missing or expired
+                self._users.pop(username, None)
+                self._misses += 1
+
+                return None
+
+            # Most recently used goes to the end
+            self._users.move_to_end(username)
+            self._hits += 1
+
+            return user[0], user[1]
+
+    def put(self, username: str, key: str, password: str):
+        """
+            Add or update cached user
+        """
+
+        with self._lock:
+
+            self._users[username] = (key, password, time.monotonic() + self._ttl)
+            self._users.move_to_end(username)
+
+            # Drop the least recently used
+            while len(self._users) > self._max_size:
+                self._users.popitem(last=False)
+
+    def invalidate(self, username: str):
+        """
+            Remove cached user
+        """
+
+        with self._lock:
+            self._users.pop(username, None)
+
+    def stats(self) -> dict:
+        """
+            Returns cache counters
+        """
+
+        with self._lock:
+
+            total = self._hits + self._misses
+
+            return {
+                "size": len(self._users),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / total if total > 0 else 0.0
+            }
+
+#  endregion
+
+
+#  region @ Database Pool Class
+
+class c_database_pool:
+    """
+        Database Connection Pool Class.
+
+        One connection per thread in WAL mode,
+        shared by every c_protocol_db using the same database file
+    """
+
+    # Pools by database file name
+    _pools: dict = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, database_name: str):
+
+        self._database_name = database_name
+
+        # Each thread keeps its own connection
+        self._local = threading.local()
+
+        # Tables are created once per pool
+        self.is_ready: bool = False
+
+        # Users cache in front of the users table
+        self.credentials = c_credentials_cache()
+
+    @staticmethod
+    def get(database_name: str) -> any:
+        """
+            Get the shared pool of a database file
+        """
+
+        with c_database_pool._pools_lock:
+
+            if database_name not in c_database_pool._pools:
+                c_database_pool._pools[database_name] = c_database_pool(database_name)
+
+            return c_database_pool._pools[database_name]
+
+    def connection(self) -> sqlite3.Connection:
+        """
+            Get the connection of the current thread
+        """
+
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None:
+            connection = sqlite3.connect(self._database_name,
+                                         timeout=DATABASE_TIMEOUT,
+                                         cached_statements=DATABASE_CACHED_STATEMENTS)
+
+            # Readers do not block the writer and commits do not wait for a full sync
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+
+            self._local.connection = connection
+
+        return connection
+
+    def close(self):
+        """
+            Close the connection of the current thread
+        """
+
+        connection = getattr(self._local, "connection", None)
+
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+#  endregion
+
+
+#  region @ Register Writer Class
+
+class c_register_writer:
+    """
+        Group Commit Register Writer Class.
+
+        Collects registrations from every client handle and
+        inserts them in one transaction, one sync per batch
+    """
+
+    # Writers by database file name
+    _writers: dict = {}
+    _writers_lock = threading.Lock()
+
+    def __init__(self, pool: c_database_pool, max_latency: float = REGISTER_MAX_LATENCY):
+
+        self._pool = pool
+
+        # Longest time the first registration of a batch waits for others
+        self.max_latency: float = max_latency
+
+        # Pending registrations
+        self._queue = queue.Queue()
+
+        self._thread = threading.Thread(target=self.__process, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def get(pool: c_database_pool, database_name: str, max_latency: float = REGISTER_MAX_LATENCY) -> any:
+        """
+            Get the shared writer of a database file.
+
+            Note ! The latency is only used by the handle that creates the writer
+        """
+
+        with c_register_writer._writers_lock:
+
+            if database_name not in c_register_writer._writers:
+                c_register_writer._writers[database_name] = c_register_writer(pool, max_latency)
+
+            return c_register_writer._writers[database_name]
+
+    def register(self, username: str, password: str, key: str) -> (bool, str):
+        """
+            Queue new user and wait until its batch is committed.
+
+            Return the result and error
+        """
+
+        request = {
+            "values": (username, password, key),
+            "done": threading.Event(),
+            "success": False,
+            "error": ""
+        }
+
+        self._queue.put(request)
+
+        if not request["done"].wait(REGISTER_WAIT_TIMEOUT):
+            return False, "Registration timed out"
+
+        return request["success"], request["error"]
+
+    def __process(self):
+        """
+            Writer thread, commits the pending registrations in batches
+        """
+
+        # Only this thread writes users, make every commit durable
+        try:
+            self._pool.connection().execute("PRAGMA synchronous=FULL")
+
+        except Exception as e:
+            write_to_log(f"  Protocol DB   - catch an exception on writer setup : {e}")
+
+        while True:
+
+            # Wait for the first registration
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_latency
+
+            # Collect more until the latency or size limit
+            while len(batch) < REGISTER_MAX_BATCH:
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    break
+
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                self.__commit(batch)
+
+            except Exception as e:
+
+                write_to_log(f"  Protocol DB   - catch an exception on commit : {e}")
+
+                # Nothing from this batch is known to be saved
+                for request in batch:
+                    request["success"] = False
+                    request["error"] = str(e)
+
+            finally:
+
+                # Never leave a registration waiting
+                for request in batch:
+                    request["done"].set()
+
+    def __commit(self, batch: list):
+        """
+            Insert the batch in one transaction
+        """
+
+        connection = self._pool.connection()
+
+        for request in batch:
+
+            try:
+                # Failed insert only cancels its own statement
+                connection.execute(SQL_INSERT_USER, request["values"])
+                request["success"] = True
+
+            except Exception as e:
+                request["error"] = str(e)
+
+        try:
+            connection.commit()
+
+        except Exception as e:
+
+            # Nothing from this batch was saved
+            for request in batch:
+                if request["success"]:
+                    request["success"] = False
+                    request["error"] = str(e)
+
+            try:
+                connection.rollback()
+
+            except Exception as rollback_error:
+                write_to_log(f"  Protocol DB   - catch an exception on rollback : {rollback_error}")
+
+            return
+
+        write_to_log(f"  Protocol DB   - committed {len(batch)} registrations")
 
 #  endregion
 
@@ -18,7 +365,7 @@ import sqlite3
 
 class c_protocol_db(c_protocol, ABC):
 
-    def __init__(self):
+    def __init__(self, register_latency: float = REGISTER_MAX_LATENCY):
 
         # Current protocol commands
         self._valid_cmds = {
@@ -27,61 +374,88 @@ class c_protocol_db(c_protocol, ABC):
         }
 
         # Default header to response with log in information
-        self._register_header = "REGISTRATION_INFO"
+        self._register_header = REGISTER_INFO_MSG
 
-        # Some variables to use
-        self._last_error: str = ""
-        self._last_success: bool = False
-        self._last_key_used: str = None
+        # Note ! No results are stored here, one object serves every connection
 
         # Current database file name
         self._database_name: str = "Users.db"
 
-        # Call and setup users table
-        self.__setup_table()
+        # Shared connections and group commit writer.
+        # Note ! Opened on the first command, clients only create requests
+        self._pool: c_database_pool = None
+        self._register_writer: c_register_writer = None
+        self._register_latency: float = register_latency
 
-    def create_request(self, cmd: str, args: str, data: dict) -> str:
+        self._setup_lock = threading.Lock()
+
+    def create_request(self, cmd: str, args: str, data: dict) -> bytes:
         """
             Creates a request message by formatting the command and arguments.
         """
 
-        return c_protocol.format_value(f"{cmd}>{args}")
+        return c_protocol.format_frame(f"{cmd}>{args}", data)
 
-    def create_response(self, cmd: str, args: list, data: dict) -> str:
+    def create_response(self, cmd: str, args: list, data: dict) -> bytes:
         """
             Create valid response information,
 
             In case unsupported request "Non-supported cmd" will be returned
         """
 
+        response, _ = self.create_result(cmd, args, data)
+
+        return response
+
+    def create_result(self, cmd: str, args: list, data: dict) -> (bytes, dict):
+        """
+            Create valid response information and the operation result.
+
+            Result : {"success": bool, "key": str, "error": str}
+            None if the command is not supported
+        """
+
         response = "None Supported CMD"
+        result = None
 
         # Check if command is valid and can use
         if cmd in self._valid_cmds:
 
-            # Get the operation result and set the last success
-            self._last_success = self._valid_cmds[cmd](args)
+            try:
+
+                # Open the shared database on the first command
+                self.__setup_database()
+
+                # Get the operation result
+                result = self._valid_cmds[cmd](args)
+
+            except Exception as e:
+
+                # Database can not be opened, answer like any other failure
+                write_to_log(f"  Protocol DB   - catch an exception on {cmd} : {e}")
+
+                result = {"success": False, "key": None, "error": str(e)}
 
             # If we logged in
-            if self._last_success:
+            if result["success"]:
 
                 # Set response with needed information
                 response = f"{SUCCESS_CMD},{cmd},{args[0]}"
 
                 if cmd == "REGISTER":
                     # Only in Register operation we receive the key
-                    response = response + f",{self._last_key_used}"
+                    response = response + f",{result['key']}"
 
             else:
 
                 # Something went wrong. inform the client
-                response = self._last_error
+                response = result["error"]
 
         # Log
         write_to_log(f"  Protocol DB   - response to client : {response} ")
 
-        # Return formatted response
-        return c_protocol.format_value(f"{self._register_header}>{response}")
+        # Return formatted response and the result
+        return c_protocol.format_frame(f"{self._register_header}>{response}", data), result
 
     def get_cmds(self) -> any:
         """
@@ -95,6 +469,30 @@ class c_protocol_db(c_protocol, ABC):
 
         return result
 
+    def __setup_database(self):
+        """
+            Open the shared pool and writer.
+
+            If already opened ignore call
+        """
+
+        if self._register_writer is not None:
+            return
+
+        with self._setup_lock:
+
+            if self._register_writer is not None:
+                return
+
+            self._pool = c_database_pool.get(self._database_name)
+
+            # Call and setup users table, only once per database
+            if not self._pool.is_ready:
+                self.__setup_table()
+
+            # Shared group commit writer for registrations
+            self._register_writer = c_register_writer.get(self._pool, self._database_name, self._register_latency)
+
     def __setup_table(self):
         """
             Setup users table.
@@ -105,97 +503,74 @@ class c_protocol_db(c_protocol, ABC):
         try:
 
             # Connect
-            connection = sqlite3.connect(self._database_name)
-            cursor = connection.cursor()
+            connection = self._pool.connection()
 
             # Create table if it doesn't exist
-            cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY,
-                    username TEXT UNIQUE NOT NULL,
-                    password TEXT NOT NULL,
-                    key TEXT NOT NULL);
-            """)
-
-            # Commit changes and close connection
+            connection.execute(SQL_CREATE_USERS)
+
+            # Commit changes
             connection.commit()
-            connection.close()
+
+            self._pool.is_ready = True
 
         except Exception as e:
 
             # Handle Fail
-            self._last_error = str(e)
             write_to_log(f"  Protocol DB   - catch an exception on setup table() : {e}")
 
-    def __register_command(self, information) -> bool:
+    def __register_command(self, information) -> dict:
         """
             Register client command function.
 
-            Return the result and save the created key
+            Return the result with the created key
         """
 
-        connection = None
         success = False
+        error = ""
 
         # Generate new key
         key = c_encryption.random_key(32)
         encryption = c_encryption(key)
 
         try:
-            # Connect to database
-            connection = sqlite3.connect(self._database_name)
-            cursor = connection.cursor()
-
-            # Insert user information
-            cursor.execute("""
-                INSERT INTO users (username, password, key) VALUES (?, ?, ?);""",
-                (
-                    information[0],                                 # Username
-                    encryption.encrypt(information[1]).decode(),    # Encrypted password
-                    key)                                            # Encryption Key
-            )
+            # Old information of the same name must not be used anymore
+            self._pool.credentials.invalidate(information[0])
 
-            success = True
+            # Insert user information, returns once its batch is committed
+            success, error = self._register_writer.register(
+                information[0],                                 # Username
+                encryption.encrypt(information[1]).decode(),    # Encrypted password
+                key)                                            # Encryption Key
+
+            if not success:
+                raise Exception(error)
 
         except Exception as e:
 
-            self._last_error = str(e)
+            error = str(e)
             success = False
 
-        # If our connection succeeded and we can finish
-        if connection:
-            connection.commit()
-            connection.close()
-
-        # Save key
-        self._last_key_used = key
-
         # Return result
-        return success
+        return {"success": success, "key": key, "error": error}
 
-    def __login_command(self, information) -> bool:
+    def __login_command(self, information) -> dict:
         """
             Login client command function.
 
-            Return the result
+            Return the result with the user key
         """
 
-        connection = None
         success = False
+        error = ""
 
         key = None
 
         try:
-            # Connect to database
-            connection = sqlite3.connect(self._database_name)
-            cursor = connection.cursor()
-
-            # Search by username
-            cursor.execute("SELECT * FROM users WHERE username=?",
-                           (information[0],))
+            # Try the cache first
+            received_data = self._pool.credentials.get(information[0])
 
-            # Get data
-            received_data = cursor.fetchone()
+            if received_data is None:
+                received_data = self.__load_credentials(information[0])
 
             # Check if valid
             if not received_data:
@@ -204,11 +579,11 @@ class c_protocol_db(c_protocol, ABC):
             # We found user
 
             # Prepare for decryption
-            key = received_data[3]
+            key, stored_password = received_data
             encryption = c_encryption(key)
 
             # Both bytes
-            original_password = encryption.decrypt(received_data[2])
+            original_password = encryption.decrypt(stored_password)
             received_password = encryption.decrypt(information[1])
 
             if not original_password == received_password:
@@ -219,28 +594,39 @@ class c_protocol_db(c_protocol, ABC):
         except Exception as e:
 
             success = False
-            self._last_error = str(e)
+            error = str(e)
 
-        # Close connection
-        if connection:
-            connection.close()
+        # Return result
+        return {"success": success, "key": key, "error": error}
 
-        # Save key
-        self._last_key_used = key
+    def __load_credentials(self, username: str) -> any:
+        """
+            Read user key and encrypted password from the database.
 
-        # Return result
-        return success
+            Return (key, encrypted password) or None.
+            Note ! Connection errors are raised, call inside the login try
+        """
 
-    def __call__(self, value_name: str) -> any:
+        # Connect to database
+        connection = self._pool.connection()
 
-        if value_name == "last_error":
-            return self._last_error
+        # Search by username
+        received_data = connection.execute(SQL_SELECT_USER, (username,)).fetchone()
+
+        if not received_data:
+            return None
+
+        # Save for the next logins
+        self._pool.credentials.put(username, received_data[3], received_data[2])
+
+        return received_data[3], received_data[2]
+
+    def __call__(self, value_name: str) -> any:
 
-        if value_name == "last_success":
-            return self._last_success
+        if value_name == "cache_stats":
+            self.__setup_database()
 
-        if value_name == "last_key":
-            return self._last_key_used
+            return self._pool.credentials.stats()
 
         if value_name == "register_header":
             return self._register_header
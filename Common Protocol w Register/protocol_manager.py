@@ -9,9 +9,24 @@
 from protocol import *
 from utils import *
 
-from protocol_26 import c_protocol_26
-from protocol_27 import c_protocol_27, receive_photo
-from protocol_db import c_protocol_db
+import importlib
+import threading
+
+#  endregion
+
+
+#  region @ Constants
+
+HELP_CACHE_SIZE: int = 1024     # Encrypted HELP responses kept (one per key)
+
+# Default protocols - name, module, class and commands.
+# Modules (and their heavy libraries) are imported on first use,
+# the commands are checked against the protocol get_cmds() then
+DEFAULT_PROTOCOLS: tuple = (
+    ("2.6", "protocol_26", "c_protocol_26", ("TIME", "RAND", "NAME")),
+    ("2.7", "protocol_27", "c_protocol_27", ("DIR", "DELETE", "COPY", "COPY_CANCEL", "EXECUTE", "EXECUTE_CANCEL", "TAKE_SCREENSHOT", "SCREEN_STREAM", "SCREEN_STOP", "SEND_PHOTO", "PHOTO_FETCH", "PHOTO_RANGE")),
+    ("database", "protocol_db", "c_protocol_db", ("REGISTER", "LOGIN"))
+)
 
 #  endregion
 
@@ -22,37 +37,153 @@ class c_protocol_manager(c_protocol, ABC):
 
     def __init__(self):
 
-        # Protocols list based on numbers
-        self._protocols = {
-            1: c_protocol_26(),
-            2: c_protocol_27(),
-            3: c_protocol_db()
-        }
+        # Protocols list based on numbers, None until first use
+        self._protocols = {}
+
+        # How to load each protocol based on numbers
+        self._protocols_info = {}
 
         # Protocol names and their numbers
-        self._protocols_names = {
-            "2.6": 1,
-            "2.7": 2,
-            "database": 3
-        }
+        self._protocols_names = {}
+
+        # Command -> protocol number, built once instead of searched on every request
+        self._commands: dict = {}
+
+        # Ready HELP responses by key and frame mode
+        self._help_cache: dict = {}
+        self._help_text: str = None
+
+        # Protects runtime registration
+        self._lock = threading.Lock()
 
         self._last_error: str = ""
 
-    def get_protocol_type(self, cmd: str) -> int:
+        # Numbers 1 - 2.6, 2 - 2.7, 3 - database
+        for name, module_name, class_name, cmds in DEFAULT_PROTOCOLS:
+            self.declare_protocol(name, module_name, class_name, cmds)
+
+    def declare_protocol(self, name: str, module_name: str, class_name: str, cmds: any) -> int:
         """
-            Gets protocol enum based on command
+            Add protocol by name and command set.
+            The module is imported on the first command of the protocol.
+
+            Return the new protocol number
+        """
+
+        return self.__add_protocol(name, None, {
+            "module": module_name,
+            "class": class_name,
+            "cmds": list(cmds),
+            "options": {}
+        })
+
+    def configure_protocol(self, name: str, **options):
+        """
+            Set the constructor arguments of declared protocol.
+            Must be called before its first command
+        """
+
+        with self._lock:
+
+            protocol_index = self._protocols_names.get(name)
+            if protocol_index is None:
+                raise Exception(f"Unknown protocol {name}")
+
+            if self._protocols[protocol_index] is not None:
+                raise Exception(f"Protocol {name} is already loaded")
+
+            self._protocols_info[protocol_index]["options"].update(options)
+
+    def register_protocol(self, name: str, protocol: c_protocol) -> int:
+        """
+            Add ready protocol object at runtime.
+
+            Return the new protocol number
+        """
+
+        return self.__add_protocol(name, protocol, {
+            "module": None,
+            "class": None,
+            "cmds": protocol.get_cmds(),
+            "options": {}
+        })
+
+    def __add_protocol(self, name: str, protocol: any, information: dict) -> int:
+
+        with self._lock:
+
+            if name in self._protocols_names:
+                raise Exception(f"Protocol {name} already registered")
+
+            protocol_index = len(self._protocols) + 1
+
+            self._protocols[protocol_index] = protocol
+            self._protocols_info[protocol_index] = information
+            self._protocols_names[name] = protocol_index
+
+            self.__build_commands()
+
+        return protocol_index
+
+    def __get_protocol(self, protocol_index: int) -> c_protocol:
+        """
+            Get protocol object, import and create it on first use
+        """
+
+        protocol = self._protocols[protocol_index]
+        if protocol is not None:
+            return protocol
+
+        with self._lock:
+
+            # Other thread may have loaded it while we waited
+            if self._protocols[protocol_index] is None:
+                information = self._protocols_info[protocol_index]
+
+                module = importlib.import_module(information["module"])
+                protocol = getattr(module, information["class"])(**information["options"])
+
+                # Requests are routed by the declared commands, they must be the real ones
+                if sorted(protocol.get_cmds()) != sorted(information["cmds"]):
+                    raise Exception(f"Protocol {information['module']} commands {protocol.get_cmds()} "
+                                    f"do not match the declared {information['cmds']}")
+
+                self._protocols[protocol_index] = protocol
+
+                write_to_log(f"  Manager       - loaded protocol {information['module']}")
+
+            return self._protocols[protocol_index]
+
+    def __build_commands(self):
+        """
+            Build the command index and drop the cached HELP
         """
 
-        if cmd == DISCONNECT_MSG or cmd == HELP_CMD_MSG:
-            return 0
+        commands = {
+            DISCONNECT_MSG: 0,
+            HELP_CMD_MSG: 0,
+            FRAMING_CMD: 0
+        }
+
+        for protocol_index in sorted(self._protocols_info):
+            for cmd in self._protocols_info[protocol_index]["cmds"]:
 
-        for i in range(3):
-            protocol_index = i + 1
+                # First protocol with the command handles it
+                if cmd not in commands:
+                    commands[cmd] = protocol_index
 
-            if cmd in self._protocols[protocol_index].get_cmds():
-                return protocol_index
+        # Swap at once, requests on other threads see the old or the new index
+        self._commands = commands
 
-        return -1  # fail
+        self._help_text = None
+        self._help_cache = {}
+
+    def get_protocol_type(self, cmd: str) -> int:
+        """
+            Gets protocol enum based on command
+        """
+
+        return self._commands.get(cmd, -1)  # -1 on fail
 
     def create_request(self, cmd: str, args: str, data: dict) -> any:
         """
@@ -71,14 +202,15 @@ class c_protocol_manager(c_protocol, ABC):
             return None
 
         if e_protocol_type == 0:
-            # Our Disconnect / Help Message need to be handled manually
+            # Our Disconnect / Help / Framing Message need to be handled manually
             # Since there is no protocol that handles it
-            cmd = c_encryption(data).encrypt(cmd).decode()
+            if cmd == FRAMING_CMD:
+                cmd = f"{cmd}>{args}"
 
-            return c_protocol.format_value(cmd)
+            return c_protocol.format_frame(cmd, data)
 
         # Use correct protocol to create a request based on type
-        value = self._protocols[e_protocol_type].create_request(cmd, args, data)
+        value = self.__get_protocol(e_protocol_type).create_request(cmd, args, data)
 
         # Return the request
         return value
@@ -89,34 +221,123 @@ class c_protocol_manager(c_protocol, ABC):
             with length field. In case unsupported request "Non-supported cmd" will be sent back
         """
 
+        response, _ = self.handle_request(cmd, args, data)
+
+        return response
+
+    def handle_request(self, cmd: str, args: list, data: dict) -> (any, dict):
+        """
+            Create valid response information and return the
+            login / register result as a value.
+
+            Nothing is stored per connection, so one manager can serve every client.
+            Result is None for non database commands
+        """
+
         # Get protocol type
         e_protocol_type = self.get_protocol_type(cmd)
 
         # Some checks
         if e_protocol_type == -1:
             self._last_error = "Invalid Command"
-            return None
+            return None, None
 
         if e_protocol_type == 2 and args is None:
             self._last_error = "Invalid Arguments"
-            return None
+            return None, None
+
+        if e_protocol_type == 0 and cmd == FRAMING_CMD:
+            # Framing Msg - answer with the frame mode (and compression) both sides will use
+            mode = self.select_frame_mode(args)
+            compression = self.select_compression(mode, args)
+
+            value = mode if compression is None else f"{mode},{compression}"
+
+            return c_protocol.format_frame(f"{FRAMING_CMD}>{value}", data), None
 
         if e_protocol_type == 0:
             # Help Msg - since Disconnect MSG is handled before this call
+            return self.__help_response(data), None
+
+        if e_protocol_type == 3:
+            # Database commands also return the operation result
+            return self.__get_protocol(e_protocol_type).create_result(cmd, args, data)
+
+        # Return a ready to send response message
+        return self.__get_protocol(e_protocol_type).create_response(cmd, args, data), None
+
+    def get_handler(self, cmd: str) -> any:
+        """
+            Returns the command handler function.
+            Only protocol 2.7 commands have plain handlers, None for the others
+        """
+
+        if self.get_protocol_type(cmd) != 2:
+            return None
+
+        return self.__get_protocol(2).get_handler(cmd)
+
+    def __help_response(self, data: dict) -> bytes:
+        """
+            HELP response for the connection key
+        """
+
+        codec = c_protocol.find_codec(data)
+
+        # Note ! Only the compressed and encrypted value is cached, every request frames it with its own id
+        cache_index = (utils.find_key(data), codec.compression)
+
+        cached = self._help_cache.get(cache_index)
+        if cached is not None:
+            return c_protocol.wrap_frame(cached[0], data, cached[1])
+
+        if self._help_text is None:
             result = "Possible commands :\n"
 
             # TODO !
-            result = result + "\n".join(self.get_cmds())
+            self._help_text = result + "\n".join(self.get_cmds())
 
-            result = c_encryption(data).encrypt(result).decode()
-            return c_protocol.format_value(result)
+        response, flags = codec.compress(self._help_text.encode())
+        response = c_encryption(data).encrypt(response)
 
-        # Return a ready to send response message
-        return self._protocols[e_protocol_type].create_response(cmd, args, data)
+        # Many keys, keep it bounded
+        if len(self._help_cache) >= HELP_CACHE_SIZE:
+            self._help_cache = {}
+
+        self._help_cache[cache_index] = (response, flags)
+
+        return c_protocol.wrap_frame(response, data, flags)
+
+    @staticmethod
+    def select_frame_mode(args: list) -> str:
+        """
+            Select frame mode from the requested one.
+            Unknown modes fall back to the text frames
+        """
+
+        mode = utils.extract(args, 0)
+
+        if c_frame_codec.is_valid_mode(mode):
+            return mode
+
+        return FRAME_MODE_TEXT
+
+    @staticmethod
+    def select_compression(mode: str, args: list) -> str:
+        """
+            Select compression from the offered methods after the mode.
+            Only binary frames can mark compressed values
+        """
+
+        if mode != FRAME_MODE_BINARY or not args:
+            return None
+
+        return c_frame_codec.select_compression(args[1:])
 
     def get_cmds(self) -> any:
         """
             Returns valid cmds for every protocol.
+            Does not load any protocol
 
             Note ! Return Dict
         """
@@ -126,14 +347,14 @@ class c_protocol_manager(c_protocol, ABC):
         for name in self._protocols_names:
             protocol_index = self._protocols_names[name]
 
-            result[name] = self._protocols[protocol_index].get_cmds()
+            result[name] = list(self._protocols_info[protocol_index]["cmds"])
 
         return result
 
     def __call__(self, index) -> any:
 
         if index in self._protocols_names:
-            return self._protocols[self._protocols_names[index]]
+            return self.__get_protocol(self._protocols_names[index])
 
         if index == "last_error":
             return self._last_error
@@ -0,0 +1,440 @@
+"""
+    screen_capture.py - Screen Capture File
+
+    last update : 15/05/2024
+"""
+
+#  region @ Libraries
+
+from protocol import *
+
+import threading
+import hashlib
+import struct
+import zlib
+import sys
+import io
+import os
+
+#  endregion
+
+
+#  region @ Constants
+
+CAPTURE_SOURCE_ENV: str = "SCREEN_CAPTURE_SOURCE"   # Environment variable to force the capture source
+CAPTURE_SOURCE_SCREEN: str = "screen"               # Real screen through pyautogui
+CAPTURE_SOURCE_HEADLESS: str = "headless"           # Generated frames, no display needed
+
+HEADLESS_WIDTH: int = 1280      # Generated frame size
+HEADLESS_HEIGHT: int = 720
+HEADLESS_BOX_SIZE: int = 64     # Moving box, so every frame is a bit different
+
+CAPTURE_FORMAT_PNG: str = "png"     # Lossless, zlib level 0 - 9
+CAPTURE_FORMAT_JPEG: str = "jpeg"   # Lossy, quality 1 - 95, needs Pillow
+CAPTURE_FORMAT_PPM: str = "ppm"     # Raw pixels, no compression
+
+CAPTURE_DEFAULT_LEVEL: int = 6      # Default png level
+CAPTURE_DEFAULT_QUALITY: int = 75   # Default jpeg quality
+
+PNG_SIGNATURE: bytes = b"\x89PNG\r\n\x1a\n"
+PNG_CHUNK_HEADER = struct.Struct("!I4s")            # Length and type
+PNG_IHDR = struct.Struct("!IIBBBBB")                # Width, height, depth, color type, compression, filter, interlace
+
+SCREEN_TILE_SIZE: int = 64                          # Default tile width and height in pixels
+SCREEN_TILE_HASH_SIZE: int = 16                     # blake2b digest bytes of one tile
+SCREEN_TILE = struct.Struct("!HH")                  # Tile column, row - followed by the tile pixels
+
+#  endregion
+
+
+#  region @ Screen Frame
+
+class c_screen_frame:
+    """
+        Screen Frame Class.
+
+        Captured image as packed RGB rows
+    """
+
+    def __init__(self, width: int, height: int, pixels: bytes):
+
+        self.width: int = width
+        self.height: int = height
+
+        # width * height * 3 bytes, row after row
+        self.pixels: bytes = pixels
+
+    def stride(self) -> int:
+        return self.width * 3
+
+#  endregion
+
+
+#  region @ Capture Sources
+
+class c_screen_source(ABC):
+    """
+        Screen Source Class. Base of every capture source
+    """
+
+    name: str = ""
+
+    @abstractmethod
+    def grab(self) -> c_screen_frame:  # Virtual Function
+        """
+            Capture the current frame
+        """
+
+        pass
+
+
+class c_pyautogui_source(c_screen_source):
+    """
+        Real screen capture through pyautogui
+    """
+
+    name: str = CAPTURE_SOURCE_SCREEN
+
+    def __init__(self):
+
+        # Note ! Imported here, fails on servers without display
+        import pyautogui
+
+        self._pyautogui = pyautogui
+
+    def grab(self) -> c_screen_frame:
+
+        image = self._pyautogui.screenshot().convert("RGB")
+
+        return c_screen_frame(image.width, image.height, image.tobytes())
+
+
+class c_headless_source(c_screen_source):
+    """
+        Stand-in capture source for servers without display and tests.
+
+        Generates a fixed background with a box that moves on every grab
+    """
+
+    name: str = CAPTURE_SOURCE_HEADLESS
+
+    def __init__(self, width: int = HEADLESS_WIDTH, height: int = HEADLESS_HEIGHT):
+
+        self._width: int = width
+        self._height: int = height
+
+        self._lock = threading.Lock()
+        self._frames: int = 0
+
+        # Horizontal / vertical gradient, built once
+        row = bytearray(width * 3)
+        for x in range(width):
+            row[x * 3] = x * 255 // max(1, width - 1)
+
+        background = bytearray()
+        for y in range(height):
+            row[2::3] = bytes([y * 255 // max(1, height - 1)]) * width
+            background += row
+
+        self._background = bytes(background)
+
+    def grab(self) -> c_screen_frame:
+
+        with self._lock:
+            frame_index = self._frames
+            self._frames += 1
+
+        pixels = bytearray(self._background)
+
+        # Box walks along the diagonal
+        box = min(HEADLESS_BOX_SIZE, self._width, self._height)
+
+        left = (frame_index * 16) % max(1, self._width - box + 1)
+        top = (frame_index * 9) % max(1, self._height - box + 1)
+
+        stride = self._width * 3
+        line = b"\xff\xff\xff" * box
+
+        for y in range(top, top + box):
+            start = y * stride + left * 3
+            pixels[start:start + box * 3] = line
+
+        return c_screen_frame(self._width, self._height, bytes(pixels))
+
+
+_screen_source: c_screen_source = None
+_screen_source_lock = threading.Lock()
+
+
+def get_screen_source() -> c_screen_source:
+    """
+        Shared capture source.
+
+        SCREEN_CAPTURE_SOURCE=headless uses the stand-in source,
+        otherwise the real screen. Raise if it is not available,
+        the next call tries again (a display may be attached later)
+    """
+
+    global _screen_source
+
+    with _screen_source_lock:
+
+        if _screen_source is not None:
+            return _screen_source
+
+        if os.environ.get(CAPTURE_SOURCE_ENV, CAPTURE_SOURCE_SCREEN) == CAPTURE_SOURCE_HEADLESS:
+            _screen_source = c_headless_source()
+            return _screen_source
+
+        # X11 / Wayland needs a display on Linux
+        has_display = not sys.platform.startswith("linux") or \
+            os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")
+
+        try:
+            if not has_display:
+                raise Exception("no display")
+
+            _screen_source = c_pyautogui_source()
+
+        except Exception as e:
+            write_to_log(f"  Capture       - screen capture is not available : {e}")
+
+            raise Exception("Screen capture is not available")
+
+        return _screen_source
+
+#  endregion
+
+
+#  region @ Encoders
+
+def format_from_name(file_name: str) -> str:
+    """
+        Image format by the file extension, None for formats without own encoder
+    """
+
+    extension = os.path.splitext(file_name)[1].lower()
+
+    if extension == ".png":
+        return CAPTURE_FORMAT_PNG
+
+    if extension in (".jpg", ".jpeg"):
+        return CAPTURE_FORMAT_JPEG
+
+    if extension in (".ppm", ".pnm"):
+        return CAPTURE_FORMAT_PPM
+
+    return None
+
+
+def encode_frame(frame: c_screen_frame, image_format: str = CAPTURE_FORMAT_PNG, level: int = None) -> io.BytesIO:
+    """
+        Encode frame into in memory buffer.
+
+        level : png zlib level (0 - 9) / jpeg quality (1 - 95)
+    """
+
+    buffer = io.BytesIO()
+
+    if image_format == CAPTURE_FORMAT_PNG:
+        buffer.write(encode_png(frame, CAPTURE_DEFAULT_LEVEL if level is None else level))
+
+    elif image_format == CAPTURE_FORMAT_PPM:
+        buffer.write(f"P6\n{frame.width} {frame.height}\n255\n".encode())
+        buffer.write(frame.pixels)
+
+    elif image_format == CAPTURE_FORMAT_JPEG:
+        encode_jpeg(frame, CAPTURE_DEFAULT_QUALITY if level is None else level, buffer)
+
+    else:
+        raise Exception(f"Invalid image format {image_format}")
+
+    buffer.seek(0)
+
+    return buffer
+
+
+def encode_png(frame: c_screen_frame, level: int) -> bytes:
+    """
+        Minimal RGB png, no row filters.
+        zlib does the heavy work in C
+    """
+
+    if level < 0 or level > 9:
+        raise Exception(f"Invalid png level {level}")
+
+    stride = frame.stride()
+    pixels = frame.pixels
+
+    # Every row starts with filter type 0
+    rows = b"".join(b"\x00" + pixels[y * stride:(y + 1) * stride] for y in range(frame.height))
+
+    return PNG_SIGNATURE + \
+        png_chunk(b"IHDR", PNG_IHDR.pack(frame.width, frame.height, 8, 2, 0, 0, 0)) + \
+        png_chunk(b"IDAT", zlib.compress(rows, level)) + \
+        png_chunk(b"IEND", b"")
+
+
+def png_chunk(chunk_type: bytes, value: bytes) -> bytes:
+
+    return PNG_CHUNK_HEADER.pack(len(value), chunk_type) + value + \
+        struct.pack("!I", zlib.crc32(value, zlib.crc32(chunk_type)))
+
+
+def encode_jpeg(frame: c_screen_frame, quality: int, buffer: io.BytesIO):
+    """
+        Jpeg through Pillow, installed together with pyautogui
+    """
+
+    from PIL import Image
+
+    image = Image.frombytes("RGB", (frame.width, frame.height), frame.pixels)
+    image.save(buffer, format="JPEG", quality=quality)
+
+#  endregion
+
+
+#  region @ Screen Tiles
+
+def tile_grid(width: int, height: int, tile_size: int) -> (int, int):
+    """
+        Number of tile columns and rows, edge tiles can be smaller
+    """
+
+    return (width + tile_size - 1) // tile_size, (height + tile_size - 1) // tile_size
+
+
+def split_tiles(frame: c_screen_frame, tile_size: int) -> list:
+    """
+        Split frame into tiles pixels, row after row of tiles
+    """
+
+    stride = frame.stride()
+    pixels = frame.pixels
+    tile_line = tile_size * 3
+
+    tiles = []
+
+    for top in range(0, frame.height, tile_size):
+
+        # Rows of one tiles band, sliced once for every tile in it
+        lines = [pixels[y * stride:(y + 1) * stride] for y in range(top, min(top + tile_size, frame.height))]
+
+        for left in range(0, stride, tile_line):
+            tiles.append(b"".join(line[left:left + tile_line] for line in lines))
+
+    return tiles
+
+
+def hash_tiles(tiles: list) -> list:
+    """
+        Tiles digests, only the digests of the last frame are kept
+    """
+
+    return [hashlib.blake2b(tile, digest_size=SCREEN_TILE_HASH_SIZE).digest() for tile in tiles]
+
+
+def pack_tiles(tiles: list, indexes: any, columns: int) -> bytes:
+    """
+        Tiles of the given indexes as tile position and pixels records
+    """
+
+    return b"".join(SCREEN_TILE.pack(index % columns, index // columns) + tiles[index] for index in indexes)
+
+
+class c_screen_canvas:
+    """
+        Screen Canvas Class.
+
+        Rebuilds the streamed screen from keyframe and changed tiles
+    """
+
+    def __init__(self, width: int, height: int, tile_size: int):
+
+        self.width: int = width
+        self.height: int = height
+        self.tile_size: int = tile_size
+
+        self._pixels = bytearray(width * height * 3)
+
+    def apply(self, records: bytes) -> list:
+        """
+            Write tiles records into the canvas.
+
+            Return changed tiles positions as (column, row)
+        """
+
+        view = memoryview(records)
+        stride = self.width * 3
+
+        changed = []
+        offset = 0
+
+        while offset < len(view):
+
+            column, row = SCREEN_TILE.unpack_from(view, offset)
+            offset += SCREEN_TILE.size
+
+            left = column * self.tile_size
+            top = row * self.tile_size
+
+            if left >= self.width or top >= self.height:
+                raise Exception(f"Invalid tile {column},{row}")
+
+            line = min(self.tile_size, self.width - left) * 3
+
+            for y in range(top, min(top + self.tile_size, self.height)):
+                start = y * stride + left * 3
+
+                self._pixels[start:start + line] = view[offset:offset + line]
+                offset += line
+
+            changed.append((column, row))
+
+        if offset > len(view):
+            raise Exception("Truncated tile")
+
+        return changed
+
+    def frame(self) -> c_screen_frame:
+        """
+            Copy of the current screen
+        """
+
+        return c_screen_frame(self.width, self.height, bytes(self._pixels))
+
+#  endregion
+
+
+#  region @ Capture
+
+def capture_screen(image_format: str = CAPTURE_FORMAT_PNG, level: int = None) -> io.BytesIO:
+    """
+        Capture the screen into in memory encoded image
+    """
+
+    return encode_frame(get_screen_source().grab(), image_format, level)
+
+
+def save_screen(file_name: str):
+    """
+        Capture the screen into the file, in the format of its extension.
+        Other formats (bmp, gif, tiff...) are saved through Pillow, unknown ones raise
+    """
+
+    image_format = format_from_name(file_name)
+
+    if image_format is not None:
+        image = capture_screen(image_format)
+
+        with open(file_name, "wb") as file:
+            file.write(image.getbuffer())
+
+        return
+
+    from PIL import Image
+
+    frame = get_screen_source().grab()
+    Image.frombytes("RGB", (frame.width, frame.height), frame.pixels).save(file_name)
+
+#  endregion
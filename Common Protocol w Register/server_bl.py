@@ -8,13 +8,54 @@
 
 from protocol_manager import *
 
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, CancelledError
+import concurrent.futures
+from collections import deque
+from contextlib import nullcontext
 from select import select
 import threading
+import asyncio
 import time
 
 #  endregion
 
 
+#  region @ Constants
+
+SERVER_ENGINE_THREAD: str = "thread"     # Thread per client engine
+SERVER_ENGINE_ASYNC: str = "asyncio"     # Single event loop engine
+
+ASYNC_ACCEPT_BACKLOG: int = 1024         # Pending connections queue for the asyncio engine
+
+# Inline commands that send whole files or wait for the database,
+# the asyncio engine runs them off the event loop
+ASYNC_BLOCKING_COMMANDS: tuple = ("SEND_PHOTO", "PHOTO_FETCH", "REGISTER", "LOGIN")
+ASYNC_BLOCKING_THREADS: int = 64         # Threads for them, every registration waiting for its commit holds one
+
+EXECUTOR_THREAD: str = "thread"          # I/O bound commands, run on the worker threads
+EXECUTOR_PROCESS: str = "process"        # CPU bound commands, run on the worker processes
+
+EXECUTOR_THREADS: int = 16               # Worker threads shared by every client
+EXECUTOR_PROCESSES: int = 2              # Worker processes shared by every client
+
+# Commands that run outside the connection handle - pool and how many can run at once
+EXECUTOR_COMMANDS: dict = {
+    "DIR": (EXECUTOR_THREAD, 8),
+    "DELETE": (EXECUTOR_THREAD, 8),
+    "COPY": (EXECUTOR_THREAD, 4),
+    "EXECUTE": (EXECUTOR_THREAD, 4),
+    "TAKE_SCREENSHOT": (EXECUTOR_THREAD, 2),    # Streams to the connection, encoders release the GIL
+    "SCREEN_STREAM": (EXECUTOR_THREAD, 2),      # First capture off the connection, frames run on the stream thread
+    "PHOTO_RANGE": (EXECUTOR_THREAD, 16)        # Parallel transfer ranges, the asyncio loop only forwards the data
+}
+
+# Commands that send on the connection or keep jobs in the server, they can not use the worker processes
+EXECUTOR_CONNECTION_COMMANDS: tuple = ("DIR", "COPY", "EXECUTE", "TAKE_SCREENSHOT", "SCREEN_STREAM",
+                                       "SEND_PHOTO", "PHOTO_FETCH", "PHOTO_RANGE")
+
+#  endregion
+
+
 #  region @ Clear Log File
 
 with open(LOG_FILE, "wb") as file:
@@ -23,17 +64,363 @@ with open(LOG_FILE, "wb") as file:
 #  endregion
 
 
+#  region @ Async Socket
+
+class c_async_socket:
+    """
+        Socket like wrapper around asyncio streams.
+
+        Lets the protocols keep calling .send() while running on the asyncio engine
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, loop: asyncio.AbstractEventLoop):
+
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+
+        # Threads hold it while they write, so the frames of a streamed
+        # command and the frames of the background jobs do not mix.
+        # Note ! Never taken on the event loop, it waits for the loop
+        self.lock = threading.RLock()
+
+    def send(self, data: bytes) -> int:
+        """
+            Send data to the client.
+
+            From the event loop the data is queued,
+            from any other thread the call waits until the data is flushed
+        """
+
+        # Writes to a closed stream are dropped silently, let the caller know
+        if self.writer.is_closing():
+            raise ConnectionError("stream closed")
+
+        if self.__in_loop():
+            self.writer.write(data)
+        else:
+            with self.lock:
+                asyncio.run_coroutine_threadsafe(self.__write(data), self.loop).result()
+
+        return len(data)
+
+    def sendall(self, data: bytes) -> None:
+        """
+            Just wrap function for .send(...)
+        """
+
+        self.send(data)
+
+    async def drain(self):
+        """
+            Wait until the queued data is flushed
+        """
+
+        await self.writer.drain()
+
+    def close(self):
+        """
+            Close the stream
+        """
+
+        if self.__in_loop():
+            self.writer.close()
+        else:
+            self.loop.call_soon_threadsafe(self.writer.close)
+
+    def getpeername(self) -> tuple:
+        return self.writer.get_extra_info("peername")
+
+    def getsockopt(self, *args) -> any:
+        return self.writer.get_extra_info("socket").getsockopt(*args)
+
+    def setsockopt(self, *args):
+        self.writer.get_extra_info("socket").setsockopt(*args)
+
+    async def __write(self, data: bytes):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def __in_loop(self) -> bool:
+        """
+            Is the current thread running our event loop
+        """
+
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+#  endregion
+
+
+#  region @ Command Executor
+
+def run_command_handler(handler: any, arguments: list) -> any:
+    """
+        Run command handler on a worker process.
+        Sockets and keys stay in the server, the handler receives only the arguments
+    """
+
+    return handler({"arguments": arguments})
+
+
+class c_command_executor:
+    """
+        Command Executor Class. One per server.
+
+        Runs slow command handlers on bounded worker pools,
+        so they do not block the next requests of the connection.
+        Every command has its own concurrency limit, the requests
+        above it wait in the command queue
+    """
+
+    def __init__(self, max_threads: int = EXECUTOR_THREADS, max_processes: int = EXECUTOR_PROCESSES,
+                 commands: dict = None):
+
+        if commands is None:
+            commands = EXECUTOR_COMMANDS
+
+        self._lock = threading.Lock()
+
+        self._max_threads: int = max_threads
+        self._max_processes: int = max_processes
+
+        # Pools are created on the first command that needs them
+        self._pools = {
+            EXECUTOR_THREAD: None,
+            EXECUTOR_PROCESS: None
+        }
+
+        # Command name -> pool, limit, waiting requests and counters
+        self._commands = {}
+
+        for cmd in commands:
+            pool, limit = commands[cmd]
+
+            if pool != EXECUTOR_THREAD and pool != EXECUTOR_PROCESS:
+                raise Exception(f"Invalid executor pool {pool}")
+
+            # Worker processes only receive the arguments, not the socket
+            if pool == EXECUTOR_PROCESS and cmd in EXECUTOR_CONNECTION_COMMANDS:
+                raise Exception(f"{cmd} sends on the connection, it can not run on the {pool} pool")
+
+            self._commands[cmd] = {
+                "pool": pool,
+                "limit": max(1, limit),
+                "queue": deque(),
+
+                "running": 0,
+                "max_queued": 0,
+                "completed": 0,
+                "failed": 0,
+                "wait_seconds": 0.0
+            }
+
+    def is_offloaded(self, cmd: str) -> bool:
+        """
+            Does the command run on the workers
+        """
+
+        return cmd in self._commands
+
+    def pool_type(self, cmd: str) -> any:
+        """
+            Worker pool of the command, None if it runs inline
+        """
+
+        command = self._commands.get(cmd)
+        if command is None:
+            return None
+
+        return command["pool"]
+
+    def submit(self, cmd: str, function: any, *args) -> Future:
+        """
+            Queue the function call of the command.
+
+            Return future of the function result.
+            Note ! Process pool functions and arguments must be picklable
+        """
+
+        future = Future()
+
+        with self._lock:
+
+            command = self._commands[cmd]
+
+            command["queue"].append((function, args, future, time.monotonic()))
+            command["max_queued"] = max(command["max_queued"], len(command["queue"]))
+
+            started = self.__dispatch(cmd)
+
+        self.__watch(cmd, started)
+
+        return future
+
+    def stats(self) -> dict:
+        """
+            Returns queue depth and counters of every command
+        """
+
+        result = {}
+
+        with self._lock:
+
+            for cmd in self._commands:
+                command = self._commands[cmd]
+
+                started = command["completed"] + command["failed"] + command["running"]
+
+                result[cmd] = {
+                    "pool": command["pool"],
+                    "limit": command["limit"],
+                    "running": command["running"],
+                    "queued": len(command["queue"]),
+                    "max_queued": command["max_queued"],
+                    "completed": command["completed"],
+                    "failed": command["failed"],
+                    "average_wait": command["wait_seconds"] / started if started > 0 else 0.0
+                }
+
+        return result
+
+    def shutdown(self):
+        """
+            Stop the pools, queued requests are cancelled
+        """
+
+        with self._lock:
+
+            for cmd in self._commands:
+                queue = self._commands[cmd]["queue"]
+
+                while queue:
+                    queue.popleft()[2].cancel()
+
+            pools = [pool for pool in self._pools.values() if pool is not None]
+
+            self._pools[EXECUTOR_THREAD] = None
+            self._pools[EXECUTOR_PROCESS] = None
+
+        for pool in pools:
+            pool.shutdown(wait=False)
+
+    def __dispatch(self, cmd: str) -> list:
+        """
+            Start waiting requests of the command while it is under the limit.
+            Return the started (pool future, future) pairs
+
+            Note ! Called with the lock
+        """
+
+        command = self._commands[cmd]
+        started = []
+
+        while command["queue"] and command["running"] < command["limit"]:
+
+            function, args, future, queued_time = command["queue"].popleft()
+
+            # Cancelled while waiting
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            command["running"] += 1
+            command["wait_seconds"] += time.monotonic() - queued_time
+
+            try:
+                pool_future = self.__get_pool(command["pool"]).submit(function, *args)
+
+            except Exception as e:
+
+                # Pool was shut down / broken
+                command["running"] -= 1
+                command["failed"] += 1
+
+                future.set_exception(e)
+                continue
+
+            started.append((pool_future, future))
+
+        return started
+
+    def __watch(self, cmd: str, started: list):
+        """
+            Wait for the started requests.
+            Note ! Called without the lock, done futures run the callback right away
+        """
+
+        for pool_future, future in started:
+            pool_future.add_done_callback(lambda result, f=future: self.__on_done(cmd, result, f))
+
+    def __on_done(self, cmd: str, pool_future: Future, future: Future):
+        """
+            Worker finished, pass the result and start the next request
+        """
+
+        # Cancelled futures raise from exception() and result()
+        if pool_future.cancelled():
+            exception = CancelledError(f"{cmd} was cancelled")
+        else:
+            exception = pool_future.exception()
+
+        try:
+
+            with self._lock:
+
+                command = self._commands[cmd]
+
+                command["running"] -= 1
+                command["completed" if exception is None else "failed"] += 1
+
+                started = self.__dispatch(cmd)
+
+            self.__watch(cmd, started)
+
+        finally:
+
+            # The request waits for its response, always resolve it
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(pool_future.result())
+
+    def __get_pool(self, pool_type: str) -> any:
+        """
+            Get worker pool, create it on first use.
+            Note ! Called with the lock
+        """
+
+        pool = self._pools[pool_type]
+
+        if pool is None:
+
+            if pool_type == EXECUTOR_PROCESS:
+                pool = ProcessPoolExecutor(max_workers=self._max_processes)
+            else:
+                pool = ThreadPoolExecutor(max_workers=self._max_threads, thread_name_prefix="command")
+
+            self._pools[pool_type] = pool
+
+        return pool
+
+#  endregion
+
+
 #  region @ Client Handle
 
 class c_client_handle:
 
-    def __init__(self):
+    def __init__(self, protocols: c_protocol_manager, executor: c_command_executor = None):
 
         # Client information
         self._client_info: dict = {}
 
-        # Protocol manager
-        self._protocols = c_protocol_manager()
+        # Shared protocol manager, built once by the server
+        self._protocols = protocols
+
+        # Shared slow commands executor, None runs everything inline
+        self._executor = executor
 
         # Events handler
         self._events = {
@@ -52,11 +439,34 @@ class c_client_handle:
         self._client_info["connected"] = True
         self._client_info["logged_in"] = False
 
+        # Every client starts with text frames until it asks for other mode
+        self._client_info["codec"] = c_frame_codec()
+
         # Client general information
         self._client_info["ip"] = addr[0]
         self._client_info["port"] = addr[1]
         self._client_info["socket"] = socket_obj
 
+        # Setup default username for each client
+        # While they are still not logged in
+        self._client_info["username"] = f"{self._client_info['ip']} ({self._client_info['port']})"
+
+        if type(socket_obj) == c_async_socket:
+
+            # Async engine writes only from the event loop, no lock is needed there
+            self._client_info["send_lock"] = nullcontext()
+
+            # Asyncio engine, the event loop drives the requests handle
+            self._client_info["task"] = socket_obj.loop.create_task(self.__async_main_handle())
+            return
+
+        # Workers answer from their own threads, frames must not mix.
+        # Reentrant, inline handlers may send their own frames while the request holds it
+        self._client_info["send_lock"] = threading.RLock()
+
+        # Buffered frame reader for this socket
+        self._client_info["reader"] = c_frame_reader(socket_obj, self._client_info["codec"])
+
         # Setup thread for requests handle
         self._client_info["thread"] = threading.Thread(target=self.__main_handle)
         self._client_info["thread"].start()
@@ -66,32 +476,155 @@ class c_client_handle:
             Handle function for requests.
         """
 
-        # Setup default username for each client
-        # While they are still not logged in
-        self._client_info["username"] = f"{self._client_info['ip']} ({self._client_info['port']})"
+        reader: c_frame_reader = self._client_info["reader"]
 
         # Work until the client close connection
         while self._client_info["connected"]:
 
-            # Get, Decrypt and Parse data
-            command, arguments = self.__handle_requests()
+            # Pop from buffer raw-data, pipelined requests wait in the reader buffer
+            result, message, request_id = reader.read_message()
 
-            if command is None and arguments is None:
+            # Nothing will come from a closed socket
+            if reader.closed:
+                self._client_info["connected"] = False
                 continue
 
-            # Check if the client wants to disconnect
-            if command == DISCONNECT_MSG:
-                self._client_info["connected"] = False
+            # Check if valid
+            if not result:
                 continue
 
-            # Prepare a response message
-            response_msg = self._protocols.create_response(command, arguments, self._client_info)
+            # Handle the request
+            self.handle_message(message, request_id)
+
+        # Close connection
+        self.close_connection()
+
+    async def __async_main_handle(self):
+        """
+            Handle function for requests on the asyncio engine.
+        """
+
+        socket_obj: c_async_socket = self._client_info["socket"]
+
+        try:
+
+            # Work until the client close connection
+            while self._client_info["connected"]:
+
+                # Wait for the next message without holding a thread
+                result, message, request_id = await c_protocol.get_message_from_stream(socket_obj.reader, self._client_info["codec"])
+
+                # Nothing will come from a closed stream
+                if not result:
+                    break
+
+                # Handle the request, blocking ones finish off the loop before the next request
+                pending = self.handle_message(message, request_id)
+                if pending is not None:
+                    await pending
+
+                # Flush the responses
+                await socket_obj.drain()
+
+        except Exception as e:
+
+            # Connection lost or server shutdown
+            write_to_log(f"  Server        - async handle stopped for {self._client_info['username']} : {e}")
+
+        # Close connection
+        self._client_info["connected"] = False
+        self.close_connection()
+
+    def handle_message(self, message: str, request_id: int = None) -> any:
+        """
+            Handle single raw message from the client.
+            Decrypts, parses, responds and updates the login status.
+
+            Responses of requests with id carry the same id,
+            so the client can match them while many requests are in flight.
+
+            Requests without id (text frames) are matched by order, their slow
+            commands still run on the workers but are answered before the next request.
+
+            On the asyncio engine commands that block (files, database, the slow commands)
+            never run on the event loop (registrations of many clients can share one commit).
+            Return the awaitable the connection must wait for, None otherwise
+        """
+
+        try:
+
+            # Decrypt and Parse data
+            command, arguments = self.__handle_requests(message)
+
+        except Exception as e:
+
+            # Corrupt frame, nothing more can be trusted on this connection
+            write_to_log(f"  Server        - failed to decode request from {self._client_info['username']} : {e}")
+
+            self._client_info["connected"] = False
+            return
 
-            # Check if the client is not logged in
-            if not self._client_info["logged_in"]:
+        # Check if the client wants to disconnect
+        if command == DISCONNECT_MSG:
+            self._client_info["connected"] = False
+            return
+
+        # Every response frame of this request is tagged with its id
+        data = self._client_info
+        if request_id is not None:
+            data = dict(self._client_info, request_id=request_id)
+
+        # Slow commands go to the workers
+        if self.__is_offloaded(command, arguments):
+            future = self.__submit_command(command, arguments, data)
+
+            # Responses with id are matched by it, the next requests do not wait for them
+            if request_id is not None:
+                future.add_done_callback(lambda result: self.__send_command_result(command, result, data))
+                return None
+
+            # Matched by order, answer before the next request
+            return self.__wait_command_result(command, future, data)
+
+        socket_obj = self._client_info["socket"]
+
+        # Whole files / database waits / slow commands without workers would hold the loop
+        if type(socket_obj) == c_async_socket and (command in ASYNC_BLOCKING_COMMANDS or command in EXECUTOR_COMMANDS):
+            return socket_obj.loop.run_in_executor(None, self.__handle_blocking, command, arguments, data)
+
+        self.__handle_inline(command, arguments, data)
+
+        # The framing answer went out in the old mode, switch after it
+        if command == FRAMING_CMD:
+            self.__handle_framing(arguments)
+
+        return None
+
+    def __handle_blocking(self, command: str, arguments: list, data: dict):
+        """
+            Run inline request on a thread of the asyncio engine.
+            The stream lock keeps the job frames out of the file data
+        """
+
+        with self._client_info["socket"].lock:
+            self.__handle_inline(command, arguments, data)
+
+    def __handle_inline(self, command: str, arguments: list, data: dict):
+        """
+            Respond to request on the connection handle
+        """
+
+        # Inline requests own the socket until answered (photo data is sent by the handler)
+        with self._client_info["send_lock"]:
+
+            # Prepare a response message and the login result
+            response_msg, result = self._protocols.handle_request(command, arguments, data)
+
+            # Check if the client is not logged in and tried to log in
+            if not self._client_info["logged_in"] and result is not None:
 
                 # Run handle login to check if the client logged in
-                self._client_info["logged_in"] = self.__handle_login(response_msg, arguments)
+                self._client_info["logged_in"] = self.__handle_login(result, arguments)
 
             # Check if response is valid
             if response_msg is not None:
@@ -100,26 +633,102 @@ class c_client_handle:
                 write_to_log(f"  Server        - send to client : {response_msg}")
 
                 # Send the response
-                self._client_info["socket"].send(response_msg.encode())
+                self._client_info["socket"].sendall(response_msg)
 
-        # Close connection
-        self.close_connection()
+    def __is_offloaded(self, command: str, arguments: list) -> bool:
+        """
+            Should the command run on the workers
+        """
+
+        if self._executor is None or arguments is None:
+            return False
 
-    def __handle_requests(self) -> (str, str):
+        return self._executor.is_offloaded(command) and self._protocols.get_handler(command) is not None
+
+    def __submit_command(self, command: str, arguments: list, data: dict) -> Future:
         """
-            Handle client's requests.
-            Returns ready command and arguments.
+            Submit the command handler to the executor.
+
+            Return future of the response
         """
 
-        # Pop from buffer raw-data
-        result, message = c_protocol.get_raw_from_buffer(self._client_info["socket"])
+        handler = self._protocols.get_handler(command)
 
-        # Check if valid
-        if not result:
-            return None, None
+        if self._executor.pool_type(command) == EXECUTOR_PROCESS:
+
+            # Only the arguments can travel to other process
+            future = self._executor.submit(command, run_command_handler, handler, arguments)
+
+        else:
+            future = self._executor.submit(command, handler, dict(data, arguments=arguments))
+
+        return future
+
+    def __wait_command_result(self, command: str, future: Future, data: dict) -> any:
+        """
+            Wait for command that runs on the workers and send its response.
+
+            Return awaitable on the asyncio engine, the loop is not blocked
+        """
+
+        if type(self._client_info["socket"]) == c_async_socket:
+            return self.__async_wait_command_result(command, future, data)
+
+        concurrent.futures.wait([future])
+        self.__send_command_result(command, future, data)
+
+        return None
+
+    async def __async_wait_command_result(self, command: str, future: Future, data: dict):
+
+        # Does not raise, failures are answered by the result sender
+        await asyncio.wait([asyncio.wrap_future(future)])
+
+        self.__send_command_result(command, future, data)
+
+    def __send_command_result(self, command: str, future: Future, data: dict):
+        """
+            Send the response of command that ran on the workers
+        """
+
+        try:
+
+            if future.cancelled():
+                return
+
+            exception = future.exception()
+            if exception is not None:
+                response = f"Failed to run {command}"
+
+                write_to_log(f"  Server        - {command} failed on the workers : {exception}")
+            else:
+                response = future.result()
+
+            # Ignore current response
+            if response is None or not self._client_info["connected"]:
+                return
+
+            response_msg = c_protocol.format_frame(response, data)
+
+            # Log response
+            write_to_log(f"  Server        - send to client : {response_msg}")
+
+            with self._client_info["send_lock"]:
+                self._client_info["socket"].sendall(response_msg)
+
+        except Exception as e:
+
+            # Client is already gone
+            write_to_log(f"  Server        - failed to send {command} result : {e}")
+
+    def __handle_requests(self, message: str) -> (str, str):
+        """
+            Handle client's requests.
+            Returns ready command and arguments.
+        """
 
         # Try to decrypt if can
-        message = c_encryption(self._client_info).decrypt(message).decode()
+        message = c_protocol.decrypt_value(message, self._client_info)
 
         # Parse to command and arguments
         command, arguments = c_protocol.parse(message)
@@ -136,24 +745,18 @@ class c_client_handle:
         # Return ready command and arguments
         return command, arguments
 
-    def __handle_login(self, response, arguments) -> bool:
+    def __handle_login(self, result: dict, arguments) -> bool:
         """
             Handle client's login result.
             Return if the client logged in/registered.
         """
 
-        # Get database protocol ptr
-        database_protocol: c_protocol_db = self._protocols("database")
-
-        # Check if the last register / login was Successful.
-        if not database_protocol("last_success"):
+        # Check if the register / login was Successful.
+        if not result["success"]:
             return False
 
-        # Just extract information
-        _, raw_args = c_protocol.parse(response)
-
         # Save the encryption key and username
-        self._client_info["key"] = database_protocol("last_key")
+        self._client_info["key"] = result["key"]
         self._client_info["username"] = arguments[0]
 
         # Prepare and call log in event
@@ -163,6 +766,24 @@ class c_client_handle:
 
         return True
 
+    def __handle_framing(self, arguments):
+        """
+            Handle client's frame mode negotiation.
+            Switch the connection codec to the agreed mode
+        """
+
+        mode = c_protocol_manager.select_frame_mode(arguments)
+        compression = c_protocol_manager.select_compression(mode, arguments)
+
+        self._client_info["codec"] = c_frame_codec(mode, compression)
+
+        # The next frames are read in the new mode
+        reader = utils.extract(self._client_info, "reader")
+        if reader is not None:
+            reader.codec = self._client_info["codec"]
+
+        write_to_log(f"  Server        - {self._client_info['username']} uses {mode} frames, compression : {compression}")
+
     def close_connection(self):
         """
             Handle close connection process
@@ -198,7 +819,7 @@ class c_client_handle:
             return False
 
         # Send message
-        self._client_info["socket"].send(call_for_disconnect.encode())
+        self._client_info["socket"].send(call_for_disconnect)
 
         return True
 
@@ -282,15 +903,24 @@ class c_server_bl:
             "last_error": "",
             "success": False,
 
-            "running": False
+            "running": False,
+
+            "engine": SERVER_ENGINE_THREAD,
+
+            # File transfer settings for every client
+            "chunk_size": TRANSFER_CHUNK_SIZE,
+            "adaptive_chunks": False
         }
 
         # Server socket object
         self._server_socket = None
 
-        # Protocols manager
+        # Protocols manager, built once and shared by every client handle
         self._protocols = c_protocol_manager()
 
+        # Slow commands executor, shared by every client handle
+        self._executor: c_command_executor = None
+
         # Events handler
         self._events = {
             "server_receive": c_event(),     # General receive event
@@ -304,17 +934,48 @@ class c_server_bl:
 
     #  region Server Setup
 
-    def setup_server(self, ip: str, port: int):
+    def setup_server(self, ip: str, port: int, engine: str = SERVER_ENGINE_THREAD,
+                     chunk_size: int = TRANSFER_CHUNK_SIZE, adaptive_chunks: bool = False,
+                     workers: int = EXECUTOR_THREADS, processes: int = EXECUTOR_PROCESSES,
+                     command_limits: dict = None, register_latency: float = None):
         """
             Setup server business layer
+
+            engine : SERVER_ENGINE_THREAD - thread per client
+                     SERVER_ENGINE_ASYNC  - every client on one event loop
+
+            chunk_size      : file transfer chunk size of every client
+            adaptive_chunks : grow the chunk size based on measured throughput
+
+            workers        : worker threads for I/O bound commands
+            processes      : worker processes for CPU bound commands
+            command_limits : command -> (EXECUTOR_THREAD / EXECUTOR_PROCESS, limit),
+                             None uses EXECUTOR_COMMANDS. Empty dict runs everything inline.
+                             Commands in EXECUTOR_CONNECTION_COMMANDS can not use EXECUTOR_PROCESS
+
+            register_latency : seconds a registration waits for others to share its commit,
+                               None uses REGISTER_MAX_LATENCY
         """
 
         write_to_log(f"  Server        - Server starting up")
 
         try:
+            if engine != SERVER_ENGINE_THREAD and engine != SERVER_ENGINE_ASYNC:
+                raise Exception(f"Invalid server engine {engine}")
+
             # Preallocate important information
             self._server_info["ip"] = ip
             self._server_info["port"] = port
+            self._server_info["engine"] = engine
+            self._server_info["chunk_size"] = chunk_size
+            self._server_info["adaptive_chunks"] = adaptive_chunks
+
+            # Slow commands run on the workers
+            self._executor = c_command_executor(workers, processes, command_limits)
+
+            # Group commit window of the database protocol, loaded on the first command
+            if register_latency is not None:
+                self._protocols.configure_protocol("database", register_latency=register_latency)
 
             # Setup server socket
             self._server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -341,6 +1002,10 @@ class c_server_bl:
             Start server process
         """
 
+        # Run the event loop engine instead
+        if self._server_info["engine"] == SERVER_ENGINE_ASYNC:
+            return self.__start_async_server()
+
         try:
 
             # Update running flag
@@ -371,6 +1036,72 @@ class c_server_bl:
             write_to_log(f"  Server        - error occurred in the server connection process {e}")
             self._server_info["last_error"] = f"An error occurred in server bl [server_process function]\nError : {e}"
 
+    def __start_async_server(self):
+        """
+            Start server process on the asyncio engine.
+
+            Blocks until the server is stopped, same as the thread engine
+        """
+
+        try:
+
+            # Update running flag
+            self._server_info["running"] = True
+
+            asyncio.run(self.__async_server_process())
+
+        except Exception as e:
+
+            # Stop the server
+            self.stop_server()
+
+            write_to_log(f"  Server        - error occurred in the async server process {e}")
+            self._server_info["last_error"] = f"An error occurred in server bl [async_server_process function]\nError : {e}"
+
+    async def __async_server_process(self):
+        """
+            Event loop server process.
+            Every client is multiplexed on this loop
+        """
+
+        # Blocking inline commands run here, enough threads for the registrations to share commits
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=ASYNC_BLOCKING_THREADS, thread_name_prefix="async blocking"))
+
+        server = await asyncio.start_server(self.__on_async_client_connect,
+                                            sock=self._server_socket,
+                                            backlog=ASYNC_ACCEPT_BACKLOG)
+
+        write_to_log(f"  Server        - listening on {self._server_info['ip']} (asyncio)")
+
+        # Work until shutdown
+        while self._server_info["running"]:
+            await asyncio.sleep(0.5)
+
+        # Stop accepting
+        server.close()
+
+        # Stop the remaining handles
+        for client in list(self._clients):
+            task = client("task")
+
+            if task is not None:
+                task.cancel()
+
+        await asyncio.sleep(0)
+
+    async def __on_async_client_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+            Accept callback for the asyncio engine
+        """
+
+        socket_obj = c_async_socket(reader, writer, asyncio.get_running_loop())
+
+        # Prepare and call client connect event
+        self._events["client_connect"] + ("address", writer.get_extra_info("peername")[:2])
+        self._events["client_connect"] + ("socket", socket_obj)
+        self._events["client_connect"]()
+
     def stop_server(self):
         """
             Stop server process
@@ -385,10 +1116,15 @@ class c_server_bl:
         for client in self._clients:
             client.force_disconnect()
 
-        # Close server socket
-        if self._server_socket is not None:
+        # Close server socket,
+        # on the asyncio engine the event loop closes it on shutdown
+        if self._server_socket is not None and self._server_info["engine"] == SERVER_ENGINE_THREAD:
             self._server_socket.close()
 
+        # Stop the workers
+        if self._executor is not None:
+            self._executor.shutdown()
+
         # Delete it
         self._server_socket = None
 
@@ -403,8 +1139,8 @@ class c_server_bl:
             Client connect event
         """
 
-        # Create new client handle
-        new_client = c_client_handle()
+        # Create new client handle, every handle shares the server protocol manager and executor
+        new_client = c_client_handle(self._protocols, self._executor)
 
         # Add client handle to list
         self._clients.append(new_client)
@@ -412,6 +1148,9 @@ class c_server_bl:
         # Save current client index in the list
         new_client + ("client_index", self._clients.index(new_client))
 
+        # Every connection tunes its own transfers
+        new_client + ("tuner", c_transfer_tuner(self._server_info["chunk_size"], self._server_info["adaptive_chunks"]))
+
         # Register callback functions
         new_client("disconnect") + (self.__on_event_client_disconnect, "bl_client_disconnect", True)
         new_client("receive") + (self.__on_event_server_receive, "bl_server_receive", True)
@@ -425,13 +1164,17 @@ class c_server_bl:
             Client disconnect event
         """
 
-        # Get client Index
-        index = event("index")
+        # Get client address
+        client_addr = event("client_addr")
 
-        self._events["client_disconnect"] + ("client_addr", event("client_addr"))
+        self._events["client_disconnect"] + ("client_addr", client_addr)
         self._events["client_disconnect"]()
 
-        del self._clients[index]
+        # Indexes shift once clients leave, so find the handle by its address
+        for client in self._clients:
+            if client == client_addr:
+                self._clients.remove(client)
+                break
 
     def __on_event_client_logs_in(self, event):
         """
@@ -516,6 +1259,12 @@ class c_server_bl:
         if index in self._events:
             return self._events[index]
 
+        if index == "executor_stats":
+            return self._executor.stats() if self._executor is not None else {}
+
+        if index == "compression_stats":
+            return COMPRESSION_STATS.get()
+
         return utils.extract(self._server_info, index)
 
     #  endregion
@@ -14,6 +14,13 @@ from tkinter import messagebox
 #  endregion
 
 
+#  region @ Constants
+
+XOR_BLOCK_SIZE: int = 64 * 1024     # Bytes XORed at once, small enough to stay in cache
+
+#  endregion
+
+
 #  region @ Utils Handle
 
 class utils:
@@ -98,6 +105,10 @@ class c_encryption:
 
         self._key = None
 
+        # Key repeated over one block, as integer
+        self._block_key: int = 0
+        self._block_size: int = 0
+
         if type(key) == dict:
             # Try to find the key
             key = utils.find_key(key)
@@ -110,47 +121,109 @@ class c_encryption:
         except Exception:
             self._key = key.encode()
 
-    def encrypt(self, message: any) -> bytes:
+        if len(self._key) == 0:
+            return
+
+        # Block must hold whole keys so every block starts at key offset 0
+        key_count = max(1, XOR_BLOCK_SIZE // len(self._key))
+
+        self._block_size = key_count * len(self._key)
+        self._block_key = int.from_bytes(self._key * key_count, "little")
+
+    def encrypt(self, message: any, offset: int = 0) -> bytes:
         """
             Encrypt the message (string / bytes)
 
+            offset - position of the message in a longer stream
+
             Return encrypted bytes
         """
 
         if type(message) == str:
-            return self.encrypt(message.encode())
+            return self.encrypt(message.encode(), offset)
 
         if self._key is None:
             return message
 
-        encrypted_bytes = []
+        return self.__xor(message, offset)
 
-        for i in range(len(message)):
-            # Perform XOR operation for each character and key byte
-            encrypted_bytes.append(message[i] ^ self._key[i % len(self._key)])
-
-        return bytes(encrypted_bytes)
-
-    def decrypt(self, message: any) -> bytes:
+    def decrypt(self, message: any, offset: int = 0) -> bytes:
         """
             Decrypts the message (string / bytes)
 
+            offset - position of the message in a longer stream
+
             Return decrypted bytes
         """
 
         if type(message) == str:
-            return self.decrypt(message.encode())
+            return self.decrypt(message.encode(), offset)
 
         if self._key is None:
             return message
 
-        decrypted_bytes = []
+        return self.__xor(message, offset)
+
+    def stream(self, offset: int = 0) -> any:
+        """
+            Create streaming encryptor for chunked data
+        """
+
+        return c_encryption_stream(self, offset)
+
+    def __xor(self, message: any, offset: int = 0) -> bytes:
+        """
+            XOR the whole message against the repeated key.
+
+            Every block and the repeated key are turned into big integers,
+            so the XOR runs word by word in C instead of byte by byte in python
+        """
+
+        # Nothing to XOR with, same as having no key
+        if len(self._key) == 0:
+            return bytes(message)
+
+        size = len(message)
+        key_offset = offset % len(self._key)
+
+        if size <= self._block_size and key_offset == 0:
+            return self.__xor_block(message)
+
+        result = bytearray(size)
+        view = memoryview(message)
+
+        # Bytes until the key starts over, done one by one
+        head = 0
+        if key_offset != 0:
+            head = min(size, len(self._key) - key_offset)
 
-        for i in range(len(message)):
-            # Perform XOR operation for each byte and key byte
-            decrypted_bytes.append(message[i] ^ self._key[i % len(self._key)])
+            for i in range(head):
+                result[i] = view[i] ^ self._key[key_offset + i]
 
-        return bytes(decrypted_bytes)
+        for start in range(head, size, self._block_size):
+            block = view[start:start + self._block_size]
+            result[start:start + len(block)] = self.__xor_block(block)
+
+        return bytes(result)
+
+    def __xor_block(self, block: any) -> bytes:
+        """
+            XOR up to one block, starting at key offset 0
+        """
+
+        size = len(block)
+        if size == 0:
+            return b''
+
+        block_key = self._block_key
+
+        # Last block is shorter, cut the repeated key
+        if size < self._block_size:
+            block_key = block_key & ((1 << (size * 8)) - 1)
+
+        value = int.from_bytes(block, "little") ^ block_key
+
+        return value.to_bytes(size, "little")
 
     @staticmethod
     def random_key(key_length: int = 16) -> str:
@@ -179,6 +252,41 @@ class c_encryption:
 #  endregion
 
 
+#  region @ Xor Encryption Stream Class
+
+class c_encryption_stream:
+    """
+        Streaming XOR Encryption Class.
+
+        Keeps the key offset across chunks, so chunked data
+        gives the same bytes as encrypting it at once
+    """
+
+    def __init__(self, encryption: c_encryption, offset: int = 0):
+
+        self._encryption = encryption
+        self._offset: int = offset
+
+    def update(self, chunk: any) -> bytes:
+        """
+            Encrypt / Decrypt the next chunk
+        """
+
+        result = self._encryption.encrypt(chunk, self._offset)
+        self._offset += len(chunk)
+
+        return result
+
+    def __call__(self, index: str) -> any:
+
+        if index == "offset":
+            return self._offset
+
+        return None
+
+#  endregion
+
+
 #  region @ Events Classes and Handles
 
 class c_event: